@@ -11,14 +11,23 @@
 # DYK+ team, United Kingdom, www.dykteam.com
 #
 
-import csv
+import os
+from contextlib import nullcontext
 import numpy as np
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import tkinter as tk
+from tkinter import ttk
+
+from bhloop import (ALIGNMENT_MODES, FIT_METHODS, GROUND_METHODS, INTEGRATION_MODES, plot_sinusoid_fit,
+                    plot_smoothed_loop, write_signal_parameters, write_smoothed_loop)
+from bhloop.batch import output_paths
+from bhloop.jobs import JobWorker, uncancellable
+from bhloop.profiling import Profiler, format_breakdown, stage
+from bhloop.realtime import AcquisitionPipeline, FileReplaySource, open_live_window
+from bhloop.store import ResultStore, result_record
+from bhloop.tuning import TuningSession, open_tuning_window
 
 # Default input parameter values
-pi = np.pi  # pi-constant 3.1415....
 default_B_scale = 1.0  # This scale depends on the measurement units (V or mV) and the wire length and diameter
 default_H_scale = 1.0  # This scale depends on the measurement units (V or mV) and the wire length and diameter
 default_window_size = 3  # Moving Average Window. You can change from the GUI window.
@@ -26,385 +35,396 @@ default_window_size = 3  # Moving Average Window. You can change from the GUI wi
 # or reverse (groundr) branches of the hysteresis loop
 default_groundf = 0.0
 default_groundr = 0.0
-
-# Function to run the code with the entered parameters
-def run_code():
-    directory_path = directory_path_entry.get()  # Copy and paste the directory path to the GUI window
-    name = name_entry.get()  # Enter the file name without the CSV extension to the GUI window (e.g. 50kHz)
-    time_increment = float(time_increment_entry.get())  # Enter the time increment (s) to the GUI window
-    B_scale = float(B_scale_entry.get())
-    H_scale = float(H_scale_entry.get())
-    groundf = float(groundf_entry.get())
-    groundr = float(groundr_entry.get())
-    window_size = int(window_size_entry.get())
-
+# Ground offsets: 'manual' (the values above), or estimated from the record by the loop 'closure' or by least
+# squares over the full 'periods'; the estimated offsets are printed and saved to signal_parameters.txt
+default_ground_method = 'manual'
+# Integration mode: 'trapezoid' (cumulative trapezoid integral) or 'legacy' (numbers of the old nested loops)
+default_integration_mode = 'trapezoid'
+# Sinusoid fitting method: 'fft' (FFT peak and least squares) or 'curve_fit' (vertex search and scipy curve_fit)
+default_fit_method = 'fft'
+# Alignment of the branches: 'sample' (branches start at the samples nearest below t1 and t2) or 'subsample' (the
+# response is interpolated so that both branches start exactly at t1 and t2 and have the same length)
+default_alignment = 'sample'
+# Number of points of the H grid the smoothed loop is resampled onto (0: the smoothed samples are kept)
+default_grid_points = 0
+# Averaging the loop over all full periods of the record instead of a single t1-t3 window
+default_all_periods = False
+# Profiling: stage times, peak memory and counters are saved to profile.json (and printed) when "Profile stages" is
+# ticked; with default_cprofile = True a cProfile dump profile.prof is saved as well
+default_profile = False
+default_cprofile = False
+# Result store (see bhloop/store.py) to which every run is appended, e.g. 'results.bhstore'; '' for none
+default_store = ''
+# Live replay: acquisition rate of the replayed frames and the display frame rate (frames/s)
+default_replay_rate = 20.0
+default_display_fps = 20.0
+# Interval (ms) at which the window checks the progress of the background runs, and the number of recent runs listed
+default_poll_interval = 50
+default_job_list_size = 8
+
+# Cache of the processing stages: repeated runs with changed scales, ground offsets or window only recompute the
+# stages after the changed parameter
+session = TuningSession()
+
+# Function to read the parameters entered into the GUI window. Several file names separated by commas give one run
+# per file. The fields are read in the Tk thread; the runs are then processed by process_run.
+def read_runs(entries):
+    directory_path = entries['directory_path'].get()  # Copy and paste the directory path to the GUI window
+    names = entries['name'].get()  # Enter the file name without the CSV extension to the GUI window (e.g. 50kHz)
+    parameters = {
+        'directory_path': directory_path,
+        'time_increment': float(entries['time_increment'].get()),  # Enter the time increment (s) to the GUI window
+        'B_scale': float(entries['B_scale'].get()),
+        'H_scale': float(entries['H_scale'].get()),
+        'groundf': float(entries['groundf'].get()),
+        'groundr': float(entries['groundr'].get()),
+        'window_size': int(entries['window_size'].get()),
+        'integration_mode': entries['integration_mode'].get(),
+        'all_periods': entries['all_periods'].get(),
+        'fit_method': entries['fit_method'].get(),
+        'profile': entries['profile'].get(),
+        'ground_method': entries['ground_method'].get(),
+        'alignment': entries['alignment'].get(),
+        'grid_points': int(entries['grid_points'].get()),
+    }
+    return [dict(parameters, name=name.strip()) for name in names.split(',') if name.strip()]
+
+# Function to process one run: all calculations are done by the bhloop package (through the stage cache); this
+# function prints the parameters and saves the results and the plots. It runs in the background worker of the GUI
+# (or directly from run_code) and does not touch the Tk window. Returns the result and the excitation values.
+# The output files are prefixed with the file name (e.g. 50kHz_signal_parameters.txt), so the runs of several
+# queued files do not overwrite each other.
+def process_run(name, directory_path, time_increment, B_scale, H_scale, groundf, groundr, window_size,
+                integration_mode, all_periods, fit_method, profile, ground_method, alignment, grid_points):
     # Full file name, including the directory path and the csv extension
-    file_name = directory_path + '\\' +name + '.csv'
-
-    # Data from the CSV file (two columns without header)
-    data = np.genfromtxt(file_name, delimiter=',')
-    response_values = data[:, 0]  # First column: response values which are proportional to the induction B
-    sin_values = data[:, 1]  # Second column: sinusoid values which are proportional to the scanning magnetic field H
-    N = len(sin_values)  # Number of points in each column
-
-    # Time values based on the time increment
-    time = np.arange(0, N * time_increment, time_increment)
-
-    # Estimation for the sinusoid amplitude
-    A0 = np.max(sin_values)
-
-    # Scenarios for selecting sine wave vertices
-    scenario = 1 if sin_values[0] >= 0 else 2
-
-    # Skipping initial values until the sinusoid changes sign. After this, the search for vertices begins.
-    i = 0
-    while i <= N - 1 and ((scenario == 1 and sin_values[i] >= 0) or (scenario == 2 and sin_values[i] <= 0)):
-        i += 1
-    start = i  # Start index
-
-    # Searching for the indices of the first positive and negative sinusoid vertices
-
-    # Set of indices near the positive vertex of the sinusoid
-    def pset(start, y_values):
-        positive_set = []
-        i = start
-        while y_values[i] <= A0 * 0.9:
-            i += 1
-        while i <= N - 1 and y_values[i] >= 0:
-            if A0 * 0.9 <= y_values[i] <= A0:
-                positive_set.append(i)
-            i += 1
-        stop = i
-        return np.array(positive_set), stop
-
-    # Set of indices near the negative vertex of the sinusoid
-    def nset(start, y_values):
-        negative_set = []
-        i = start
-        while y_values[i] >= -A0 * 0.9:
-            i += 1
-        while i <= N - 1 and y_values[i] <= 0:
-            if -A0 <= y_values[i] <= -A0 * 0.9:
-                negative_set.append(i)
-            i += 1
-        stop = i
-        return np.array(negative_set), stop
-
-    if scenario == 1:
-        negative_set, stop = nset(start, sin_values)
-        print('stop = ', stop)
-        positive_set = pset(stop, sin_values)[0]
-    elif scenario == 2:
-        positive_set, stop = pset(start, sin_values)
-        negative_set = nset(stop, sin_values)[0]
-
-    # Average indices for the found sets of the negative and positive sinusoid vertices
-    positive_set_aver = float(sum(positive_set) / len(positive_set))
-    negative_set_aver = float(sum(negative_set) / len(negative_set))
-
-    # Integer indices for the found negative and positive sinusoid vertices
-    pvertex = int(positive_set_aver)
-    nvertex = int(negative_set_aver)
-
-    # Estimations of the period (T0) and frequency (f0) of the sinusoid
-    T0 = abs(positive_set_aver - negative_set_aver) * time_increment * 2
-    f0 = 1 / T0
-
-    # Improving A0: average amplitude of the sinusoid calculated from two vertices
-    A0 = (sin_values[pvertex] - sin_values[nvertex]) / 2.0
-
-    # Estimation of the sinusoid phase (ph0) in radians
-    # Only positive phase will be used (anticlockwise rotation)
-    qT = int(abs(pvertex - nvertex) / 2)  # Index difference for the quarter period
-    value = max(-1.0, min(sin_values[0] / A0, 1.0))  # Normalising the zero-index value and clamping it to [-1, 1]
-    phase = np.arcsin(value)  # Phase calculated from the arcsin function in the range [-pi/2, pi/2]
-    if scenario == 1:  # First scenario sin_values[0] >= 0
-        if sin_values[qT] >= 0:
-            ph0 = phase  # First quarter
-        else:
-            ph0 = pi - phase  # Second quarter
-    else:  # Second scenario sin_values[0] <= 0
-        if sin_values[qT] <= 0:
-            ph0 = pi - phase  # Third quarter
-        else:
-            ph0 = 2.0 * pi + phase  # Fourth quarter
-
-    print('Estimated amplitude = ', A0)
-    print('Estimated frequency = ', f0, ' Hz')
-    print('Estimated phase = ', ph0, ' rads')
-    print('Estimated phase = ', np.degrees(ph0), ' degrees')
-
-    # Sinusoidal function used in the fitting
-    def sinusoid(t, A, f, phase):
-        return A * np.sin(2 * pi * f * t + phase)
-
-    # Fitting the data (second column) to the sinusoid
-    params, covariance = curve_fit(sinusoid, time, sin_values, p0=[A0, f0, ph0])  # [A0, f0, ph0] - initial values
-
-    # Extracted fitting parameters
-    A_fit, f_fit, ph_fit = params
-
-    # Fitted sinusoid curve
-    sinusoid_fit = sinusoid(time, A_fit, f_fit, ph_fit)
-    ph_degrees = np.degrees(ph_fit)
+    file_name = os.path.join(directory_path, name + '.csv')
+    paths = output_paths(directory_path, name)
+
+    profiler = Profiler(memory=True, cprofile=default_cprofile) if profile else None
+    with profiler or nullcontext():
+        response_values, sin_values = session.load(file_name)[1]  # Parsed data are cached between runs
+        result = session.compute(file_name, time_increment, B_scale=B_scale, H_scale=H_scale, window=window_size,
+                                 groundf=groundf, groundr=groundr, integration_mode=integration_mode,
+                                 fit_method=fit_method, all_periods=all_periods, ground_method=ground_method,
+                                 alignment=alignment, grid_points=grid_points)
+
+        # Plot of the original data and the fitted curve, and the graph of the smoothed curves. The figures are
+        # created without pyplot, so they can be drawn in the background worker.
+        with stage('plot'):
+            fit_figure = Figure(figsize=(10, 6))
+            plot_sinusoid_fit(fit_figure.add_subplot(), sin_values, result)
+            loop_figure = Figure(figsize=(10, 6))
+            plot_smoothed_loop(loop_figure.add_subplot(), result)
+
+        # Writing the parameters to the txt file, the smoothed curves to the CSV file and the plots as images.
+        # A run cancelled from now on still writes all of them, so the files always belong to the same run.
+        with uncancellable():
+            write_signal_parameters(paths['parameters'], file_name, time_increment, B_scale, H_scale, result)
+            write_smoothed_loop(paths['loop'], result)
+            if default_store:
+                parameters = {'window': window_size, 'groundf': groundf, 'groundr': groundr,
+                              'integration_mode': integration_mode, 'fit_method': fit_method,
+                              'all_periods': all_periods, 'ground_method': ground_method, 'alignment': alignment,
+                              'grid_points': grid_points}
+                ResultStore(os.path.join(directory_path, default_store)).append(
+                    [result_record(result, file_name, time_increment, B_scale, H_scale, parameters)])
+            fit_figure.savefig(paths['fit_plot'])
+            loop_figure.savefig(paths['loop_plot'])
+
+    print('Estimated amplitude = ', result.A0)
+    print('Estimated frequency = ', result.f0, ' Hz')
+    print('Estimated phase = ', result.ph0, ' rads')
+    print('Estimated phase = ', np.degrees(result.ph0), ' degrees')
 
     print('')
-    print('Fitted amplitude = ', A_fit)
-    print('Fitted frequency = ', f_fit, ' Hz')
-    print('Fitted phase = ', ph_fit, ' rads')
-    print('Fitted phase = ', ph_degrees, ' degrees')
-
-    # Calculation of the reference time points t123 used in the numerical integration
-    if scenario == 1:  # First scenario sin_values[0] >= 0
-        t1 = (3.0 * pi / 2.0 - ph_fit) / (2.0 * pi * f_fit)
-        t2 = (5.0 * pi / 2.0 - ph_fit) / (2.0 * pi * f_fit)
-    else:  # Second scenario sin_values[0] <= 0
-        t1 = (5.0 * pi / 2.0 - ph_fit) / (2.0 * pi * f_fit)
-        t2 = (7.0 * pi / 2.0 - ph_fit) / (2.0 * pi * f_fit)
-    t3 = t2 + 0.5 / f_fit
+    print('Fitted amplitude = ', result.A_fit)
+    print('Fitted frequency = ', result.f_fit, ' Hz')
+    print('Fitted phase = ', result.ph_fit, ' rads')
+    print('Fitted phase = ', result.ph_degrees, ' degrees')
 
     print('')
-    print('Reference time t1 = ', t1, ' s')
-    print('Reference time t2 = ', t2, ' s')
-    print('Reference time t3 = ', t3, ' s')
-
-    # Indexes corresponding to the reference time moments
-    refindex1 = int(t1 / time_increment)
-    refindex2 = int(t2 / time_increment)
-    refindex3 = int(t3 / time_increment)
+    print('Reference time t1 = ', result.t1, ' s')
+    print('Reference time t2 = ', result.t2, ' s')
+    print('Reference time t3 = ', result.t3, ' s')
 
     print('')
-    print('Reference index 1 = ', refindex1)
-    print('Reference index 2 = ', refindex2)
-    print('Reference index 3 = ', refindex3)
-
-    # Writing the parameters to the txt file
-    with open(directory_path + '\\' + 'signal_parameters.txt', 'w') as file:
-        file.write('\n')
-        file.write('File name and directory {}\n'.format(file_name))
-        file.write('\n')
-        file.write('Time increment = {} s\n'.format(time_increment))
-        file.write('Fitted sinusoid amplitude = {} (your units)\n'.format(A_fit))
-        file.write('Fitted sinusoid frequency = {} Hz\n'.format(f_fit))
-        file.write('Fitted sinusoid phase = {} rads\n'.format(ph_fit))
-        file.write('Fitted sinusoid phase = {} degrees\n'.format(ph_degrees))
-        file.write('\n')
-        file.write('B-scale = {} \n'.format(B_scale))
-        file.write('H-scale = {} \n'.format(H_scale))
-        file.write('\n')
-        file.write('Reference time t1 = {} s \n'.format(t1))
-        file.write('Reference time t2 = {} s \n'.format(t2))
-        file.write('Reference time t3 = {} s \n'.format(t3))
-        file.write('\n')
-        file.write('Reference index 1 = {} \n'.format(refindex1))
-        file.write('Reference index 2 = {} \n'.format(refindex2))
-        file.write('Reference index 3 = {} \n'.format(refindex3))
-
-    # Plot the original data and the fitted curve
-    plt.figure(figsize=(10, 6))
-    plt.scatter(time, sin_values, label='Original Data', color='blue', marker='o')
-    plt.plot(time, sinusoid_fit, label='Fitted Sinusoid', color='red')
-
-    # Add vertical lines at t1, t2, and t3
-    plt.axvline(x=t1, color='green', linestyle='--', label='t1')
-    plt.axvline(x=t2, color='purple', linestyle='--', label='t2')
-    plt.axvline(x=t3, color='orange', linestyle='--', label='t3')
-
-    plt.xlabel('Time')
-    plt.ylabel('Amplitude')
-    plt.title('Sinusoidal Fit with Reference Points t1, t2, and t3')
-    plt.legend()
-    plt.grid(True)
-
-    # Saving the plot as an image
-    plt.savefig(directory_path + '\\' + 'sinusoid_fitting_reference_points.png')
-
-    plt.show()
-
-    # Forward integration of the voltage response between the reference indexes 1 and 2
-    B_forward = []
-    H_forward = []
-    integral_value = 0.0
-    for i in range(refindex1, refindex2):
-        H_forward.append(sinusoid_fit[i])  # Values taken from the fitting sinusoid
-        # H_forward.append(sin_values[i])  # Experimental values (old version)
-        for j in range(refindex1, i):
-            integral_value += 0.5 * (response_values[j] + response_values[j + 1]) * time_increment  # Trapezoid method
-            integral_value += - groundf * (j - refindex1 + 1) * time_increment  # ground offset compensation
-        B_forward.append(integral_value)
-
-    # Reverse integration of the voltage response between the reference indexes 2 and 3
-    B_reverse = []
-    H_reverse = []
-    integral_value = 0.0
-    for i in range(refindex2, refindex3):
-        H_reverse.append(sinusoid_fit[i])  # Values taken from the fitting sinusoid
-        # H_reverse.append(sin_values[i])  # Experimental values (old version)
-        for j in range(refindex2, i):
-            integral_value += 0.5 * (response_values[j] + response_values[j + 1]) * time_increment  # Trapezoid method
-            integral_value += - groundr * (j - refindex2 + 1) * time_increment  # ground offset compensation
-        B_reverse.append(integral_value)
-
-    # Rescaling the magnetic induction B and the field H from the data values
-    B_forward = np.array(B_forward) * B_scale
-    H_forward = -np.array(H_forward) * H_scale
-    lf = len(B_forward)  # Number of points in the forward BH curve
-    B_reverse = np.array(B_reverse) * B_scale
-    H_reverse = -np.array(H_reverse) * H_scale
-    lr = len(B_reverse)  # Number of points in the reverse BH curve
-
-    # Defining the concavity con_forward of the forward BH curve
-    # B = af + bf * H is the straight line between the forward BH curve ends
-    bf = (B_forward[lf - 1] - B_forward[0]) / (H_forward[lf - 1] - H_forward[0])
-    af = (B_forward[0] * H_forward[lf - 1] - B_forward[lf - 1] * H_forward[0]) / (H_forward[lf - 1] - H_forward[0])
-    # Direction of the concavity
-    if (af + bf * (H_forward[lf - 1] - H_forward[0]) / 2) >= B_forward[int(lf / 2)]:
-        con_forward = 'down'
-    else:
-        con_forward = 'up'
-
-    # Defining the concavity con_reverse of the reverse BH curve
-    # B = ar + br * H is the straight line between the reverse BH curve ends
-    br = (B_reverse[lr - 1] - B_reverse[0]) / (H_reverse[lr - 1] - H_reverse[0])
-    ar = (B_reverse[0] * H_reverse[lr - 1] - B_reverse[lr - 1] * H_reverse[0]) / (H_reverse[lr - 1] - H_reverse[0])
-    # Direction of the concavity
-    if (ar + br * (H_reverse[lr - 1] - H_reverse[0]) / 2) >= B_reverse[int(lr / 2)]:
-        con_reverse = 'down'
-    else:
-        con_reverse = 'up'
-
-     # Vertical shifts of the BH curves
-    if con_forward == 'up':
-        B_forward = B_forward + abs(B_forward[0] - B_forward[lf - 1]) / 2
-    else:
-        B_forward = B_forward - abs(B_forward[0] - B_forward[lf - 1]) / 2
+    print('Reference index 1 = ', result.refindex1)
+    print('Reference index 2 = ', result.refindex2)
+    print('Reference index 3 = ', result.refindex3)
 
-    if con_reverse == 'up':
-        B_reverse = B_reverse + abs(B_reverse[0] - B_reverse[lr - 1]) / 2
+    print('')
+    print('Ground offset (forward) = ', result.groundf)
+    print('Ground offset (reverse) = ', result.groundr)
+    if all_periods:
+        print('Number of averaged periods = ', result.n_periods)
+
+    if profile:
+        print('')
+        print(format_breakdown(profiler.report()))
+        profiler.write_json(paths['profile'])
+        if default_cprofile:
+            profiler.dump_cprofile(paths['cprofile'])
+    return result, sin_values
+
+# Function to run the code with the parameters entered into the GUI window, without the background worker
+def run_code(entries):
+    return [process_run(**run) for run in read_runs(entries)]
+
+# Function to queue the runs of the entered files in the background worker
+def submit_code(worker, entries):
+    for run in read_runs(entries):
+        worker.submit(run['name'], process_run, **run)
+
+# Function to draw the result of a finished run into the plots embedded in the main window
+def show_result(figure, canvas, result, sin_values):
+    fit_ax, loop_ax = figure.axes
+    fit_ax.clear()
+    loop_ax.clear()
+    plot_sinusoid_fit(fit_ax, sin_values, result)
+    plot_smoothed_loop(loop_ax, result)
+    figure.tight_layout()
+    canvas.draw_idle()
+
+# Function to update the progress bar, the job list and the plots with the jobs changed in the background worker.
+# It is called again from the Tk event loop every default_poll_interval ms.
+def poll_jobs(root, worker, widgets):
+    finished = None
+    for job in worker.poll():
+        if job.state == 'done' and job.result is not None:
+            finished = job
+        if job.state == 'failed':
+            print('Run {} failed: {}'.format(job.name, job.error))
+    if finished is not None:  # Only the latest result is drawn; the arrays are not kept for the whole session
+        show_result(widgets['figure'], widgets['canvas'], *finished.result)
+        finished.result = None
+
+    job_list = widgets['job_list']
+    job_list.delete(0, tk.END)
+    for job in worker.jobs[-default_job_list_size:]:
+        job_list.insert(tk.END, job.describe())
+    current = worker.current
+    if current is not None:
+        widgets['progress']['value'] = 100.0 * current.progress
+        widgets['status'].config(text=current.describe())
     else:
-        B_reverse = B_reverse - abs(B_reverse[0] - B_reverse[lr - 1]) / 2
-
-    # Function for computing the moving average
-    def moving_average(data, window_size):
-        cumsum = np.cumsum(data)
-        cumsum[window_size:] = cumsum[window_size:] - cumsum[:-window_size]
-        return cumsum[window_size - 1:] / window_size
-
-    # Smoothing the data using moving averages
-    # After smoothing, arrays may have different dimensions
-    B_forward_smoothed = moving_average(B_forward, window_size)
-    l0 = len(B_forward_smoothed)
-    H_forward_smoothed = moving_average(H_forward, window_size)
-    l1 = len(H_forward_smoothed)
-    B_reverse_smoothed = moving_average(B_reverse, window_size)
-    l2 = len(B_reverse_smoothed)
-    H_reverse_smoothed = moving_average(H_reverse, window_size)
-    l3 = len(H_reverse_smoothed)
-
-    min_length = min(l0, l1, l2, l3)  # minimum dimension of the arrays after smoothing
-
-    # Adjusting the dimension of the arrays after smoothing
-    if l0 > min_length:
-        B_forward_smoothed = B_forward_smoothed[:-(l0 - min_length)]
-
-    if l1 > min_length:
-        H_forward_smoothed = H_forward_smoothed[:-(l1 - min_length)]
-
-    if l2 > min_length:
-        H_reverse_smoothed = H_reverse_smoothed[:-(l2 - min_length)]
-
-    if l3 > min_length:
-        B_reverse_smoothed = B_reverse_smoothed[:-(l3 - min_length)]
-
-    # Creating the graph of smoothed curves
-    plt.figure(figsize=(10, 6))
-    plt.plot(H_forward_smoothed, B_forward_smoothed, label='Smoothed B_forward vs. H_forward', color='blue')
-    plt.plot(H_reverse_smoothed, B_reverse_smoothed, label='Smoothed B_reverse vs. H_reverse', color='red')
-    plt.xlabel('H (A/m)')
-    plt.ylabel('B (T)')
-    plt.title('Smoothed Magnetic Hysteresis Loop')
-    plt.legend()
-    plt.grid(True)
-
-    # Saving the data and smoothed curves to a CSV file
-    data = np.column_stack((H_forward_smoothed, B_forward_smoothed, H_reverse_smoothed, B_reverse_smoothed))
-    header = ['H_forward (A/m)', 'B_forward_smoothed (T)', 'H_reverse (A/m)', 'B_reverse_smoothed (T)']
-
-    with open(directory_path + '\\' + 'smoothed_hysteresis_data.csv', 'w', newline='') as csv_file:
-        writer = csv.writer(csv_file)
-        writer.writerow(header)
-        writer.writerows(data)
-
-    # Saving the plot as an image
-    plt.savefig(directory_path + '\\' + 'smoothed_hysteresis_plot.png')
-
-    plt.show()
-
-# Create a function to stop the code execution
-def stop_code():
-    quit()
-
-# Main GUI window
-root = tk.Tk()
-root.title("Input Parameters")
-
-# Labels and entry fields for input parameters
-directory_path_label = tk.Label(root, text="Directory Path:")
-directory_path_label.pack()
-directory_path_entry = tk.Entry(root)
-directory_path_entry.pack()
-
-name_label = tk.Label(root, text="File Name (w/o extension):")
-name_label.pack()
-name_entry = tk.Entry(root)
-name_entry.pack()
-
-time_increment_label = tk.Label(root, text="Time Increment (s):")
-time_increment_label.pack()
-time_increment_entry = tk.Entry(root)
-time_increment_entry.pack()
-
-B_scale_label = tk.Label(root, text="B-scale:")
-B_scale_label.pack()
-B_scale_entry = tk.Entry(root)
-B_scale_entry.insert(0, default_B_scale)  # Default value
-B_scale_entry.pack()
-
-H_scale_label = tk.Label(root, text="H-scale:")
-H_scale_label.pack()
-H_scale_entry = tk.Entry(root)
-H_scale_entry.insert(0, default_H_scale)  # Default value
-H_scale_entry.pack()
-
-window_size_label = tk.Label(root, text="Moving Aver. Window:")
-window_size_label.pack()
-window_size_entry = tk.Entry(root)
-window_size_entry.insert(0, default_window_size)  # Default value
-window_size_entry.pack()
-
-groundf_label = tk.Label(root, text="Ground offset (forward):")
-groundf_label.pack()
-groundf_entry = tk.Entry(root)
-groundf_entry.insert(0, default_groundf)  # Default value
-groundf_entry.pack()
-
-groundr_label = tk.Label(root, text="Ground offset (reverse):")
-groundr_label.pack()
-groundr_entry = tk.Entry(root)
-groundr_entry.insert(0, default_groundr)  # Default value
-groundr_entry.pack()
-
-# Frame to hold the buttons in one row
-button_frame = tk.Frame(root)
-button_frame.pack()
-
-# "Run Code" button with some padding to the right
-run_button = tk.Button(button_frame, text="Run Code", command=run_code)
-run_button.pack(side=tk.LEFT, padx=5)  # Adjust the padx value as needed
-
-# "Stop Code" button with some padding to the left
-stop_button = tk.Button(button_frame, text="Stop Code", command=stop_code)
-stop_button.pack(side=tk.LEFT, padx=5)  # Adjust the padx value as needed
-
-# Main event loop
-root.mainloop()
\ No newline at end of file
+        widgets['progress']['value'] = 0.0
+        widgets['status'].config(text='{} queued'.format(len(worker.pending())) if worker.pending() else 'Idle')
+    root.after(default_poll_interval, poll_jobs, root, worker, widgets)
+
+# Function to replay the selected file as a live acquisition. The frames are processed in a background thread and
+# the loop is redrawn in a separate window, so the input window stays responsive.
+def live_replay(root, entries):
+    directory_path = entries['directory_path'].get()
+    name = entries['name'].get()
+    time_increment = float(entries['time_increment'].get())
+
+    file_name = os.path.join(directory_path, name + '.csv')
+    source = FileReplaySource(file_name, time_increment, rate=default_replay_rate)
+    pipeline = AcquisitionPipeline(source, B_scale=float(entries['B_scale'].get()),
+                                   H_scale=float(entries['H_scale'].get()),
+                                   window=int(entries['window_size'].get()),
+                                   groundf=float(entries['groundf'].get()), groundr=float(entries['groundr'].get()),
+                                   integration_mode=entries['integration_mode'].get(),
+                                   fit_method=entries['fit_method'].get(), all_periods=entries['all_periods'].get(),
+                                   ground_method=entries['ground_method'].get(),
+                                   alignment=entries['alignment'].get(),
+                                   grid_points=int(entries['grid_points'].get()))
+    open_live_window(root, pipeline, fps=default_display_fps, title='Live BH-loop: ' + name)
+
+# Function to open the tuning window: the loop is redrawn on every move of the B-scale, H-scale, ground offset and
+# window sliders. The tuned values are copied back to the input fields when the tuning window is closed.
+def tune_code(root, entries):
+    directory_path = entries['directory_path'].get()
+    name = entries['name'].get()
+    time_increment = float(entries['time_increment'].get())
+    file_name = os.path.join(directory_path, name + '.csv')
+    parameters = {'B_scale': float(entries['B_scale'].get()), 'H_scale': float(entries['H_scale'].get()),
+                  'window': int(entries['window_size'].get()), 'groundf': float(entries['groundf'].get()),
+                  'groundr': float(entries['groundr'].get()), 'integration_mode': entries['integration_mode'].get(),
+                  'fit_method': entries['fit_method'].get(), 'ground_method': entries['ground_method'].get(),
+                  'alignment': entries['alignment'].get(), 'grid_points': int(entries['grid_points'].get())}
+    window = open_tuning_window(root, session, file_name, time_increment, parameters)
+
+    def close():
+        for name, key in (('B_scale', 'B_scale'), ('H_scale', 'H_scale'), ('window', 'window_size'),
+                          ('groundf', 'groundf'), ('groundr', 'groundr')):
+            entries[key].delete(0, tk.END)
+            entries[key].insert(0, parameters[name])
+        window.destroy()
+
+    window.protocol('WM_DELETE_WINDOW', close)
+
+# Function to stop the code execution: the running job is cancelled at its next stage and the queue is cleared
+def stop_code(worker):
+    worker.cancel_all()
+
+# Function to close the main window: the running job is cancelled and the worker is stopped
+def close_window(root, worker):
+    worker.stop()
+    root.destroy()
+
+
+# Main GUI window. Nothing is created on import, so the module can be imported without a display.
+def main():
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+    root = tk.Tk()
+    root.title("Input Parameters")
+
+    # Input fields on the left, progress of the runs and the plots of the latest result on the right
+    form = tk.Frame(root)
+    form.pack(side=tk.LEFT, fill=tk.Y, padx=5)
+    results = tk.Frame(root)
+    results.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    # Labels and entry fields for input parameters
+    directory_path_label = tk.Label(form, text="Directory Path:")
+    directory_path_label.pack()
+    directory_path_entry = tk.Entry(form)
+    directory_path_entry.pack()
+
+    name_label = tk.Label(form, text="File Name (w/o extension):")
+    name_label.pack()
+    name_entry = tk.Entry(form)
+    name_entry.pack()
+
+    time_increment_label = tk.Label(form, text="Time Increment (s):")
+    time_increment_label.pack()
+    time_increment_entry = tk.Entry(form)
+    time_increment_entry.pack()
+
+    B_scale_label = tk.Label(form, text="B-scale:")
+    B_scale_label.pack()
+    B_scale_entry = tk.Entry(form)
+    B_scale_entry.insert(0, default_B_scale)  # Default value
+    B_scale_entry.pack()
+
+    H_scale_label = tk.Label(form, text="H-scale:")
+    H_scale_label.pack()
+    H_scale_entry = tk.Entry(form)
+    H_scale_entry.insert(0, default_H_scale)  # Default value
+    H_scale_entry.pack()
+
+    window_size_label = tk.Label(form, text="Moving Aver. Window:")
+    window_size_label.pack()
+    window_size_entry = tk.Entry(form)
+    window_size_entry.insert(0, default_window_size)  # Default value
+    window_size_entry.pack()
+
+    groundf_label = tk.Label(form, text="Ground offset (forward):")
+    groundf_label.pack()
+    groundf_entry = tk.Entry(form)
+    groundf_entry.insert(0, default_groundf)  # Default value
+    groundf_entry.pack()
+
+    groundr_label = tk.Label(form, text="Ground offset (reverse):")
+    groundr_label.pack()
+    groundr_entry = tk.Entry(form)
+    groundr_entry.insert(0, default_groundr)  # Default value
+    groundr_entry.pack()
+
+    ground_method_label = tk.Label(form, text="Ground offsets:")
+    ground_method_label.pack()
+    ground_method_var = tk.StringVar(root, value=default_ground_method)
+    ground_method_menu = tk.OptionMenu(form, ground_method_var, *GROUND_METHODS)
+    ground_method_menu.pack()
+
+    integration_mode_label = tk.Label(form, text="Integration mode:")
+    integration_mode_label.pack()
+    integration_mode_var = tk.StringVar(root, value=default_integration_mode)
+    integration_mode_menu = tk.OptionMenu(form, integration_mode_var, *INTEGRATION_MODES)
+    integration_mode_menu.pack()
+
+    fit_method_label = tk.Label(form, text="Sinusoid fitting:")
+    fit_method_label.pack()
+    fit_method_var = tk.StringVar(root, value=default_fit_method)
+    fit_method_menu = tk.OptionMenu(form, fit_method_var, *FIT_METHODS)
+    fit_method_menu.pack()
+
+    alignment_label = tk.Label(form, text="Branch alignment:")
+    alignment_label.pack()
+    alignment_var = tk.StringVar(root, value=default_alignment)
+    alignment_menu = tk.OptionMenu(form, alignment_var, *ALIGNMENT_MODES)
+    alignment_menu.pack()
+
+    grid_points_label = tk.Label(form, text="H grid points (0 = off):")
+    grid_points_label.pack()
+    grid_points_entry = tk.Entry(form)
+    grid_points_entry.insert(0, default_grid_points)  # Default value
+    grid_points_entry.pack()
+
+    all_periods_var = tk.BooleanVar(root, value=default_all_periods)
+    all_periods_check = tk.Checkbutton(form, text="Average all periods", variable=all_periods_var)
+    all_periods_check.pack()
+
+    profile_var = tk.BooleanVar(root, value=default_profile)
+    profile_check = tk.Checkbutton(form, text="Profile stages", variable=profile_var)
+    profile_check.pack()
+
+    # Frame to hold the buttons in one row
+    button_frame = tk.Frame(form)
+    button_frame.pack()
+
+    # Input fields read by run_code
+    entries = {
+        'directory_path': directory_path_entry,
+        'name': name_entry,
+        'time_increment': time_increment_entry,
+        'B_scale': B_scale_entry,
+        'H_scale': H_scale_entry,
+        'window_size': window_size_entry,
+        'groundf': groundf_entry,
+        'groundr': groundr_entry,
+        'ground_method': ground_method_var,
+        'integration_mode': integration_mode_var,
+        'all_periods': all_periods_var,
+        'fit_method': fit_method_var,
+        'alignment': alignment_var,
+        'grid_points': grid_points_entry,
+        'profile': profile_var,
+    }
+
+    # Background worker processing the runs one after another, so the window stays responsive
+    worker = JobWorker()
+
+    # "Run Code" button (queues a run for every entered file) with some padding to the right
+    run_button = tk.Button(button_frame, text="Run Code", command=lambda: submit_code(worker, entries))
+    run_button.pack(side=tk.LEFT, padx=5)  # Adjust the padx value as needed
+
+    # "Tune" button opening the sliders for the scales, ground offsets and window
+    tune_button = tk.Button(button_frame, text="Tune", command=lambda: tune_code(root, entries))
+    tune_button.pack(side=tk.LEFT, padx=5)
+
+    # "Live Replay" button replaying the file as a live acquisition
+    live_button = tk.Button(button_frame, text="Live Replay", command=lambda: live_replay(root, entries))
+    live_button.pack(side=tk.LEFT, padx=5)
+
+    # "Stop Code" button (cancels the running and queued runs) with some padding to the left
+    stop_button = tk.Button(button_frame, text="Stop Code", command=lambda: stop_code(worker))
+    stop_button.pack(side=tk.LEFT, padx=5)  # Adjust the padx value as needed
+
+    # Progress of the running job, its stage and the list of recent runs
+    progress = ttk.Progressbar(results, maximum=100.0)
+    progress.pack(fill=tk.X, padx=5, pady=5)
+    status = tk.Label(results, text='Idle', anchor=tk.W)
+    status.pack(fill=tk.X, padx=5)
+    job_list = tk.Listbox(results, height=default_job_list_size)
+    job_list.pack(fill=tk.X, padx=5)
+
+    # Plots of the latest result: the fitted sinusoid with the reference points and the smoothed loop
+    figure = Figure(figsize=(10, 8))
+    figure.add_subplot(2, 1, 1)
+    figure.add_subplot(2, 1, 2)
+    canvas = FigureCanvasTkAgg(figure, master=results)
+    canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+
+    widgets = {'progress': progress, 'status': status, 'job_list': job_list, 'figure': figure, 'canvas': canvas}
+    root.after(default_poll_interval, poll_jobs, root, worker, widgets)
+    root.protocol('WM_DELETE_WINDOW', lambda: close_window(root, worker))
+
+    # Main event loop
+    root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,28 +11,76 @@
 # DYK+ team, United Kingdom, www.dykteam.com
 #
 
+import time
 import tkinter as tk
 from PIL import Image, ImageTk
 
+from Wheatstone_sweep import E_SERIES, bridge_ratios, format_table, sweep_bridge
+
 def calculate():
     R0 = float(R0_entry.get())
     R1 = float(R1_entry.get())
     R3 = float(R3_entry.get())
     Rw = float(Rw_entry.get())
 
-    # Calculate R2 that provides the balance of the bridge circuit
-    R2 = R1 * Rw / R3
-
-    # Calculate VM / Vout
-    VM_Vout = (R3 + Rw) / R3
-
-    # Calculate Vw / V0
-    Vw_V0 = ((R1 + R2) * Rw) / (R0 * (R1 + R2 + R3 + Rw) + (R1 + R2) * (R3 + Rw))
+    # Calculate R2 that provides the balance of the bridge circuit, VM / Vout and Vw / V0
+    R2, VM_Vout, Vw_V0 = bridge_ratios(R0, R1, R3, Rw)
 
     # Update the equation label with the calculated R2 value and the value for VM / Vout and Vw / V0
     equation_label.config(text=f"R2 = Rw x R1 / R3 = {R2:.3f} Ohms\n\nVM / Vout = (R3 + Rw) / R3 = {VM_Vout:.3f}"
                                f"\n\nVw / V0 = {Vw_V0:.3f}")
 
+# Function to open the sweep window: each resistor is given as a value, a list (47, 68, 100), a range
+# (start:stop:step) or a standard series between bounds (E24:10:1000), and all combinations are evaluated at once.
+# The combinations satisfying the constraints are ranked (see Wheatstone_sweep.py).
+def open_sweep():
+    sweep_window = tk.Toplevel(window)
+    sweep_window.title("Resistor Sweep")
+
+    fields = {}
+    for row, (name, default) in enumerate((("R0", R0_entry.get() or "1"), ("R1", "E24:10:1000"),
+                                           ("R3", "E24:10:1000"), ("Rw", Rw_entry.get() or "68"),
+                                           ("Target Vw / V0", ""), ("Tolerance", ""), ("Max VM / Vout", ""),
+                                           ("Max R2 error", ""), ("Ranked rows", "20"))):
+        tk.Label(sweep_window, text=name + ":").grid(row=row, column=0, sticky=tk.W, padx=10, pady=2)
+        entry = tk.Entry(sweep_window, width=30)
+        entry.insert(0, default)
+        entry.grid(row=row, column=1, padx=10, pady=2)
+        fields[name] = entry
+
+    series_var = tk.StringVar(sweep_window, value="none")
+    tk.Label(sweep_window, text="R2 series:").grid(row=9, column=0, sticky=tk.W, padx=10, pady=2)
+    tk.OptionMenu(sweep_window, series_var, "none", *E_SERIES).grid(row=9, column=1, sticky=tk.W, padx=10)
+
+    table_text = tk.Text(sweep_window, width=100, height=24, font=("Courier", 9))
+    table_text.grid(row=11, columnspan=2, padx=10, pady=10)
+    status_label = tk.Label(sweep_window, text="")
+    status_label.grid(row=12, columnspan=2, pady=5)
+
+    # Optional number of a field (None if empty)
+    def number(name):
+        text = fields[name].get().strip()
+        return float(text) if text else None
+
+    def run_sweep():
+        start = time.perf_counter()
+        try:
+            table, combinations, matches = sweep_bridge(
+                fields["R0"].get(), fields["R1"].get(), fields["R3"].get(), fields["Rw"].get(),
+                target=number("Target Vw / V0"), tolerance=number("Tolerance"), max_vm_vout=number("Max VM / Vout"),
+                r2_series=None if series_var.get() == "none" else series_var.get(),
+                max_r2_error=number("Max R2 error"), top=int(fields["Ranked rows"].get()))
+        except ValueError as error:
+            status_label.config(text=str(error))
+            return
+        table_text.delete("1.0", tk.END)
+        table_text.insert(tk.END, format_table(table))
+        status_label.config(text=f"{matches} of {combinations} combinations satisfy the constraints "
+                                 f"({time.perf_counter() - start:.3f} s)")
+
+    sweep_button = tk.Button(sweep_window, text="Run Sweep", command=run_sweep)
+    sweep_button.grid(row=10, columnspan=2, pady=10)
+
 # Function to stop the calculation and close the program
 def stop_calculation():
     window.quit()
@@ -85,6 +133,10 @@ calculate_button.grid(row=6, column=0, pady=10)  # Increased space using pady
 stop_button = tk.Button(left_frame, text="STOP", command=stop_calculation)
 stop_button.grid(row=6, column=1, pady=10)  # Increased space using pady
 
+# Create a button to open the sweep over ranges or standard series of the resistor values
+sweep_button = tk.Button(left_frame, text="Sweep", command=open_sweep)
+sweep_button.grid(row=8, columnspan=2, pady=10)  # Below the result label
+
 # Create a label to display the result
 result_label = tk.Label(left_frame, text="")
 result_label.grid(row=7, columnspan=2, pady=10)  # Increased space using pady
@@ -0,0 +1,320 @@
+#
+# Wheatstone calculator: design-space sweep of the bridge resistors
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Instead of one set of R0, R1, R3 and Rw per click, every resistor is given as a value, a list, a linear range or
+# the values of a standard E-series between two bounds, and the bridge formulas of the calculator are evaluated for
+# all combinations at once with NumPy broadcasting (in blocks of about a million combinations to bound the memory).
+# R2 balances the bridge (R2 = R1 x Rw / R3); with a standard series for R2 it is rounded to the nearest standard
+# value, and Vw / V0 is computed for the rounded R2, i.e. for the bridge that can be built.
+# The combinations are filtered by the constraints (target Vw / V0 within a tolerance, maximum VM / Vout, maximum
+# balance error of the rounded R2) and ranked: closest to the target Vw / V0 (largest Vw / V0 without a target),
+# then smallest balance error.
+# The formulas are cross-checked against the operating points saved by the LTspice decks of the repository
+# (Wheatstone_Calculator_LTspice_VM_Vout and Wheatstone_Calculator_LTspice_Vw_V0). The decks of a chosen design
+# can be written with --deck-output and checked with --check-spice after running them in LTspice.
+#
+# Values:
+#   68                  one value (Ohms)
+#   47, 68, 100         list of values
+#   60:80:0.5           linear range start:stop:step (stop included)
+#   E24:10:1000         values of the E3, E6, E12, E24, E48, E96 or E192 series between the bounds
+#
+# Usage:
+#   python Wheatstone_sweep.py --R0 1 --R1 E24:10:1000 --R3 E24:10:1000 --Rw 60:80:0.5 --target 0.4 --max-vm 2
+#   python Wheatstone_sweep.py --R0 1 --R1 E96:10:1000 --R3 E96:10:1000 --Rw 68 --r2-series E96 --top 10
+#   python Wheatstone_sweep.py --check-spice
+#
+
+import argparse
+import csv
+import math
+import os
+import re
+import struct
+import time
+
+import numpy as np
+
+# Standard resistor series: E24 (two significant digits), and E192 computed with the usual exception 9.20
+E24 = (1.0, 1.1, 1.2, 1.3, 1.5, 1.6, 1.8, 2.0, 2.2, 2.4, 2.7, 3.0, 3.3, 3.6, 3.9, 4.3, 4.7, 5.1, 5.6, 6.2, 6.8, 7.5,
+       8.2, 9.1)
+E192 = tuple(9.2 if i == 185 else round(10 ** (i / 192), 2) for i in range(192))
+E_SERIES = {'E3': E24[::8], 'E6': E24[::4], 'E12': E24[::2], 'E24': E24, 'E48': E192[::4], 'E96': E192[::2],
+            'E192': E192}
+
+# Columns of the ranked table
+TABLE_FIELDS = ['R0', 'R1', 'R2', 'R3', 'Rw', 'R2_balance', 'R2_error', 'VM_Vout', 'Vw_V0']
+
+# LTspice decks (folder and file name) with the quantity shown by their node label and the source driving them
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DECKS = {'VM_Vout': ('Wheatstone_Calculator_LTspice_VM_Vout', 'Wheatstone_Calculator_VM_Vout', 'VM'),
+         'Vw_V0': ('Wheatstone_Calculator_LTspice_Vw_V0', 'Wheatstone_Calculator_Vw_V0', 'V0')}
+SPICE_SUFFIXES = {'f': 1e-15, 'p': 1e-12, 'n': 1e-9, 'u': 1e-6, 'm': 1e-3, 'k': 1e3, 'meg': 1e6, 'g': 1e9,
+                  't': 1e12}
+
+
+# Bridge formulas of the calculator for scalars or arrays (broadcast against each other).
+# R2: the balancing resistor R1 x Rw / R3 if not given. Returns R2, VM / Vout and Vw / V0.
+def bridge_ratios(R0, R1, R3, Rw, R2=None):
+    if R2 is None:
+        R2 = R1 * Rw / R3
+    VM_Vout = (R3 + Rw) / R3
+    Vw_V0 = ((R1 + R2) * Rw) / (R0 * (R1 + R2 + R3 + Rw) + (R1 + R2) * (R3 + Rw))
+    return R2, VM_Vout, Vw_V0
+
+
+# Values of a standard series between low and high (Ohms), in increasing order
+def series_values(series, low, high):
+    if series not in E_SERIES:
+        raise ValueError('Unknown series {}; use one of {}'.format(series, ', '.join(E_SERIES)))
+    if not 0 < low <= high:
+        raise ValueError('The bounds of the {} values must satisfy 0 < low <= high'.format(series))
+    values = [float('{:.3g}'.format(mantissa * 10.0 ** decade))
+              for decade in range(math.floor(math.log10(low)), math.floor(math.log10(high)) + 1)
+              for mantissa in E_SERIES[series]]
+    return np.array([value for value in values if low * (1 - 1e-9) <= value <= high * (1 + 1e-9)])
+
+
+# Resistor values of a text: one value, a comma-separated list, start:stop:step or series:low:high (see above)
+def parse_values(text):
+    text = text.strip()
+    try:
+        parts = text.split(':')
+        if text[:1].upper() == 'E':
+            series, low, high = parts
+            values = series_values(series.upper(), float(low), float(high))
+        elif len(parts) == 3:
+            start, stop, step = (float(part) for part in parts)
+            if step <= 0 or stop < start:
+                raise ValueError('the range needs start <= stop and step > 0')
+            values = start + step * np.arange(int(math.floor((stop - start) / step + 1e-9)) + 1)
+        elif len(parts) == 1:
+            values = np.array([float(value) for value in text.split(',') if value.strip()])
+        else:
+            raise ValueError('use value, list, start:stop:step or series:low:high')
+    except ValueError as error:
+        raise ValueError('Invalid resistor values "{}": {}'.format(text, error)) from None
+    if values.size == 0 or np.any(values <= 0):
+        raise ValueError('Invalid resistor values "{}": the values must be positive'.format(text))
+    return np.unique(values)
+
+
+# Nearest values of a standard series (nearest in ratio, as the series are spaced logarithmically)
+def nearest_standard(values, series):
+    values = np.asarray(values, dtype=float)
+    table = series_values(series, 10.0 ** math.floor(math.log10(values.min()) - 1),
+                          10.0 ** math.ceil(math.log10(values.max()) + 1))
+    upper = np.clip(np.searchsorted(table, values), 1, len(table) - 1)
+    below, above = table[upper - 1], table[upper]
+    return np.where(values * values <= below * above, below, above)
+
+
+# Sweep over all combinations of the resistor values (arrays or texts for parse_values).
+# target, tolerance: wanted Vw / V0 and the allowed deviation; max_vm_vout: largest allowed VM / Vout;
+# r2_series: standard series of R2 (None keeps the exact balancing value); max_r2_error: largest allowed relative
+# deviation of the rounded R2 from the balancing value; top: number of ranked combinations returned;
+# block: number of combinations evaluated at once.
+# Returns the ranked table (dictionary of columns, see TABLE_FIELDS), the number of combinations and the number of
+# combinations satisfying the constraints.
+def sweep_bridge(R0, R1, R3, Rw, target=None, tolerance=None, max_vm_vout=None, r2_series=None, max_r2_error=None,
+                 top=20, block=2 ** 20):
+    R0, R1, R3, Rw = (parse_values(values) if isinstance(values, str) else np.unique(np.asarray(values, dtype=float))
+                      for values in (R0, R1, R3, Rw))
+    if tolerance is not None and target is None:
+        raise ValueError('A tolerance needs a target Vw / V0')
+    if top < 1:
+        raise ValueError('The number of ranked combinations must be at least 1')
+
+    # The (R3, Rw) grid is broadcast against a block of (R0, R1) pairs
+    R3_grid, Rw_grid = R3[:, None], Rw[None, :]
+    VM_Vout = (R3_grid + Rw_grid) / R3_grid
+    outer_R0, outer_R1 = (values.ravel() for values in np.meshgrid(R0, R1, indexing='ij'))
+    pairs = max(1, block // VM_Vout.size)
+
+    kept, matches = [], 0
+    for start in range(0, len(outer_R0), pairs):
+        R0_block = outer_R0[start:start + pairs, None, None]
+        R1_block = outer_R1[start:start + pairs, None, None]
+        R2_balance = R1_block * Rw_grid / R3_grid
+        R2 = nearest_standard(R2_balance, r2_series) if r2_series else R2_balance
+        _, _, Vw_V0 = bridge_ratios(R0_block, R1_block, R3_grid, Rw_grid, R2)
+        R2_error = R2 / R2_balance - 1.0
+
+        mask = np.ones(Vw_V0.shape, dtype=bool)
+        if tolerance is not None:
+            mask &= np.abs(Vw_V0 - target) <= tolerance
+        if max_vm_vout is not None:
+            mask &= np.broadcast_to(VM_Vout <= max_vm_vout, mask.shape)
+        if max_r2_error is not None:
+            mask &= np.abs(R2_error) <= max_r2_error
+        selected = np.flatnonzero(mask)
+        matches += len(selected)
+        if not len(selected):
+            continue
+
+        # Only the best combinations of the block (with all ties of the last one) are kept for the ranking
+        Vw_selected = Vw_V0.ravel()[selected]
+        rank = np.abs(Vw_selected - target) if target is not None else -Vw_selected
+        if len(selected) > top:
+            best = rank <= np.partition(rank, top - 1)[top - 1]
+            selected, rank = selected[best], rank[best]
+        index = np.unravel_index(selected, Vw_V0.shape)
+        shape = Vw_V0.shape
+        kept.append({'R0': np.broadcast_to(R0_block, shape)[index], 'R1': np.broadcast_to(R1_block, shape)[index],
+                     'R2': np.broadcast_to(R2, shape)[index], 'R3': np.broadcast_to(R3_grid, shape)[index],
+                     'Rw': np.broadcast_to(Rw_grid, shape)[index], 'R2_balance': R2_balance[index],
+                     'R2_error': R2_error[index], 'VM_Vout': np.broadcast_to(VM_Vout, shape)[index],
+                     'Vw_V0': Vw_V0[index], 'rank': rank})
+
+    table = {name: np.concatenate([part[name] for part in kept]) if kept else np.empty(0)
+             for name in TABLE_FIELDS + ['rank']}
+    order = np.lexsort((np.abs(table['R2_error']), table.pop('rank')))[:top]
+    return {name: values[order] for name, values in table.items()}, R0.size * R1.size * R3.size * Rw.size, matches
+
+
+# Text table of the ranked combinations
+def format_table(table):
+    lines = ['{:>4s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>11s} {:>10s} {:>10s}'.format(
+        'rank', 'R0', 'R1', 'R2', 'R3', 'Rw', 'R2 error', 'VM/Vout', 'Vw/V0')]
+    for i in range(len(table['Vw_V0'])):
+        lines.append('{:>4d} {:>10.4g} {:>10.4g} {:>10.4g} {:>10.4g} {:>10.4g} {:>10.3f}% {:>10.4f} {:>10.5f}'.format(
+            i + 1, table['R0'][i], table['R1'][i], table['R2'][i], table['R3'][i], table['Rw'][i],
+            100.0 * table['R2_error'][i], table['VM_Vout'][i], table['Vw_V0'][i]))
+    return '\n'.join(lines)
+
+
+def write_table(path, table):
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(TABLE_FIELDS)
+        writer.writerows(zip(*(table[name] for name in TABLE_FIELDS)))
+
+
+# Number with an optional SPICE suffix (e.g. 4.7k, 1meg); the micro sign written by LTspice is read as u
+def spice_number(text):
+    match = re.fullmatch(r'([-+0-9.eE]+)(meg|[fpnumkgt])?\w*', text.strip().lower().replace('\u00b5', 'u'))
+    if match is None:
+        raise ValueError('Invalid SPICE value "{}"'.format(text))
+    return float(match.group(1)) * SPICE_SUFFIXES.get(match.group(2), 1.0)
+
+
+# Component values of an LTspice schematic (.asc): {instance name: value}
+def read_deck_values(path):
+    values, name = {}, None
+    with open(path, encoding='latin-1') as deck:
+        for line in deck:
+            words = line.split()
+            if words[:2] == ['SYMATTR', 'InstName']:
+                name = words[2]
+            elif words[:2] == ['SYMATTR', 'Value'] and name is not None:
+                values[name] = spice_number(words[2])
+    return values
+
+
+# Operating point of an LTspice binary .raw file: {variable name: value}. The header is UTF-16 text; the first
+# variable is stored as a double and the others as floats, unless the flags contain "double".
+def read_operating_point(path):
+    with open(path, 'rb') as raw:
+        content = raw.read()
+    marker = 'Binary:\n'.encode('utf-16-le')
+    header_end = content.find(marker)
+    if header_end < 0:
+        raise ValueError('{} is not a binary LTspice raw file'.format(path))
+    header = content[:header_end].decode('utf-16-le').splitlines()
+    flags = next(line.split(':', 1)[1] for line in header if line.startswith('Flags:'))
+    start = header.index('Variables:') + 1
+    names = [line.split()[1] for line in header[start:] if line.strip()]
+    data = content[header_end + len(marker):]
+    if 'double' in flags:
+        numbers = struct.unpack_from('<{}d'.format(len(names)), data)
+    else:
+        numbers = struct.unpack_from('<d{}f'.format(len(names) - 1), data)
+    return dict(zip(names, numbers))
+
+
+# Comparison of the formulas with the LTspice decks under directory (their folders as in the repository).
+# The node voltage expected from the formulas (Vout for VM_Vout, Vw for Vw_V0) is looked up among the simulated
+# node voltages. Returns (quantity, formula value, nearest simulated node, its voltage, relative difference) per deck.
+def check_spice(directory=REPOSITORY):
+    checks = []
+    for quantity, (folder, name, source) in DECKS.items():
+        values = read_deck_values(os.path.join(directory, folder, name + '.asc'))
+        voltages = {variable: value for variable, value in
+                    read_operating_point(os.path.join(directory, folder, name + '.raw')).items()
+                    if variable.startswith('V(')}
+        _, VM_Vout, Vw_V0 = bridge_ratios(values['R0'], values['R1'], values['R3'], values['Rw'], values['R2'])
+        expected = values[source] / VM_Vout if quantity == 'VM_Vout' else values[source] * Vw_V0
+        node = min(voltages, key=lambda variable: abs(abs(voltages[variable]) - expected))
+        difference = abs(abs(voltages[node]) - expected) / expected
+        checks.append((quantity, expected, node, voltages[node], difference))
+    return checks
+
+
+# Copies of the LTspice decks with the resistor values of one design, in the folders of the repository under
+# directory, so they can be simulated and then compared with check_spice(directory). Returns the written paths.
+def write_decks(directory, values):
+    paths = []
+    for folder, name, _ in DECKS.values():
+        with open(os.path.join(REPOSITORY, folder, name + '.asc'), encoding='latin-1') as deck:
+            lines = deck.read().split('\n')
+        instance = None
+        for i, line in enumerate(lines):
+            words = line.split()
+            if words[:2] == ['SYMATTR', 'InstName']:
+                instance = words[2]
+            elif words[:2] == ['SYMATTR', 'Value'] and instance in values:
+                lines[i] = 'SYMATTR Value {:.6g}'.format(values[instance])
+        os.makedirs(os.path.join(directory, folder), exist_ok=True)
+        path = os.path.join(directory, folder, name + '.asc')
+        with open(path, 'w', encoding='latin-1', newline='') as deck:
+            deck.write('\n'.join(lines))
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Design-space sweep of the Wheatstone bridge resistors')
+    for name, default in (('R0', '1'), ('R1', 'E24:10:1000'), ('R3', 'E24:10:1000'), ('Rw', '68')):
+        parser.add_argument('--' + name, default=default,
+                            help='value, list, start:stop:step or series:low:high (default {})'.format(default))
+    parser.add_argument('--target', type=float, help='wanted Vw / V0 (ranking by the distance to it)')
+    parser.add_argument('--tolerance', type=float, help='allowed deviation from the target Vw / V0')
+    parser.add_argument('--max-vm', type=float, help='largest allowed VM / Vout')
+    parser.add_argument('--r2-series', choices=list(E_SERIES), help='round R2 to the nearest value of this series')
+    parser.add_argument('--max-r2-error', type=float, help='largest allowed relative balance error of R2')
+    parser.add_argument('--top', type=int, default=20, help='number of ranked combinations')
+    parser.add_argument('--output', help='CSV file for the ranked table')
+    parser.add_argument('--deck-output', help='write the LTspice decks of the best combination to this directory')
+    parser.add_argument('--check-spice', nargs='?', const=REPOSITORY,
+                        help='compare the formulas with the simulated LTspice decks (repository decks by default)')
+    args = parser.parse_args(argv)
+
+    if args.check_spice:
+        for quantity, expected, node, simulated, difference in check_spice(args.check_spice):
+            print('{:>8s}: formula {:.7g}, LTspice {} = {:.7g}, relative difference {:.1e}'.format(
+                quantity, expected, node, simulated, difference))
+        return
+
+    start = time.perf_counter()
+    try:
+        table, combinations, matches = sweep_bridge(
+            args.R0, args.R1, args.R3, args.Rw, target=args.target, tolerance=args.tolerance,
+            max_vm_vout=args.max_vm, r2_series=args.r2_series, max_r2_error=args.max_r2_error, top=args.top)
+    except ValueError as error:
+        parser.error(str(error))
+    seconds = time.perf_counter() - start
+
+    print(format_table(table))
+    print('')
+    print('{} of {} combinations satisfy the constraints ({:.3f} s)'.format(matches, combinations, seconds))
+    if args.output:
+        write_table(args.output, table)
+        print('Table: {}'.format(args.output))
+    if args.deck_output and len(table['Vw_V0']):
+        best = {name: table[name][0] for name in ('R0', 'R1', 'R2', 'R3', 'Rw')}
+        print('LTspice decks: {}'.format(', '.join(write_decks(args.deck_output, best))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#
+# Digital BH-loop algorithm: benchmark of the cumulative integration engine
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Run from the repository root: python benchmarks/bench_integration.py
+#
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bhloop import cumulative_integral
+
+time_increment = 1e-8  # Time increment (s)
+ground = 0.01  # Ground offset used in all runs
+sizes = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]  # Samples per branch
+loop_sizes = [10 ** 2, 3 * 10 ** 2, 10 ** 3]  # The nested loops are O(n^2), so only small branches are timed
+
+
+# Original forward integration loop from BH.py (before the vectorized engine), used as the reference
+def nested_loop_integral(response_values, time_increment, ground):
+    B = []
+    integral_value = 0.0
+    for i in range(len(response_values)):
+        for j in range(0, i):
+            integral_value += 0.5 * (response_values[j] + response_values[j + 1]) * time_increment
+            integral_value += - ground * (j + 1) * time_increment
+        B.append(integral_value)
+    return np.array(B)
+
+
+# Best of several runs to reduce the timer noise
+def best_time(function, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+rng = np.random.default_rng(0)
+
+print('Legacy mode against the original nested loops')
+for n in loop_sizes:
+    y = np.sin(np.linspace(0, np.pi, n)) + 0.01 * rng.standard_normal(n)
+    reference = nested_loop_integral(y, time_increment, ground)
+    legacy = cumulative_integral(y, time_increment, ground, mode='legacy')
+    error = np.max(np.abs(legacy - reference)) / np.max(np.abs(reference))
+    t_loop = best_time(lambda: nested_loop_integral(y, time_increment, ground), repeats=1)
+    t_fast = best_time(lambda: cumulative_integral(y, time_increment, ground, mode='legacy'))
+    print('n = {:>8d}   nested loops {:10.4f} s   vectorized {:10.6f} s   relative difference {:.2e}'.format(
+        n, t_loop, t_fast, error))
+
+print('')
+print('Scaling of the vectorized engine')
+times = {mode: [] for mode in ('trapezoid', 'legacy')}
+for n in sizes:
+    y = np.sin(np.linspace(0, np.pi, n)) + 0.01 * rng.standard_normal(n)
+    row = 'n = {:>8d}'.format(n)
+    for mode in times:
+        t = best_time(lambda: cumulative_integral(y, time_increment, ground, mode=mode))
+        times[mode].append(t)
+        row += '   {} {:10.6f} s ({:6.2f} ns/sample)'.format(mode, t, t / n * 1e9)
+    print(row)
+
+# Slope of log(time) against log(n) over the sizes where the fixed call overhead no longer dominates
+print('')
+for mode, values in times.items():
+    slope = np.polyfit(np.log10(sizes[2:]), np.log10(values[2:]), 1)[0]
+    print('Scaling exponent ({}) = {:.2f} (1.0 is linear)'.format(mode, slope))
@@ -0,0 +1,63 @@
+#
+# Digital BH-loop algorithm: benchmark of the closed-form sinusoid estimator against scipy curve_fit
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Run from the repository root: python benchmarks/bench_sinefit.py
+#
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bhloop import fit_excitation, load_capture
+
+# Bundled files and their time increments (s)
+directory_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Experimental data')
+files = [('50kHz', 5e-8), ('100kHz', 2e-8), ('200kHz', 1e-8), ('250kHz', 1e-8),
+         ('Test1', 1e-8), ('Test2', 1e-8), ('Test3', 1e-8)]
+sizes = [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]  # Points of the synthetic records
+
+
+# Best of several runs to reduce the timer noise; returns the time and the last result
+def best_time(function, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# Phase difference wrapped to [-pi, pi]
+def phase_difference(ph1, ph2):
+    return (ph1 - ph2 + np.pi) % (2.0 * np.pi) - np.pi
+
+
+print('Bundled captures: fft estimator against curve_fit')
+for name, dt in files:
+    response_values, sin_values = load_capture(os.path.join(directory_path, name + '.csv'))
+    t = np.arange(len(sin_values)) * dt
+    t_curve, curve = best_time(lambda: fit_excitation(t, sin_values, dt, 'curve_fit')[1])
+    t_fft, fft = best_time(lambda: fit_excitation(t, sin_values, dt, 'fft')[1])
+    print('{:>7s}: curve_fit {:8.2f} ms   fft {:6.2f} ms   dA/A = {:.1e}   df/f = {:.1e}   dph = {:.1e} rads'.format(
+        name, t_curve * 1e3, t_fft * 1e3, abs(fft[0] - curve[0]) / curve[0], abs(fft[1] - curve[1]) / curve[1],
+        abs(phase_difference(fft[2], curve[2]))))
+
+print('')
+print('Synthetic records (A = 10, f = 250 kHz, ph = 2 rads, 2% noise): errors against the true parameters')
+rng = np.random.default_rng(0)
+dt = 1e-8
+A, f, ph = 10.0, 250e3, 2.0
+for N in sizes:
+    t = np.arange(N) * dt
+    sin_values = A * np.sin(2 * np.pi * f * t + ph) + 0.2 * rng.standard_normal(N)
+    row = 'N = {:>8d}'.format(N)
+    for method in ('curve_fit', 'fft'):
+        seconds, fit = best_time(lambda: fit_excitation(t, sin_values, dt, method)[1], repeats=1)
+        row += '   {} {:8.3f} s (df/f = {:.1e}, dph = {:.1e})'.format(
+            method, seconds, abs(fit[1] - f) / f, abs(phase_difference(fit[2], ph)))
+    print(row)
@@ -0,0 +1,48 @@
+#
+# Digital BH-loop algorithm: benchmark of the stacked processing against the per-file loop
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Many short records of the same length (1200 points like the bundled files, 3-5 periods, random phases and
+# 0.5% noise) are processed by compute_bh_loop in a Python loop and by compute_bh_loops in one call.
+#
+# Run from the repository root: python benchmarks/bench_stacked.py
+#
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bhloop import compute_bh_loop
+from bhloop.stacked import compute_bh_loops
+from bhloop.synthetic import synthetic_capture
+
+dt = 1e-8  # Time increment (s)
+N = 1200  # Points per record
+records = [10, 100, 1000, 5000]
+
+
+rng = np.random.default_rng(0)
+print('{:>8s} {:>13s} {:>13s} {:>9s} {:>14s}'.format('records', 'per-file', 'stacked', 'speed-up', 'max |dB| / B'))
+for n_records in records:
+    captures = [synthetic_capture(N, dt, periods=rng.uniform(3.0, 5.0), amplitude=10.0, phase=rng.uniform(0, 2 * np.pi),
+                                  coercivity=3.0, width=1.0, noise=0.005, seed=i) for i in range(n_records)]
+    responses = np.array([capture.response for capture in captures])
+    excitations = np.array([capture.excitation for capture in captures])
+
+    start = time.perf_counter()
+    single = [compute_bh_loop(responses[i], excitations[i], dt) for i in range(n_records)]
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stacked = compute_bh_loops(responses, excitations, dt)
+    t_stacked = time.perf_counter() - start
+
+    # Largest difference of the smoothed loops relative to the loop amplitude
+    difference = max(np.max(np.abs(stacked.record(i).B_forward_smoothed - result.B_forward_smoothed))
+                     / np.max(np.abs(result.B_forward_smoothed)) for i, result in enumerate(single))
+    print('{:>8d} {:>10.1f} ms {:>10.1f} ms {:>8.1f}x {:>14.1e}'.format(
+        n_records, t_loop * 1e3, t_stacked * 1e3, t_loop / t_stacked, difference))
@@ -0,0 +1,165 @@
+#
+# Digital BH-loop algorithm: benchmark of the processing stages on synthetic captures with a known loop
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Every stage of the GUI run (load, vertex search, sinusoid fit, reference indexes, integration, scaling,
+# smoothing and output) is timed from 10^3 points up to --max-points, and the accuracy against the ground truth is
+# recorded next to the runtime. With --output the table is saved as JSON; with --baseline the accuracy is compared
+# with an earlier JSON file and the script fails if any error grew by more than --tolerance, so a speed-up cannot
+# silently change the results.
+#
+# Run from the repository root:
+#   python benchmarks/bench_stages.py --output stages.json
+#   python benchmarks/bench_stages.py --baseline stages.json
+# 10^8 points (--max-points 1e8) need about 8 GB of memory.
+#
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bhloop import (BHLoopResult, Capture, branch_integrals, detect_vertices, fit_excitation, read_source,
+                    reference_indices, reference_times, save_capture, scale_branches, sinusoid, smooth_loop,
+                    write_signal_parameters, write_smoothed_loop)
+from bhloop.synthetic import synthetic_capture
+
+STAGES = ('load', 'parse_csv', 'vertices', 'fit', 'indices', 'integration', 'scale', 'smoothing', 'output')
+ERRORS = ('A_error', 'f_error', 'ph_error', 'loop_error', 'smoothed_loop_error')
+
+# Synthetic loop: 4 periods in the record, 0.5% noise and a DC ground offset of 1% of the response peak,
+# compensated by groundf/groundr
+dt = 1e-8
+parameters = dict(periods=4, amplitude=10.0, phase=2.0, coercivity=3.0, saturation=1.0, width=1.0, noise=0.005,
+                  seed=0)
+window = 3
+ground_fraction = 0.01
+
+
+# Phase difference wrapped to [-pi, pi]
+def phase_difference(ph1, ph2):
+    return (ph1 - ph2 + np.pi) % (2.0 * np.pi) - np.pi
+
+
+# Row of the printed table: stage times in ms ('-' for skipped stages) and the errors
+def format_row(N, times, errors):
+    columns = ['{:>8.2f} ms'.format(times[stage] * 1e3) if times[stage] == times[stage] else '{:>11s}'.format('-')
+               for stage in STAGES]
+    return (' '.join(['{:>10d}'.format(N)] + columns) + '   '
+            + ' '.join('{:>9.1e}'.format(errors[name]) for name in ERRORS))
+
+
+# Times of the stages (s) and the errors against the ground truth for a record of N points
+def run_stages(N, directory, csv_limit):
+    # Peak of the response dB/dt = Bs / w * A * 2 * pi * f
+    frequency = parameters['periods'] / (N * dt)
+    peak = parameters['saturation'] / parameters['width'] * parameters['amplitude'] * 2.0 * np.pi * frequency
+    capture = synthetic_capture(N, dt, ground=ground_fraction * peak, **parameters)
+    ground = capture.ground
+    times = dict.fromkeys(STAGES, float('nan'))
+
+    def timed(stage, function):
+        start = time.perf_counter()
+        value = function()
+        times[stage] = time.perf_counter() - start
+        return value
+
+    # Loading of the .npz container, and the CSV parsing for short records
+    container = os.path.join(directory, 'capture.npz')
+    save_capture(container, Capture(capture.response, capture.excitation, dt))
+    loaded = timed('load', lambda: read_source(container))
+    if N <= csv_limit:
+        csv_file = os.path.join(directory, 'capture.csv')
+        np.savetxt(csv_file, np.column_stack((capture.response, capture.excitation)), delimiter=',')
+        timed('parse_csv', lambda: read_source(csv_file))
+    response_values, sin_values = loaded.response, loaded.excitation
+    capture.response = capture.excitation = None  # Only the ground truth parameters are needed further
+
+    timed('vertices', lambda: detect_vertices(sin_values))
+    time_values = np.arange(N) * dt
+    (A0, f0, ph0), (A_fit, f_fit, ph_fit), scenario = timed(
+        'fit', lambda: fit_excitation(time_values, sin_values, dt, 'fft'))
+    sinusoid_fit = sinusoid(time_values, A_fit, f_fit, ph_fit)
+
+    def indices():
+        t123 = reference_times(f_fit, ph_fit, scenario)
+        return t123, reference_indices(*t123, dt, N)
+
+    (t1, t2, t3), refindexes = timed('indices', indices)
+    raw_forward, raw_reverse = timed('integration', lambda: branch_integrals(response_values, *refindexes, dt))
+    H_forward, B_forward, H_reverse, B_reverse, con_forward, con_reverse = timed(
+        'scale', lambda: scale_branches(raw_forward, raw_reverse, sinusoid_fit, *refindexes, dt, groundf=ground,
+                                        groundr=ground))
+    smoothed = timed('smoothing', lambda: smooth_loop(H_forward, B_forward, H_reverse, B_reverse, window))
+    result = BHLoopResult(
+        time=time_values, sinusoid_fit=sinusoid_fit, A0=A0, f0=f0, ph0=ph0, A_fit=A_fit, f_fit=f_fit,
+        ph_fit=ph_fit, scenario=scenario, t1=t1, t2=t2, t3=t3, refindex1=refindexes[0], refindex2=refindexes[1],
+        refindex3=refindexes[2], groundf=ground, groundr=ground, H_forward=H_forward, B_forward=B_forward,
+        H_reverse=H_reverse, B_reverse=B_reverse, con_forward=con_forward, con_reverse=con_reverse,
+        H_forward_smoothed=smoothed[0], B_forward_smoothed=smoothed[1], H_reverse_smoothed=smoothed[2],
+        B_reverse_smoothed=smoothed[3])
+
+    def output():
+        write_signal_parameters(os.path.join(directory, 'signal_parameters.txt'), container, dt, 1.0, 1.0, result)
+        write_smoothed_loop(os.path.join(directory, 'smoothed_hysteresis_data.csv'), result)
+
+    timed('output', output)
+
+    errors = {'A_error': abs(A_fit - capture.amplitude) / capture.amplitude,
+              'f_error': abs(f_fit - capture.frequency) / capture.frequency,
+              'ph_error': abs(phase_difference(ph_fit, capture.phase)),
+              'loop_error': capture.loop_error(result),
+              'smoothed_loop_error': capture.loop_error(result, smoothed=True)}
+    return times, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stage benchmark on synthetic captures')
+    parser.add_argument('--max-points', type=float, default=1e7, help='largest record (default 1e7)')
+    parser.add_argument('--csv-limit', type=float, default=1e6, help='largest record also loaded from CSV')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare the accuracy with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative growth of the errors')
+    args = parser.parse_args(argv)
+
+    sizes = [10 ** k for k in range(3, 9) if 10 ** k <= args.max_points]
+    rows = []
+    print(' '.join(['{:>10s}'.format('N')] + ['{:>11s}'.format(stage) for stage in STAGES])
+          + '   ' + ' '.join('{:>9s}'.format(name[:9]) for name in ERRORS))
+    with tempfile.TemporaryDirectory() as directory:
+        for N in sizes:
+            times, errors = run_stages(N, directory, args.csv_limit)
+            rows.append({'N': N, 'seconds': {stage: value if value == value else None  # Skipped stages
+                                             for stage, value in times.items()}, 'errors': errors})
+            print(format_row(N, times, errors))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'parameters': parameters, 'time_increment': dt, 'window': window, 'rows': rows}, file,
+                      indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = {row['N']: row['errors'] for row in json.load(file)['rows']}
+        failures = []
+        for row in rows:
+            for name, value in row['errors'].items():
+                reference = baseline.get(row['N'], {}).get(name)
+                # Errors at the rounding level are not compared
+                if reference is not None and value > reference * (1.0 + args.tolerance) + 1e-12:
+                    failures.append('N = {}: {} = {:.3e} (baseline {:.3e})'.format(row['N'], name, value, reference))
+        if failures:
+            print('Accuracy regressions against the baseline:')
+            print('\n'.join(failures))
+            sys.exit(1)
+        print('Accuracy matches the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#
+# Digital BH-loop algorithm: benchmark of the result store against the legacy TXT/CSV files
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The results of synthetic records (1200 points like the bundled files) are written as signal_parameters.txt and
+# smoothed_hysteresis_data.csv per record, and appended to a result store in segments of 64 records. The store is
+# then queried by file name and frequency range, and the loops of the found records are read.
+#
+# Run from the repository root: python benchmarks/bench_store.py
+#
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bhloop import compute_bh_loop, write_signal_parameters, write_smoothed_loop
+from bhloop.store import ResultStore, result_record
+from bhloop.synthetic import synthetic_capture
+
+dt = 1e-8  # Time increment (s)
+N = 1200  # Points per record
+records = [100, 1000, 5000]
+chunk = 64  # Records per segment
+
+
+# Total size of the files in a directory (bytes)
+def directory_size(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory))
+
+
+rng = np.random.default_rng(0)
+print('{:>8s} {:>12s} {:>12s} {:>10s} {:>10s} {:>12s} {:>12s}'.format(
+    'records', 'legacy', 'store', 'legacy MB', 'store MB', 'find', 'read loops'))
+for n_records in records:
+    frequencies = rng.uniform(3e5, 5e5, n_records)  # 3.6 to 6 periods per record
+    results = []
+    for i in range(n_records):
+        capture = synthetic_capture(N, dt, frequency=frequencies[i], phase=rng.uniform(0, 2 * np.pi),
+                                    amplitude=10.0, coercivity=3.0, width=1.0, noise=0.005, seed=i)
+        results.append(compute_bh_loop(capture.response, capture.excitation, dt))
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = os.path.join(directory, 'legacy')
+        os.makedirs(legacy)
+        start = time.perf_counter()
+        for i, result in enumerate(results):
+            name = os.path.join(legacy, 'capture{}'.format(i))
+            write_signal_parameters(name + '_signal_parameters.txt', name + '.csv', dt, 1.0, 1.0, result)
+            write_smoothed_loop(name + '_smoothed_hysteresis_data.csv', result)
+        t_legacy = time.perf_counter() - start
+
+        store = ResultStore(os.path.join(directory, 'results.bhstore'))
+        start = time.perf_counter()
+        for first in range(0, n_records, chunk):
+            store.append(result_record(result, 'capture{}.csv'.format(first + i), dt)
+                         for i, result in enumerate(results[first:first + chunk]))
+        t_store = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.find(file='capture0.csv')
+        rows = store.find(f_min=3.9e5, f_max=4.1e5)
+        t_find = time.perf_counter() - start
+        start = time.perf_counter()
+        store.loops(rows)
+        t_read = time.perf_counter() - start
+
+        print('{:>8d} {:>9.1f} ms {:>9.1f} ms {:>10.2f} {:>10.2f} {:>9.2f} ms {:>9.2f} ms'.format(
+            n_records, t_legacy * 1e3, t_store * 1e3, directory_size(legacy) / 1e6,
+            directory_size(store.path) / 1e6, t_find * 1e3, t_read * 1e3))
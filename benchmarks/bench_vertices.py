@@ -0,0 +1,59 @@
+#
+# Digital BH-loop algorithm: benchmark of the vectorized vertex and zero-crossing detection
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Run from the repository root: python benchmarks/bench_vertices.py
+#
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bhloop import detect_vertices
+
+dt = 1e-8  # Time increment (s)
+f = 250e3  # Sinusoid frequency (Hz)
+sizes = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+
+
+# Original search of the first negative vertex set in BH.py (pure Python loop over the samples), used as the reference
+def loop_negative_vertex(y_values):
+    N = len(y_values)
+    A0 = np.max(y_values)
+    i = 0
+    while i <= N - 1 and y_values[i] >= 0:
+        i += 1
+    negative_set = []
+    while y_values[i] >= -A0 * 0.9:
+        i += 1
+    while i <= N - 1 and y_values[i] <= 0:
+        if -A0 <= y_values[i] <= -A0 * 0.9:
+            negative_set.append(i)
+        i += 1
+    return sum(negative_set) / len(negative_set)
+
+
+rng = np.random.default_rng(0)
+for N in sizes:
+    t = np.arange(N) * dt
+    y = 10.0 * np.sin(2 * np.pi * f * t + 0.5) + 0.05 * rng.standard_normal(N)
+
+    start = time.perf_counter()
+    vertices = detect_vertices(y)
+    seconds = time.perf_counter() - start
+
+    # The Python loop only finds the first vertex; it is timed on the same record for comparison
+    y_list = y.tolist()
+    start = time.perf_counter()
+    first_negative = loop_negative_vertex(y_list)
+    loop_seconds = time.perf_counter() - start
+
+    print('N = {:>8d}   vectorized {:8.2f} ms ({:5.1f} ns/point, {} crossings, {} vertices)   '
+          'first vertex loop {:8.2f} ms   first vertex difference {:.2f} points'.format(
+              N, seconds * 1e3, seconds / N * 1e9, len(vertices.rising) + len(vertices.falling),
+              len(vertices.positive) + len(vertices.negative), loop_seconds * 1e3,
+              abs(vertices.negative[0] - first_negative)))
@@ -0,0 +1,56 @@
+#
+# Wheatstone calculator: benchmark of the bridge sweep against one calculation per combination
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The bridge formulas of the calculator are evaluated for every combination of E96 values of R1 and R3, values of
+# R0 and a range of wire resistances Rw, with R2 rounded to the E96 series: once as a Python loop calling the scalar
+# formulas (rounding by bisection in a precomputed table; timed on a subset and extrapolated to all combinations)
+# and once with the broadcast sweep.
+#
+# Run from the repository root: python benchmarks/bench_wheatstone.py
+#
+
+import bisect
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'Wheatstone_Calculator_Python'))
+
+from Wheatstone_sweep import bridge_ratios, parse_values, series_values, sweep_bridge
+
+grids = [('1', 'E96:10:1000', 'E96:10:1000', '60:80:1'),
+         ('E12:1:10', 'E96:10:1000', 'E96:10:1000', '60:80:1'),
+         ('E24:1:100', 'E96:10:1000', 'E96:10:1000', '60:80:0.5')]
+loop_combinations = 200000  # Combinations timed in the Python loop
+E96 = list(series_values('E96', 0.1, 1e6))
+
+
+# Nearest E96 value of one resistance (in ratio)
+def nearest_e96(value):
+    upper = min(max(bisect.bisect_left(E96, value), 1), len(E96) - 1)
+    below, above = E96[upper - 1], E96[upper]
+    return below if value * value <= below * above else above
+
+
+print('{:>12s} {:>14s} {:>12s} {:>14s} {:>9s}'.format('combinations', 'loop (est.)', 'sweep', 'per combination',
+                                                       'speed-up'))
+for grid in grids:
+    values = [parse_values(text) for text in grid]
+    combinations = 1
+    for array in values:
+        combinations *= len(array)
+
+    start = time.perf_counter()
+    for R0, R1, R3, Rw in itertools.islice(itertools.product(*values), loop_combinations):
+        bridge_ratios(R0, R1, R3, Rw, nearest_e96(R1 * Rw / R3))
+    t_loop = (time.perf_counter() - start) * combinations / min(combinations, loop_combinations)
+
+    start = time.perf_counter()
+    sweep_bridge(*values, target=0.4, max_vm_vout=2.0, r2_series='E96', max_r2_error=0.01)
+    t_sweep = time.perf_counter() - start
+
+    print('{:>12d} {:>12.2f} s {:>10.3f} s {:>11.1f} ns {:>8.0f}x'.format(
+        combinations, t_loop, t_sweep, t_sweep / combinations * 1e9, t_loop / t_sweep))
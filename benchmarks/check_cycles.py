@@ -0,0 +1,56 @@
+#
+# Digital BH-loop algorithm: check of the cycle averaging and the streaming processing against the single period
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# For the bundled captures (first and second scenario of the sinusoid fit) and synthetic records starting on either
+# half wave, the first period found by compute_cycle_average must start at the reference time t1 of compute_bh_loop,
+# and the averaged forward branch must run in the same direction with a ground offset applied to the forward branch
+# only. The streamed loop must run in the same direction as well.
+#
+# Run from the repository root: python benchmarks/check_cycles.py
+#
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bhloop import compute_bh_loop, compute_cycle_average, load_capture
+from bhloop.streaming import process_stream
+from bhloop.synthetic import synthetic_capture
+
+groundf = 0.05  # Ground offset of the forward branch only, so swapped branches change the loop
+tolerance = 0.05  # Largest relative difference of the forward B range of the average and of the single period
+
+captures = [(name, *load_capture(os.path.join('Experimental data', name + '.csv')), dt)
+            for name, dt in (('50kHz', 5e-8), ('100kHz', 2e-8), ('200kHz', 1e-8), ('250kHz', 1e-8),
+                             ('Test1', 1e-8), ('Test2', 1e-8), ('Test3', 1e-8))]
+for phase in (0.5, 2.0, 3.5, 5.0):  # Records starting on the positive and on the negative half wave
+    capture = synthetic_capture(1200, 1e-8, periods=4, amplitude=10.0, phase=phase, coercivity=3.0, width=1.0)
+    captures.append(('synthetic phase {}'.format(phase), capture.response, capture.excitation, 1e-8))
+
+failures = 0
+print('{:>22s} {:>8s} {:>10s} {:>12s} {:>12s} {:>10s} {:>6s}'.format(
+    'capture', 'scenario', 'alignment', 'B range', 'averaged', 'direction', 'check'))
+for name, response, excitation, dt in captures:
+    for alignment in ('sample', 'subsample'):
+        single = compute_bh_loop(response, excitation, dt, groundf=groundf, alignment=alignment)
+        average = compute_cycle_average(response, excitation, dt, groundf=groundf, alignment=alignment)
+        direction = np.sign(single.H_forward[-1] - single.H_forward[0])
+        same_direction = direction == np.sign(average.H_forward[-1] - average.H_forward[0])
+        B_range, B_average = np.ptp(single.B_forward), np.ptp(average.B_forward)
+        ok = (np.isclose(average.period_times[0], single.t1) and same_direction
+              and abs(B_average - B_range) <= tolerance * B_range)
+        if alignment == 'sample':
+            streamed = process_stream([(response, excitation)], dt, groundf=groundf)
+            ok = ok and direction == np.sign(streamed.H_forward_smoothed[-1] - streamed.H_forward_smoothed[0])
+        failures += not ok
+        print('{:>22s} {:>8d} {:>10s} {:>12.4g} {:>12.4g} {:>10s} {:>6s}'.format(
+            name, single.scenario, alignment, B_range, B_average, 'same' if same_direction else 'swapped',
+            'ok' if ok else 'FAILED'))
+
+print('')
+print('All checks passed' if failures == 0 else '{} checks failed'.format(failures))
+sys.exit(failures > 0)
@@ -0,0 +1,99 @@
+#
+# Digital BH-loop algorithm: check of the compaction of the result store
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# A store of several segments is compacted (1) with a segment appended while the old segments are read, (2) with
+# the removal of the old segment files failing, and (3) again after the failure. Every record must be listed exactly
+# once after each step, with its loop arrays and in the order the records were stored.
+#
+# Run from the repository root: python benchmarks/check_store.py
+#
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bhloop.store as store_module
+from bhloop import compute_bh_loop
+from bhloop.store import ResultStore, result_record
+from bhloop.synthetic import synthetic_capture
+
+dt = 1e-8
+capture = synthetic_capture(2000, dt, periods=4, amplitude=10.0, coercivity=3.0, width=1.0)
+result = compute_bh_loop(capture.response, capture.excitation, dt)
+failures = 0
+
+
+# Record names and the forward B loop of every record of a freshly opened store, and the number of segments
+def contents(path):
+    store = ResultStore(path)
+    rows = store.find()
+    names = [str(name) for name in store.table()['file_name']]
+    return names, [loop['B_forward_smoothed'] for loop in store.loops(rows)], len(store.segment_files())
+
+
+def check(label, path, expected, segments=None):
+    global failures
+    names, loops, n_segments = contents(path)
+    ok = (names == expected and all(np.array_equal(loop, result.B_forward_smoothed) for loop in loops)
+          and (segments is None or n_segments == segments))
+    failures += not ok
+    print('{:>40s}: {} records in {} segments  {}'.format(label, len(names), n_segments, 'ok' if ok else 'FAILED'))
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'check.bhstore')
+    store = ResultStore(path)
+    expected = []
+    for segment in range(4):
+        names = ['capture{}_{}.csv'.format(segment, i) for i in range(3)]
+        store.append([result_record(result, name, dt) for name in names])
+        expected += names
+
+    # (1) Segment appended by another writer while the old segments are read
+    segment_records = store_module._segment_records
+
+    def append_meanwhile(segment):
+        store_module._segment_records = segment_records
+        ResultStore(path).append([result_record(result, 'late.csv', dt)])
+        return segment_records(segment)
+
+    store_module._segment_records = append_meanwhile
+    store.compact()
+    store_module._segment_records = segment_records
+    expected.append('late.csv')
+    check('compaction with a concurrent append', path, expected, 2)
+
+    # (2) Old segment files that cannot be removed, e.g. after a crash in the middle of the removal
+    ResultStore(path).append([result_record(result, 'more.csv', dt)])
+    expected.append('more.csv')
+    before = len(ResultStore(path).table()['file_name'])
+    remove = os.remove
+
+    def failing_remove(file):
+        raise OSError('removal failed: ' + file)
+
+    os.remove = failing_remove
+    try:
+        ResultStore(path).compact()
+    except OSError:
+        pass
+    finally:
+        os.remove = remove
+    failures += len(ResultStore(path).table()['file_name']) != before
+    check('compaction with a failed removal', path, expected, 1)
+
+    # (3) Compaction after the failure: the superseded files are removed
+    ResultStore(path).compact()
+    check('compaction after the failure', path, expected, 1)
+    leftover = len(os.listdir(path))
+    failures += leftover != 1
+    print('{:>40s}: {} files  {}'.format('store directory', leftover, 'ok' if leftover == 1 else 'FAILED'))
+
+print('')
+print('All checks passed' if failures == 0 else '{} checks failed'.format(failures))
+sys.exit(failures > 0)
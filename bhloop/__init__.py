@@ -0,0 +1,21 @@
+#
+# Digital BH-loop algorithm: processing routines shared by the GUI and the scripts
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+
+from .profiling import Profiler, StageMonitor, format_breakdown, merge_reports
+from .integration import INTEGRATION_MODES, cumulative_integral, ground_integral
+from .drift import GROUND_METHODS, closure_ground, estimate_ground, periods_ground
+from .vertices import Vertices, detect_vertices
+from .sinefit import FIT_METHODS, fft_fit_sinusoid, fft_frequency, linear_sinusoid_fit, refine_sinusoid
+from .pipeline import (ALIGNMENT_MODES, BHLoopResult, branch_integrals, branch_samples, compute_bh_loop,
+                       estimate_sinusoid, fit_excitation, fit_sinusoid, h_grid, interpolate_samples, moving_average,
+                       reference_indices, reference_times, resample_branch, resample_loop, scale_branches,
+                       shift_branch, sinusoid, smooth_loop)
+from .captures import Capture, cached_capture, convert_capture, read_capture, read_source, save_capture
+from .files import load_capture, write_signal_parameters, write_smoothed_loop
+from .plotting import plot_sinusoid_fit, plot_smoothed_loop, plot_sweep_loops, plot_sweep_parameter
+from .metrics import LoopMetrics, loop_area, loop_metrics, max_permeability, result_metrics, zero_crossing
+from .stacked import StackedLoopResult, compute_bh_loops
+from .cycles import CycleAverageResult, compute_cycle_average, extract_cycles, find_periods
+from .tuning import StageCache, TuningSession
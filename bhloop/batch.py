@@ -0,0 +1,340 @@
+#
+# Digital BH-loop algorithm: batch processing of many capture files
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Usage (from the repository root):
+#   python -m bhloop.batch "Experimental data" --time-increment 1e-8 --output results
+#   python -m bhloop.batch "Experimental data/Test*.csv" --time-increment 1e-8 --plots
+#   python -m bhloop.batch "Experimental data" --time-increment 1e-8 --output results --profile --cprofile
+#   python -m bhloop.batch "Experimental data" --time-increment 1e-8 --output results --stacked
+#   python -m bhloop.batch "Experimental data" --time-increment 1e-8 --store results/results.bhstore --no-legacy
+#
+
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .files import load_capture, write_signal_parameters, write_smoothed_loop
+from .integration import INTEGRATION_MODES
+from .metrics import result_metrics
+from .cycles import compute_cycle_average
+from .drift import GROUND_METHODS
+from .pipeline import ALIGNMENT_MODES, compute_bh_loop
+from .profiling import Profiler, format_breakdown, merge_reports
+from .sinefit import FIT_METHODS
+from .stacked import compute_bh_loops
+from .store import ResultStore, result_record
+
+# Records appended to the result store as one segment
+default_store_chunk = 64
+
+# Files written by the program itself, which are skipped when a whole directory is processed
+OUTPUT_SUFFIXES = ('smoothed_hysteresis_data.csv', '_summary.csv')
+
+# Columns of the summary table
+SUMMARY_FIELDS = ['file', 'status', 'points', 'periods', 'A_fit', 'f_fit (Hz)', 'ph_fit (rads)', 'refindex1',
+                  'refindex2', 'refindex3', 'groundf', 'groundr', 'H_max', 'B_max', 'coercivity', 'remanence',
+                  'squareness', 'loop_area', 'max_permeability', 'seconds', 'error']
+
+
+# List of the capture files given by a directory or a glob pattern
+def find_captures(source):
+    if os.path.isdir(source):
+        pattern = os.path.join(source, '*.csv')
+    else:
+        pattern = source
+    return sorted(file_name for file_name in glob.glob(pattern)
+                  if os.path.isfile(file_name) and not file_name.endswith(OUTPUT_SUFFIXES))
+
+
+# Names of the output files of one capture. The capture name is used as a prefix, so the results of different
+# files in the same output directory do not overwrite each other.
+def output_paths(output_directory, name):
+    return {
+        'parameters': os.path.join(output_directory, name + '_signal_parameters.txt'),
+        'loop': os.path.join(output_directory, name + '_smoothed_hysteresis_data.csv'),
+        'fit_plot': os.path.join(output_directory, name + '_sinusoid_fitting_reference_points.png'),
+        'loop_plot': os.path.join(output_directory, name + '_smoothed_hysteresis_plot.png'),
+        'profile': os.path.join(output_directory, name + '_profile.json'),
+        'cprofile': os.path.join(output_directory, name + '_profile.prof'),
+    }
+
+
+# Saving both plots of one capture as images. The figures are created without pyplot, so no window or
+# interactive backend is needed in the worker processes.
+def save_plots(paths, sin_values, result):
+    from matplotlib.figure import Figure
+    from .plotting import plot_sinusoid_fit, plot_smoothed_loop
+
+    fig = Figure(figsize=(10, 6))
+    plot_sinusoid_fit(fig.add_subplot(), sin_values, result)
+    fig.savefig(paths['fit_plot'])
+
+    fig = Figure(figsize=(10, 6))
+    plot_smoothed_loop(fig.add_subplot(), result)
+    fig.savefig(paths['loop_plot'])
+
+
+# Writing the output files of one capture (legacy=False: only the plots, if requested) and adding its parameters
+# to the summary row
+def save_result(row, paths, file_name, time_increment, B_scale, H_scale, sin_values, result, plots=False,
+                legacy=True):
+    if legacy:
+        write_signal_parameters(paths['parameters'], file_name, time_increment, B_scale, H_scale, result)
+        write_smoothed_loop(paths['loop'], result)
+    if plots:
+        save_plots(paths, sin_values, result)
+
+    row.update({
+        'periods': getattr(result, 'n_periods', 1),
+        'A_fit': result.A_fit, 'f_fit (Hz)': result.f_fit, 'ph_fit (rads)': result.ph_fit,
+        'refindex1': result.refindex1, 'refindex2': result.refindex2, 'refindex3': result.refindex3,
+        'groundf': result.groundf, 'groundr': result.groundr,
+    })
+    metrics = result_metrics(result)
+    row.update({name: getattr(metrics, name) for name in (
+        'H_max', 'B_max', 'coercivity', 'remanence', 'squareness', 'loop_area', 'max_permeability')})
+
+
+# Full processing of one capture file in a worker process. Errors are returned in the summary row instead of
+# being raised, so one bad file does not stop the whole batch. With record=True the result store record of the
+# file is returned in row['record'].
+def process_file(file_name, output_directory, time_increment, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0,
+                 groundr=0.0, integration_mode='trapezoid', fit_method='fft', all_periods=False, plots=False,
+                 cache=True, profile=False, cprofile=False, ground_method='manual', alignment='sample',
+                 grid_points=None, legacy=True, record=False):
+    start = time.perf_counter()
+    row = {'file': file_name, 'status': 'ok', 'points': 0}
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    paths = output_paths(output_directory, name)
+    # Stage times, peak memory and counters of the file (profile=True) and the cProfile dump (cprofile=True)
+    profiler = Profiler(memory=profile, cprofile=cprofile) if profile or cprofile else None
+    with profiler or nullcontext():
+        try:
+            response_values, sin_values = load_capture(file_name, cache=cache)
+            row['points'] = len(sin_values)
+            compute = compute_cycle_average if all_periods else compute_bh_loop
+            result = compute(response_values, sin_values, time_increment, B_scale=B_scale, H_scale=H_scale,
+                             window=window, groundf=groundf, groundr=groundr, integration_mode=integration_mode,
+                             fit_method=fit_method, ground_method=ground_method, alignment=alignment,
+                             grid_points=grid_points)
+
+            save_result(row, paths, file_name, time_increment, B_scale, H_scale, sin_values, result, plots, legacy)
+            if record:
+                row['record'] = result_record(result, file_name, time_increment, B_scale, H_scale, parameters={
+                    'window': window, 'groundf': groundf, 'groundr': groundr, 'integration_mode': integration_mode,
+                    'fit_method': fit_method, 'all_periods': all_periods, 'ground_method': ground_method,
+                    'alignment': alignment, 'grid_points': grid_points})
+        except Exception as error:
+            row['status'] = 'failed'
+            row['error'] = '{}: {}'.format(type(error).__name__, error)
+    if profile:
+        profiler.write_json(paths['profile'])
+        row['profile'] = profiler.report()
+    if cprofile:
+        profiler.dump_cprofile(paths['cprofile'])
+    row['seconds'] = time.perf_counter() - start
+    if 'record' in row:
+        row['record']['seconds'] = row['seconds']
+    return row
+
+
+# Records of the processed rows appended to the result store in segments of chunk records, as the rows arrive;
+# the records are removed from the rows
+class _StoreWriter:
+    def __init__(self, path, chunk=default_store_chunk):
+        self.store = ResultStore(path) if path else None
+        self.chunk = chunk
+        self.pending = []
+
+    def add(self, row):
+        record = row.pop('record', None)
+        if self.store is not None and record is not None:
+            self.pending.append(record)
+            if len(self.pending) >= self.chunk:
+                self.flush()
+
+    def flush(self):
+        if self.store is not None:
+            self.store.append(self.pending)
+            self.pending = []
+
+
+# Processing of all files in a process pool. Returns the summary rows in the order of the file list and the
+# total wall time. With store (path of a result store) the results are also appended to the store.
+def run_batch(file_names, output_directory, time_increment, workers=None, store=None, **parameters):
+    os.makedirs(output_directory, exist_ok=True)
+    start = time.perf_counter()
+    rows = {}
+    writer = _StoreWriter(store)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(process_file, file_name, output_directory, time_increment, record=bool(store),
+                                   **parameters): file_name for file_name in file_names}
+        for future in as_completed(futures):
+            row = future.result()
+            writer.add(row)
+            rows[futures[future]] = row
+    writer.flush()
+    return [rows[file_name] for file_name in file_names], time.perf_counter() - start
+
+
+# Processing of all files in one process with compute_bh_loops: the files of the same length are stacked and
+# processed together (sinusoid fit 'fft', one t1-t3 window per file). The seconds of every row are its share of the
+# stacked processing time.
+def run_stacked(file_names, output_directory, time_increment, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0,
+                groundr=0.0, integration_mode='trapezoid', plots=False, cache=True, ground_method='manual',
+                legacy=True, store=None):
+    os.makedirs(output_directory, exist_ok=True)
+    start = time.perf_counter()
+    rows = {}
+    writer = _StoreWriter(store)
+    parameters = {'window': window, 'groundf': groundf, 'groundr': groundr, 'integration_mode': integration_mode,
+                  'fit_method': 'fft', 'all_periods': False, 'ground_method': ground_method, 'alignment': 'sample',
+                  'grid_points': None}
+    groups = {}  # Files grouped by the number of points
+    for file_name in file_names:
+        try:
+            response_values, sin_values = load_capture(file_name, cache=cache)
+            groups.setdefault(len(sin_values), []).append((file_name, response_values, sin_values))
+        except Exception as error:
+            rows[file_name] = {'file': file_name, 'status': 'failed', 'points': 0, 'seconds': 0.0,
+                               'error': '{}: {}'.format(type(error).__name__, error)}
+
+    for N, group in groups.items():
+        group_start = time.perf_counter()
+        stacked = compute_bh_loops(np.array([item[1] for item in group]), np.array([item[2] for item in group]),
+                                   time_increment, B_scale=B_scale, H_scale=H_scale, window=window,
+                                   groundf=groundf, groundr=groundr, integration_mode=integration_mode,
+                                   ground_method=ground_method)
+        for i, (file_name, response_values, sin_values) in enumerate(group):
+            row = {'file': file_name, 'status': 'ok', 'points': N}
+            name = os.path.splitext(os.path.basename(file_name))[0]
+            try:
+                result = stacked.record(i)
+                save_result(row, output_paths(output_directory, name), file_name, time_increment, B_scale,
+                            H_scale, sin_values, result, plots, legacy)
+                if store:
+                    row['record'] = result_record(result, file_name, time_increment, B_scale, H_scale, parameters)
+            except Exception as error:
+                row['status'] = 'failed'
+                row['error'] = '{}: {}'.format(type(error).__name__, error)
+            rows[file_name] = row
+        for file_name, _, _ in group:
+            row = rows[file_name]
+            row['seconds'] = (time.perf_counter() - group_start) / len(group)
+            if 'record' in row:
+                row['record']['seconds'] = row['seconds']
+            writer.add(row)
+    writer.flush()
+    return [rows[file_name] for file_name in file_names], time.perf_counter() - start
+
+
+# Writing the summary table with one row per file
+def write_summary(path, rows):
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch processing of BH-loop capture files')
+    parser.add_argument('source', help='directory with CSV files or a glob pattern')
+    parser.add_argument('--time-increment', type=float, required=True, help='time increment (s)')
+    parser.add_argument('--output', help='output directory (default: the directory of the files)')
+    parser.add_argument('--B-scale', type=float, default=1.0)
+    parser.add_argument('--H-scale', type=float, default=1.0)
+    parser.add_argument('--window', type=int, default=3, help='moving average window')
+    parser.add_argument('--groundf', type=float, default=0.0, help='ground offset (forward)')
+    parser.add_argument('--groundr', type=float, default=0.0, help='ground offset (reverse)')
+    parser.add_argument('--ground-method', choices=GROUND_METHODS, default='manual',
+                        help="ground offsets: the entered values ('manual'), or estimated by loop 'closure' or "
+                             "least squares over the full 'periods'")
+    parser.add_argument('--alignment', choices=ALIGNMENT_MODES, default='sample',
+                        help="'subsample' interpolates the branches to start exactly at the reference times")
+    parser.add_argument('--grid-points', type=int,
+                        help='resample the smoothed loop onto a shared H grid of this many points')
+    parser.add_argument('--integration-mode', choices=INTEGRATION_MODES, default='trapezoid')
+    parser.add_argument('--fit-method', choices=FIT_METHODS, default='fft',
+                        help="sinusoid fitting: closed-form 'fft' estimator or scipy 'curve_fit'")
+    parser.add_argument('--all-periods', action='store_true',
+                        help='average the loop over all full periods of the record')
+    parser.add_argument('--plots', action='store_true', help='save the plots of every file as PNG images')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the source files again')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--stacked', action='store_true',
+                        help='process the files of the same length together in one process (fft fit only)')
+    parser.add_argument('--store', help='append the results to this result store (see bhloop/store.py)')
+    parser.add_argument('--no-legacy', action='store_true',
+                        help='do not write the TXT/CSV files of every capture (only with --store)')
+    parser.add_argument('--profile', action='store_true',
+                        help='save the stage times, peak memory and counters of every file as JSON')
+    parser.add_argument('--cprofile', action='store_true', help='save a cProfile dump of every file')
+    args = parser.parse_args(argv)
+
+    file_names = find_captures(args.source)
+    if not file_names:
+        parser.error('no CSV files found in {}'.format(args.source))
+    output_directory = args.output or os.path.dirname(file_names[0]) or '.'
+    if args.no_legacy and not args.store:
+        parser.error('--no-legacy needs --store')
+
+    if args.stacked:
+        if (args.fit_method != 'fft' or args.all_periods or args.profile or args.cprofile
+                or args.alignment != 'sample' or args.grid_points):
+            parser.error('--stacked supports only --fit-method fft without --all-periods, profiling, '
+                         '--alignment subsample and --grid-points')
+        rows, seconds = run_stacked(file_names, output_directory, args.time_increment, B_scale=args.B_scale,
+                                    H_scale=args.H_scale, window=args.window, groundf=args.groundf,
+                                    groundr=args.groundr, integration_mode=args.integration_mode,
+                                    plots=args.plots, cache=not args.no_cache, ground_method=args.ground_method,
+                                    legacy=not args.no_legacy, store=args.store)
+    else:
+        rows, seconds = run_batch(file_names, output_directory, args.time_increment, workers=args.workers,
+                                  B_scale=args.B_scale, H_scale=args.H_scale, window=args.window,
+                                  groundf=args.groundf, groundr=args.groundr,
+                                  integration_mode=args.integration_mode, fit_method=args.fit_method,
+                                  all_periods=args.all_periods,
+                                  plots=args.plots, cache=not args.no_cache, profile=args.profile,
+                                  cprofile=args.cprofile, ground_method=args.ground_method,
+                                  alignment=args.alignment, grid_points=args.grid_points,
+                                  legacy=not args.no_legacy, store=args.store)
+    summary_path = os.path.join(output_directory, 'batch_summary.csv')
+    write_summary(summary_path, rows)
+
+    for row in rows:
+        if row['status'] == 'ok':
+            print('{}: f_fit = {} Hz, Hc = {}, loop area = {}'.format(row['file'], row['f_fit (Hz)'],
+                                                                     row['coercivity'], row['loop_area']))
+        else:
+            print('{}: {}'.format(row['file'], row['error']))
+
+    samples = sum(row['points'] for row in rows)
+    print('')
+    print('Processed {} files ({} failed) in {:.3f} s'.format(
+        len(rows), sum(row['status'] != 'ok' for row in rows), seconds))
+    print('Throughput = {:.2f} files/s, {:.0f} samples/s'.format(len(rows) / seconds, samples / seconds))
+    print('Summary table: {}'.format(summary_path))
+    if args.store:
+        print('Result store: {} ({} records)'.format(args.store, len(ResultStore(args.store))))
+
+    if args.profile:
+        # Stage breakdown summed over all files
+        report = merge_reports(row['profile'] for row in rows)
+        profile_path = os.path.join(output_directory, 'batch_profile.json')
+        with open(profile_path, 'w') as file:
+            json.dump(report, file, indent=2)
+        print('')
+        print(format_breakdown(report))
+        print('Stage profile: {}'.format(profile_path))
+
+
+if __name__ == '__main__':
+    main()
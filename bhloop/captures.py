@@ -0,0 +1,183 @@
+#
+# Digital BH-loop algorithm: binary capture container, converter and parse cache
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# A capture is stored as an uncompressed NumPy .npz file with the two channels and the metadata (time increment,
+# source file and its fingerprint). Parsed CSV/xlsx files are cached in this format, so repeated runs on the same
+# capture skip the text parsing.
+#
+
+import hashlib
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+import zipfile
+from dataclasses import dataclass
+
+import numpy as np
+
+CAPTURE_EXTENSION = '.npz'
+SOURCE_EXTENSIONS = ('.csv', '.xlsx', CAPTURE_EXTENSION)
+
+# Directory of the parse cache (can be changed with the BHLOOP_CACHE environment variable)
+default_cache_directory = os.environ.get('BHLOOP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'bhloop'))
+
+
+# Two channels of a capture and its metadata
+@dataclass
+class Capture:
+    response: np.ndarray  # Response values which are proportional to the induction B
+    excitation: np.ndarray  # Sinusoid values which are proportional to the scanning magnetic field H
+    time_increment: float = None  # Time increment (s), if it is known from the source file
+    source: str = ''  # Source file the capture was read from
+
+
+# Two-column CSV file without header
+def read_csv_capture(file_name):
+    data = np.genfromtxt(file_name, delimiter=',')
+    if data.ndim != 2 or data.shape[1] < 2:
+        raise ValueError('{} must contain two comma-separated columns'.format(file_name))
+    # Contiguous copies of the columns: the FFT fit rounds differently on strided views, and the values must be the
+    # same bits whether they are parsed here or read back from the parse cache
+    return Capture(np.ascontiguousarray(data[:, 0]), np.ascontiguousarray(data[:, 1]), source=file_name)
+
+
+# Excel file exported from the oscilloscope (see "Experimental data/Original Excel files"): column A holds the point
+# index, B the response, C the excitation, and the time increment is given under the "Increment" header.
+# The files are saved in the strict Open XML format, which openpyxl cannot read, so the sheet is parsed directly.
+def read_xlsx_capture(file_name):
+    with zipfile.ZipFile(file_name) as archive:
+        strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            with archive.open('xl/sharedStrings.xml') as file:
+                strings = [''.join(item.itertext()) for item in ElementTree.parse(file).getroot()
+                           if item.tag.endswith('}si')]
+        with archive.open('xl/worksheets/sheet1.xml') as file:
+            cells = {}
+            for _, element in ElementTree.iterparse(file):
+                if element.tag.endswith('}c'):
+                    value = element.find('{*}v')
+                    if value is not None:
+                        text = value.text
+                        cells[element.get('r')] = strings[int(text)] if element.get('t') == 's' else text
+                    element.clear()
+
+    # Splitting the cell references (e.g. "B12") into columns and rows
+    columns = {}
+    for reference, value in cells.items():
+        column = reference.rstrip('0123456789')
+        columns.setdefault(column, {})[int(reference[len(column):])] = value
+
+    def numeric_rows(column):
+        values = {}
+        for row, value in columns.get(column, {}).items():
+            try:
+                values[row] = float(value)
+            except ValueError:
+                pass
+        return values
+
+    index, response, excitation = numeric_rows('A'), numeric_rows('B'), numeric_rows('C')
+    rows = sorted(set(index) & set(response) & set(excitation))
+    if not rows:
+        raise ValueError('{} does not contain the index, response and excitation columns'.format(file_name))
+
+    time_increment = None
+    for column, labels in columns.items():
+        for row, label in labels.items():
+            if label == 'Increment' and (row + 1) in numeric_rows(column):
+                time_increment = numeric_rows(column)[row + 1]
+
+    return Capture(np.array([response[row] for row in rows]), np.array([excitation[row] for row in rows]),
+                   time_increment, file_name)
+
+
+# Writing a capture to the binary container. The file is written to a temporary name first, so parallel
+# workers never see a half-written file.
+def save_capture(path, capture, **metadata):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(suffix=CAPTURE_EXTENSION, dir=directory)
+    with os.fdopen(descriptor, 'wb') as file:
+        np.savez(file, response=capture.response, excitation=capture.excitation,
+                 time_increment=np.nan if capture.time_increment is None else capture.time_increment,
+                 source=capture.source, **metadata)
+    os.replace(temporary, path)
+
+
+# Reading a capture from the binary container
+def read_capture(path):
+    with np.load(path) as data:
+        time_increment = float(data['time_increment'])
+        return Capture(data['response'], data['excitation'],
+                       None if np.isnan(time_increment) else time_increment, str(data['source']))
+
+
+# Reading any supported source file by its extension
+def read_source(file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.xlsx':
+        return read_xlsx_capture(file_name)
+    if extension == CAPTURE_EXTENSION:
+        return read_capture(file_name)
+    return read_csv_capture(file_name)
+
+
+# SHA-256 hash of the file contents
+def file_hash(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Cache file of a source file: the name is derived from the absolute path, so files with equal names in
+# different directories do not collide
+def cache_path(file_name, cache_directory=None):
+    key = hashlib.sha256(os.path.abspath(file_name).encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(cache_directory or default_cache_directory, '{}_{}{}'.format(name, key, CAPTURE_EXTENSION))
+
+
+# Capture read through the parse cache.
+# The cached copy is used if the size and modification time of the source file are unchanged, or if its contents
+# hash is unchanged (e.g. after copying; the cache is then rewritten with the new size and modification time, so
+# later calls do not hash the file again); otherwise the source is parsed again and the cache is rewritten.
+def cached_capture(file_name, cache_directory=None):
+    if file_name.lower().endswith(CAPTURE_EXTENSION):
+        return read_capture(file_name)
+
+    status = os.stat(file_name)
+    path = cache_path(file_name, cache_directory)
+    source_hash = capture = None
+    if os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                if int(data['source_size']) == status.st_size and int(data['source_mtime']) == status.st_mtime_ns:
+                    return read_capture(path)
+                source_hash = file_hash(file_name)
+                if str(data['source_sha256']) == source_hash:
+                    capture = read_capture(path)
+        except (OSError, KeyError, ValueError):
+            pass  # Damaged or old cache file, parsed again below
+
+    if capture is None:
+        capture = read_source(file_name)
+    save_capture(path, capture, source_size=status.st_size, source_mtime=status.st_mtime_ns,
+                 source_sha256=source_hash or file_hash(file_name))
+    return capture
+
+
+# Conversion of a CSV/xlsx file to the binary container. Returns the path of the written file.
+def convert_capture(file_name, destination=None, time_increment=None):
+    capture = read_source(file_name)
+    if time_increment is not None:
+        capture.time_increment = time_increment
+    if destination is None:
+        destination = os.path.splitext(file_name)[0] + CAPTURE_EXTENSION
+    elif os.path.isdir(destination):
+        destination = os.path.join(destination,
+                                   os.path.splitext(os.path.basename(file_name))[0] + CAPTURE_EXTENSION)
+    save_capture(destination, capture)
+    return destination
@@ -0,0 +1,39 @@
+#
+# Digital BH-loop algorithm: conversion of CSV/xlsx captures to the binary container
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Usage (from the repository root):
+#   python -m bhloop.convert "Experimental data/Original Excel files" --output "Experimental data/npz"
+#
+
+import argparse
+import glob
+import os
+
+from .captures import convert_capture
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Conversion of CSV/xlsx captures to the binary container')
+    parser.add_argument('sources', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('--output', help='output directory (default: next to the source files)')
+    parser.add_argument('--time-increment', type=float, help='time increment (s) stored with the captures')
+    args = parser.parse_args(argv)
+
+    file_names = []
+    for source in args.sources:
+        if os.path.isdir(source):
+            file_names += [os.path.join(source, name) for name in sorted(os.listdir(source))
+                           if name.lower().endswith(('.csv', '.xlsx'))]
+        else:
+            file_names += sorted(glob.glob(source))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    for file_name in file_names:
+        destination = convert_capture(file_name, args.output, args.time_increment)
+        print('{} -> {}'.format(file_name, destination))
+
+
+if __name__ == '__main__':
+    main()
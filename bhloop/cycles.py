@@ -0,0 +1,145 @@
+#
+# Digital BH-loop algorithm: extraction of all excitation periods and cycle averaging
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Instead of a single t1-t3 window, every full period of the fitted sinusoid in the record is integrated and the
+# loops are averaged. All periods are processed together as rows of 2-D arrays, so there is no Python loop over
+# the periods.
+#
+
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from .integration import cumulative_integral
+from .pipeline import (BHLoopResult, compute_bh_loop, h_grid, interpolate_samples, moving_average, pi,
+                       resample_branch, shift_branch)
+from .profiling import count, stage
+
+
+# Results of the cycle averaging. The BH curves of the base class hold the averaged loop; the spread is the
+# standard deviation of B over the periods (smoothed and trimmed like the averaged curves).
+@dataclass
+class CycleAverageResult(BHLoopResult):
+    n_periods: int  # Number of full periods found in the record
+    period_times: np.ndarray  # Reference time t1 of every period (s)
+    B_forward_cycles: np.ndarray  # Rescaled and shifted B of every period, shape (n_periods, branch points)
+    B_reverse_cycles: np.ndarray
+    B_forward_spread: np.ndarray  # Standard deviation of B over the periods after smoothing
+    B_reverse_spread: np.ndarray
+
+
+# First reference time t1 at or after the record start. As in reference_times, t1 is the moment where the phase of
+# the fitted sinusoid equals 3*pi/2 in the first scenario and 5*pi/2 in the second one (modulo 2*pi), so the forward
+# and reverse branches are the same half periods as in the single period processing.
+def first_period_time(f_fit, ph_fit, scenario=1):
+    anchor = 1.5 * pi if scenario == 1 else 2.5 * pi
+    return ((anchor - ph_fit) % (2.0 * pi)) / (2.0 * pi * f_fit)
+
+
+# Reference times t1 of all full periods in a record of N points, together with the number of points per branch.
+# Each period consists of the forward (t1 to t2) and reverse (t2 to t3) half periods; scenario is the one of the
+# sinusoid fit (see first_period_time).
+# With the 'subsample' alignment the branches are interpolated onto the rounded number of points per half period.
+def find_periods(f_fit, ph_fit, time_increment, N, alignment='sample', scenario=1):
+    period = 1.0 / f_fit
+    t1_first = first_period_time(f_fit, ph_fit, scenario)
+    k = np.arange(max(int((N * time_increment - t1_first) / period) + 1, 0))
+    t1 = t1_first + k * period  # Candidate periods
+
+    # Points in each half period and the periods whose reverse branch ends inside the record
+    if alignment == 'subsample':
+        branch_points = int(round(0.5 * period / time_increment))
+        last = t1 + (2 * branch_points - 1) * (0.5 * period / max(branch_points, 1))
+        return t1[last <= (N - 1) * time_increment], branch_points
+    branch_points = int(0.5 * period / time_increment)
+    reverse_start = ((t1 + 0.5 * period) / time_increment).astype(np.int64)
+    return t1[reverse_start + branch_points <= N], branch_points
+
+
+# Forward and reverse branches of all periods as 2-D arrays (one row per period).
+# Returns H and B of both branches before the vertical shift. With the 'subsample' alignment the response and
+# the fitted sinusoid are interpolated so that every branch starts exactly at its reference time.
+def extract_cycles(response_values, sinusoid_fit, time_increment, f_fit, period_times, branch_points,
+                   B_scale=1.0, H_scale=1.0, groundf=0.0, groundr=0.0, integration_mode='trapezoid',
+                   alignment='sample'):
+    if alignment == 'subsample':
+        branch_dt = 0.5 / f_fit / branch_points
+        positions = (period_times[:, np.newaxis] + np.arange(2 * branch_points) * branch_dt) / time_increment
+        response = interpolate_samples(response_values, positions)
+        H = -interpolate_samples(sinusoid_fit, positions) * H_scale
+        response_forward, response_reverse = response[:, :branch_points], response[:, branch_points:]
+        H_forward, H_reverse = H[:, :branch_points], H[:, branch_points:]
+    else:
+        branch_dt = time_increment
+        offsets = np.arange(branch_points)
+        forward_index = (period_times / time_increment).astype(np.int64)[:, np.newaxis] + offsets
+        reverse_index = ((period_times + 0.5 / f_fit) / time_increment).astype(np.int64)[:, np.newaxis] + offsets
+        response_forward, response_reverse = response_values[forward_index], response_values[reverse_index]
+        H_forward = -sinusoid_fit[forward_index] * H_scale
+        H_reverse = -sinusoid_fit[reverse_index] * H_scale
+
+    B_forward = cumulative_integral(response_forward, branch_dt, groundf, mode=integration_mode) * B_scale
+    B_reverse = cumulative_integral(response_reverse, branch_dt, groundr, mode=integration_mode) * B_scale
+    return H_forward, B_forward, H_reverse, B_reverse
+
+
+# Most frequent concavity direction over the periods
+def _majority(concavity):
+    return 'up' if np.count_nonzero(concavity == 'up') * 2 >= len(concavity) else 'down'
+
+
+# Full processing of one capture with averaging over all periods.
+# The arguments are the same as for compute_bh_loop; the sinusoid is fitted to the whole record once, and the
+# ground offsets (entered or estimated) of the first period are applied to all periods.
+def compute_cycle_average(response, excitation, dt, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0, groundr=0.0,
+                          integration_mode='trapezoid', fit_method='fft', ground_method='manual', alignment='sample',
+                          grid_points=None):
+    base = compute_bh_loop(response, excitation, dt, B_scale=B_scale, H_scale=H_scale, window=window,
+                           groundf=groundf, groundr=groundr, integration_mode=integration_mode,
+                           fit_method=fit_method, ground_method=ground_method, alignment=alignment)
+    response_values = np.asarray(response, dtype=float)
+
+    period_times, branch_points = find_periods(base.f_fit, base.ph_fit, dt, len(response_values), alignment,
+                                               base.scenario)
+    if len(period_times) == 0:
+        raise ValueError('The record does not contain a full period of the excitation')
+    count('periods', len(period_times))
+
+    with stage('cycles'):
+        H_forward, B_forward, H_reverse, B_reverse = extract_cycles(
+            response_values, base.sinusoid_fit, dt, base.f_fit, period_times, branch_points, B_scale=B_scale,
+            H_scale=H_scale, groundf=base.groundf, groundr=base.groundr, integration_mode=integration_mode,
+            alignment=alignment)
+
+    # Vertical shifts of every period, then the averaged loop and the spread over the periods
+    with stage('average'):
+        B_forward, con_forward = shift_branch(H_forward, B_forward)
+        B_reverse, con_reverse = shift_branch(H_reverse, B_reverse)
+        averaged = [values.mean(axis=0) for values in (H_forward, B_forward, H_reverse, B_reverse)]
+        spread = [values.std(axis=0) for values in (B_forward, B_reverse)]
+
+    # Smoothing the data using moving averages and trimming the arrays to the minimum length
+    with stage('smooth'):
+        smoothed = [moving_average(values, window) for values in averaged + spread]
+        min_length = min(len(values) for values in smoothed)
+        smoothed = [values[:min_length] for values in smoothed]
+
+    # Averaged curves and the spread resampled onto the shared H grid
+    if grid_points:
+        with stage('resample'):
+            H_forward, H_reverse = smoothed[0], smoothed[2]
+            grid = h_grid(H_forward, H_reverse, grid_points)
+            smoothed = [*resample_branch(H_forward, smoothed[1], grid), *resample_branch(H_reverse, smoothed[3], grid),
+                        resample_branch(H_forward, smoothed[4], grid)[1],
+                        resample_branch(H_reverse, smoothed[5], grid)[1]]
+
+    values = {field.name: getattr(base, field.name) for field in fields(base)}
+    values.update(
+        H_forward=averaged[0], B_forward=averaged[1], H_reverse=averaged[2], B_reverse=averaged[3],
+        con_forward=_majority(con_forward), con_reverse=_majority(con_reverse),
+        H_forward_smoothed=smoothed[0], B_forward_smoothed=smoothed[1],
+        H_reverse_smoothed=smoothed[2], B_reverse_smoothed=smoothed[3])
+    return CycleAverageResult(
+        n_periods=len(period_times), period_times=period_times, B_forward_cycles=B_forward,
+        B_reverse_cycles=B_reverse, B_forward_spread=smoothed[4], B_reverse_spread=smoothed[5], **values)
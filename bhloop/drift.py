@@ -0,0 +1,93 @@
+#
+# Digital BH-loop algorithm: automatic estimation of the ground offset of the response
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# A DC offset g of the pickup signal makes the integrated induction drift by g * t. Instead of tuning groundf and
+# groundr by hand, the offset can be estimated from the record itself:
+#   'closure' - the loop must close over the t1-t3 window: B at the end of the reverse branch returns to B at the
+#               start of the forward branch. B is linear in the ground offset, so this gives g in closed form
+#               (in both integration modes).
+#   'periods' - least-squares slope of the integrated response sampled at the starts of all full periods
+#               (t1 + k * T), which averages the offset over the whole record.
+# The estimated offset is used for both branches (groundf = groundr = g); 'manual' keeps the entered values.
+# In the 'legacy' integration mode the running integral is accumulated twice, so 'closure' gives the offset that
+# closes this loop rather than the DC level of the response given by 'periods'.
+#
+
+import numpy as np
+
+from .integration import cumulative_integral, ground_integral
+
+GROUND_METHODS = ('manual', 'closure', 'periods')
+
+
+# Float for a single record, array for stacked records
+def _value(array):
+    return float(array) if np.ndim(array) == 0 else array
+
+
+# Ground offset closing the loop over the forward and reverse branches integrated without ground offsets.
+# For stacked (2-D, padded) branches the lengths of the branches of every row are given.
+def closure_ground(raw_forward, raw_reverse, dt, integration_mode='trapezoid', forward_lengths=None,
+                   reverse_lengths=None):
+    raw_forward = np.asarray(raw_forward, dtype=float)
+    raw_reverse = np.asarray(raw_reverse, dtype=float)
+    n_forward = raw_forward.shape[-1] if forward_lengths is None else np.asarray(forward_lengths)
+    n_reverse = raw_reverse.shape[-1] if reverse_lengths is None else np.asarray(reverse_lengths)
+    if np.any(np.minimum(n_forward, n_reverse) < 2):
+        raise ValueError('Both branches need at least two points to estimate the ground offset')
+
+    # Values at the branch ends: the response integrals and the integrals of the unit ground level
+    forward_end = np.take_along_axis(raw_forward, np.expand_dims(n_forward - 1, -1), -1)[..., 0]
+    reverse_end = np.take_along_axis(raw_reverse, np.expand_dims(n_reverse - 1, -1), -1)[..., 0]
+    unit_forward = ground_integral(raw_forward.shape[-1], dt, integration_mode)[n_forward - 1]
+    unit_reverse = ground_integral(raw_reverse.shape[-1], dt, integration_mode)[n_reverse - 1]
+    return _value((forward_end + reverse_end) / (unit_forward + unit_reverse))
+
+
+# Ground offset as the least-squares slope of the integrated response at the starts of the full periods
+# t1 + k * T (linearly interpolated between the samples). Works along the last axis for stacked records, with
+# t1 and f_fit given per row.
+def periods_ground(response_values, dt, t1, f_fit):
+    y = np.asarray(response_values, dtype=float)
+    N = y.shape[-1]
+    t1 = np.expand_dims(np.asarray(t1, dtype=float), -1)
+    period = 1.0 / np.expand_dims(np.asarray(f_fit, dtype=float), -1)
+    full_periods = np.floor(((N - 1) * dt - t1) / period)  # Full periods after t1
+    short = ~(full_periods[..., 0] >= 1)  # NaN for the stacked records without a full period
+    if y.ndim == 1 and short:
+        raise ValueError('The record does not contain a full period to estimate the ground offset')
+    full_periods = np.where(short[..., np.newaxis], 1.0, full_periods)
+
+    integral = cumulative_integral(y, dt)
+    k = np.arange(int(np.max(full_periods)) + 1)
+    used = k <= full_periods  # Period starts inside the record
+    position = np.where(used, (t1 + k * period) / dt, 0.0)
+    index = np.clip(np.floor(position).astype(int), 0, N - 2)
+    fraction = position - index
+    values = (np.take_along_axis(integral, index, -1) * (1.0 - fraction)
+              + np.take_along_axis(integral, index + 1, -1) * fraction)
+
+    # Slope of the values against the time k * T over the used period starts
+    x = np.where(used, k * period, 0.0)
+    n = used.sum(axis=-1, keepdims=True)
+    x_mean = x.sum(axis=-1, keepdims=True) / n
+    v_mean = np.where(used, values, 0.0).sum(axis=-1, keepdims=True) / n
+    dx = np.where(used, x - x_mean, 0.0)
+    return _value(np.where(short, np.nan, np.sum(dx * (values - v_mean), axis=-1) / np.sum(dx * dx, axis=-1)))
+
+
+# Ground offsets (groundf, groundr) by the chosen method; the manual values are returned unchanged.
+# branch_dt is the time increment of the branches when they were interpolated onto the reference times.
+def estimate_ground(method, response_values, raw_forward, raw_reverse, dt, t1, f_fit, integration_mode='trapezoid',
+                    groundf=0.0, groundr=0.0, forward_lengths=None, reverse_lengths=None, branch_dt=None):
+    if method not in GROUND_METHODS:
+        raise ValueError('Unknown ground offset method {!r}, expected one of {}'.format(method, GROUND_METHODS))
+    if method == 'manual':
+        return groundf, groundr
+    if method == 'closure':
+        ground = closure_ground(raw_forward, raw_reverse, branch_dt or dt, integration_mode, forward_lengths,
+                                reverse_lengths)
+    else:
+        ground = periods_ground(response_values, dt, t1, f_fit)
+    return ground, ground
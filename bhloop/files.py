@@ -0,0 +1,80 @@
+#
+# Digital BH-loop algorithm: reading captures and writing the results
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+
+import csv
+
+import numpy as np
+
+from .captures import cached_capture, read_source
+from .metrics import result_metrics
+from .profiling import stage
+
+
+# Data from the CSV file (two columns without header), the oscilloscope xlsx file or the binary .npz container.
+# Returns the response values (proportional to the induction B) and the sinusoid values (proportional to the
+# scanning magnetic field H). With cache=True the parsed data are taken from the parse cache when possible.
+def load_capture(file_name, cache=False):
+    with stage('load'):
+        capture = cached_capture(file_name) if cache else read_source(file_name)
+    return capture.response, capture.excitation
+
+
+# Writing the fitted parameters and the loop parameters to the txt file
+def write_signal_parameters(path, file_name, time_increment, B_scale, H_scale, result):
+    with stage('metrics'):
+        metrics = result_metrics(result)
+    with stage('output'), open(path, 'w') as file:
+        file.write('\n')
+        file.write('File name and directory {}\n'.format(file_name))
+        file.write('\n')
+        file.write('Time increment = {} s\n'.format(time_increment))
+        file.write('Fitted sinusoid amplitude = {} (your units)\n'.format(result.A_fit))
+        file.write('Fitted sinusoid frequency = {} Hz\n'.format(result.f_fit))
+        file.write('Fitted sinusoid phase = {} rads\n'.format(result.ph_fit))
+        file.write('Fitted sinusoid phase = {} degrees\n'.format(result.ph_degrees))
+        file.write('\n')
+        file.write('B-scale = {} \n'.format(B_scale))
+        file.write('H-scale = {} \n'.format(H_scale))
+        file.write('\n')
+        file.write('Reference time t1 = {} s \n'.format(result.t1))
+        file.write('Reference time t2 = {} s \n'.format(result.t2))
+        file.write('Reference time t3 = {} s \n'.format(result.t3))
+        file.write('\n')
+        file.write('Reference index 1 = {} \n'.format(result.refindex1))
+        file.write('Reference index 2 = {} \n'.format(result.refindex2))
+        file.write('Reference index 3 = {} \n'.format(result.refindex3))
+        file.write('\n')
+        file.write('Ground offset (forward) = {} (your units)\n'.format(result.groundf))
+        file.write('Ground offset (reverse) = {} (your units)\n'.format(result.groundr))
+        if hasattr(result, 'n_periods'):  # Results averaged over all periods
+            file.write('\n')
+            file.write('Number of averaged periods = {} \n'.format(result.n_periods))
+        file.write('\n')
+        file.write('Coercive field = {} A/m (forward {}, reverse {})\n'.format(
+            metrics.coercivity, metrics.coercivity_forward, metrics.coercivity_reverse))
+        file.write('Remanence = {} T (forward {}, reverse {})\n'.format(
+            metrics.remanence, metrics.remanence_forward, metrics.remanence_reverse))
+        file.write('Maximum field = {} A/m\n'.format(metrics.H_max))
+        file.write('Maximum induction = {} T\n'.format(metrics.B_max))
+        file.write('Squareness (remanence / maximum induction) = {}\n'.format(metrics.squareness))
+        file.write('Loop area (loss per cycle) = {} J/m^3\n'.format(metrics.loop_area))
+        file.write('Maximum differential permeability = {} H/m (relative {})\n'.format(
+            metrics.max_permeability, metrics.max_relative_permeability))
+
+
+# Saving the smoothed curves to a CSV file.
+# For the results averaged over all periods, the spread of B over the periods is added as two extra columns.
+def write_smoothed_loop(path, result):
+    columns = [result.H_forward_smoothed, result.B_forward_smoothed,
+               result.H_reverse_smoothed, result.B_reverse_smoothed]
+    header = ['H_forward (A/m)', 'B_forward_smoothed (T)', 'H_reverse (A/m)', 'B_reverse_smoothed (T)']
+    if hasattr(result, 'n_periods'):
+        columns += [result.B_forward_spread, result.B_reverse_spread]
+        header += ['B_forward_spread (T)', 'B_reverse_spread (T)']
+    with stage('output'), open(path, 'w', newline='') as csv_file:
+        data = np.column_stack(columns)
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        writer.writerows(data)
@@ -0,0 +1,56 @@
+#
+# Digital BH-loop algorithm: cumulative integration of the voltage response
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+
+import numpy as np
+
+# Integration modes
+# 'trapezoid' - cumulative trapezoid integral of (response - ground), computed in linear time
+# 'legacy'    - reproduces the numbers of the original nested forward/reverse loops in BH.py, where the running
+#               integral was never reset inside the outer loop (kept for comparison with old results)
+INTEGRATION_MODES = ('trapezoid', 'legacy')
+
+
+# Cumulative integral of the response values over one branch of the hysteresis loop.
+# The returned array has the same shape as the input: element k is the integral from sample 0 to sample k,
+# so the first element is always zero. The ground offset is subtracted from the response in closed form.
+# For 2-D input every row is a separate branch integrated along the last axis; the ground offset can then be
+# a scalar or one value per row.
+def cumulative_integral(response_values, time_increment, ground=0.0, mode='trapezoid'):
+    if mode not in INTEGRATION_MODES:
+        raise ValueError('Unknown integration mode {!r}, expected one of {}'.format(mode, INTEGRATION_MODES))
+
+    y = np.asarray(response_values, dtype=float)
+    n = y.shape[-1]
+    if n == 0:
+        return np.zeros(y.shape)
+    ground = np.asarray(ground, dtype=float)
+    if ground.ndim > 0:
+        ground = ground[..., np.newaxis]  # One ground offset per branch
+
+    # Trapezoid areas between the neighbouring samples and their running sum
+    trapezoids = 0.5 * (y[..., :-1] + y[..., 1:]) * time_increment
+    integral = np.zeros(y.shape)
+    np.cumsum(trapezoids, axis=-1, out=integral[..., 1:])
+
+    if mode == 'legacy':
+        # Legacy mode: at the step k the old inner loop re-added every earlier trapezoid, and the outer loop kept
+        # accumulating these partial sums
+        integral = np.cumsum(integral, axis=-1)
+    return integral - ground * ground_integral(n, time_increment, mode)
+
+
+# Contribution of the unit ground level to the cumulative integral of n samples, so that
+#   cumulative_integral(y, dt, ground, mode)
+#   == cumulative_integral(y, dt, 0.0, mode) - ground * ground_integral(n, dt, mode).
+# The ground offset can thus be changed without integrating the response again.
+def ground_integral(n, time_increment, mode='trapezoid'):
+    if mode not in INTEGRATION_MODES:
+        raise ValueError('Unknown integration mode {!r}, expected one of {}'.format(mode, INTEGRATION_MODES))
+    k = np.arange(n, dtype=float)  # Sample index counted from the branch start
+    if mode == 'trapezoid':
+        # Integral of the constant ground level over k increments
+        return k * time_increment
+    # In the legacy mode the ground term ground * (j + 1) * dt was added for every j < k, and accumulated again
+    return np.cumsum(time_increment * k * (k + 1) / 2.0)
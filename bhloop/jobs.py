@@ -0,0 +1,169 @@
+#
+# Digital BH-loop algorithm: background worker for the processing runs of the GUI
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Runs submitted from the Tk window are queued and processed one after another by a worker thread, so the window
+# stays responsive while a capture is parsed, fitted and integrated. The progress of the running job follows the
+# processing stages (see profiling.StageMonitor), and a cancelled job stops at the start of its next stage, except
+# inside uncancellable() (e.g. while the outputs are written, so a job never leaves a partial set of files).
+# A thread is used instead of a process so that the runs share the stage cache of the GUI session.
+# The worker never touches Tk: the window polls the changed jobs with poll() from its event loop (root.after).
+#
+# Usage:
+#   worker = JobWorker()
+#   job = worker.submit('50kHz', process, file_name)
+#   ... worker.poll() in root.after, worker.cancel(job), worker.cancel_all() ...
+#   worker.stop()
+#
+
+import contextvars
+import itertools
+import queue
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from .profiling import StageMonitor
+
+# Stages in the order they run (single window, all periods, plotting and saving); the progress of a job is the
+# position of its latest stage in this list
+PROGRESS_STAGES = ('load', 'fit', 'vertices', 'indices', 'cycles', 'integral', 'ground', 'average', 'scale',
+                   'smooth', 'resample', 'plot', 'metrics', 'output', 'store')
+JOB_STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+_cancellable = contextvars.ContextVar('bhloop_job_cancellable', default=True)
+
+
+# Raised at the start of a stage of a cancelled job
+class JobCancelled(Exception):
+    pass
+
+
+# Context in which the running job is not stopped at the start of a stage. A job cancelled inside the context
+# finishes it; the cancellation takes effect at the first stage after it.
+@contextmanager
+def uncancellable():
+    token = _cancellable.set(False)
+    try:
+        yield
+    finally:
+        _cancellable.reset(token)
+
+
+# One submitted run. progress goes from 0 to 1; result is the return value of the function, error the message of a
+# failed job.
+@dataclass(eq=False)
+class Job:
+    number: int
+    name: str
+    function: object
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    state: str = 'queued'
+    stage: str = ''
+    progress: float = 0.0
+    result: object = None
+    error: str = ''
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    # One line for the job list of the GUI
+    def describe(self):
+        text = '#{} {}: {}'.format(self.number, self.name, self.state)
+        if self.state == 'running':
+            text += ' ({}, {:.0f}%)'.format(self.stage, 100.0 * self.progress)
+        elif self.state == 'failed':
+            text += ' ({})'.format(self.error)
+        return text
+
+
+# Worker thread processing the submitted jobs in order
+class JobWorker:
+    def __init__(self):
+        self.jobs = []  # All jobs in the order of submission
+        self.current = None  # Running job
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._changed = queue.Queue()  # Jobs with a new state or progress, for poll()
+        self._numbers = itertools.count(1)
+        self.thread = threading.Thread(target=self._run, name='bh-worker', daemon=True)
+        self.thread.start()
+
+    # Queueing function(*args, **kwargs) under the label shown in the job list; returns the job
+    def submit(self, label, function, *args, **kwargs):
+        job = Job(next(self._numbers), label, function, args, kwargs)
+        with self.lock:
+            self.jobs.append(job)
+        self._queue.put(job)
+        self._changed.put(job)
+        return job
+
+    # Cancelling a queued or running job (the running one by default). A running job stops at its next stage.
+    def cancel(self, job=None):
+        job = job or self.current
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+            self._changed.put(job)
+
+    # Cancelling the running job and all queued jobs
+    def cancel_all(self):
+        for job in self.pending():
+            self.cancel(job)
+        self.cancel()
+
+    # Jobs waiting in the queue
+    def pending(self):
+        with self.lock:
+            return [job for job in self.jobs if job.state == 'queued']
+
+    # Jobs changed since the last call, each listed once
+    def poll(self):
+        changed = []
+        while True:
+            try:
+                job = self._changed.get_nowait()
+            except queue.Empty:
+                return changed
+            if job not in changed:
+                changed.append(job)
+
+    # Cancelling all jobs and ending the worker thread
+    def stop(self, timeout=2.0):
+        self.cancel_all()
+        self._queue.put(None)
+        self.thread.join(timeout)
+
+    # Progress of the job at the start of a stage; raises JobCancelled for a cancelled job
+    def _stage_started(self, job, name):
+        if job.cancel_event.is_set() and _cancellable.get():
+            raise JobCancelled(job.name)
+        job.stage = name
+        if name in PROGRESS_STAGES:
+            job.progress = max(job.progress, PROGRESS_STAGES.index(name) / len(PROGRESS_STAGES))
+        self._changed.put(job)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if job.cancel_event.is_set():
+                job.state = 'cancelled'
+                self._changed.put(job)
+                continue
+            self.current = job
+            job.state = 'running'
+            self._changed.put(job)
+            try:
+                with StageMonitor(lambda name: self._stage_started(job, name)):
+                    job.result = job.function(*job.args, **job.kwargs)
+                job.state, job.progress = 'done', 1.0
+            except JobCancelled:
+                job.state = 'cancelled'
+            except Exception as error:  # Reported in the GUI instead of ending the worker
+                job.state, job.error = 'failed', '{}: {}'.format(type(error).__name__, error)
+            self.current = None
+            self._changed.put(job)
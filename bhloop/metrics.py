@@ -0,0 +1,116 @@
+#
+# Digital BH-loop algorithm: magnetic parameters of the hysteresis loop
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Coercive field, remanence, maximum field and induction, loop area (energy loss per cycle and unit volume when B
+# is in T and H in A/m), maximum differential permeability and squareness of a loop given by its forward and
+# reverse branches. All functions work along the last axis, so a stack of loops (one loop per row of 2-D arrays)
+# is processed in one call without loops over the rows.
+#
+
+from dataclasses import dataclass
+
+import numpy as np
+
+mu0 = 4e-7 * np.pi  # Vacuum permeability (H/m)
+
+
+# Loop parameters; floats for one loop and arrays with one value per loop for stacked loops
+@dataclass
+class LoopMetrics:
+    coercivity: object  # Mean of |Hc| of both branches
+    coercivity_forward: object  # H at B = 0 on the forward branch
+    coercivity_reverse: object  # H at B = 0 on the reverse branch
+    remanence: object  # Mean of |Br| of both branches
+    remanence_forward: object  # B at H = 0 on the forward branch
+    remanence_reverse: object  # B at H = 0 on the reverse branch
+    H_max: object  # Largest |H| of the loop
+    B_max: object  # Largest |B| of the loop
+    loop_area: object  # Area enclosed by the loop
+    max_permeability: object  # Largest differential permeability dB/dH of both branches
+    squareness: object  # Remanence divided by B_max
+
+    # Relative permeability mu_max / mu0, meaningful when B is in T and H in A/m
+    @property
+    def max_relative_permeability(self):
+        return self.max_permeability / mu0
+
+
+# Value of x where y crosses zero, linearly interpolated between the neighbouring samples.
+# If noise makes y cross zero several times, the mean of the first and the last crossing is taken;
+# NaN is returned when y does not change sign.
+def zero_crossing(x, y):
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    n = y.shape[-1]
+    crossing = (np.sign(y[..., :-1]) * np.sign(y[..., 1:]) <= 0) & (y[..., :-1] != y[..., 1:])
+    found = crossing.any(axis=-1)
+    first = np.argmax(crossing, axis=-1)
+    last = n - 2 - np.argmax(crossing[..., ::-1], axis=-1)
+
+    def interpolate(k):
+        k = np.expand_dims(k, -1)
+        x0, x1 = np.take_along_axis(x, k, -1)[..., 0], np.take_along_axis(x, k + 1, -1)[..., 0]
+        y0, y1 = np.take_along_axis(y, k, -1)[..., 0], np.take_along_axis(y, k + 1, -1)[..., 0]
+        return x0 - y0 * (x1 - x0) / np.where(found, y1 - y0, 1.0)
+
+    return _value(np.where(found, 0.5 * (interpolate(first) + interpolate(last)), np.nan))
+
+
+# Forward and reverse branches as float arrays; H is broadcast to the shape of B, so one field sweep can be shared
+# by stacked loops
+def _branches(H_forward, B_forward, H_reverse, B_reverse):
+    B_forward = np.asarray(B_forward, dtype=float)
+    B_reverse = np.asarray(B_reverse, dtype=float)
+    H_forward = np.broadcast_to(np.asarray(H_forward, dtype=float), B_forward.shape)
+    H_reverse = np.broadcast_to(np.asarray(H_reverse, dtype=float), B_reverse.shape)
+    return H_forward, B_forward, H_reverse, B_reverse
+
+
+def _value(array):
+    return float(array) if np.ndim(array) == 0 else array
+
+
+# Area enclosed by the loop (shoelace formula over the forward branch followed by the reverse branch)
+def loop_area(H_forward, B_forward, H_reverse, B_reverse):
+    H_forward, B_forward, H_reverse, B_reverse = _branches(H_forward, B_forward, H_reverse, B_reverse)
+    H = np.concatenate((H_forward, H_reverse), axis=-1)
+    B = np.concatenate((B_forward, B_reverse), axis=-1)
+    return _value(0.5 * np.abs(np.sum(H * np.roll(B, -1, axis=-1) - B * np.roll(H, -1, axis=-1), axis=-1)))
+
+
+# Largest differential permeability dB/dH of a branch. Steps with a negligible change of H (at the loop tips)
+# are skipped.
+def max_permeability(H, B):
+    dH = np.diff(H, axis=-1)
+    dB = np.diff(B, axis=-1)
+    scale = np.max(np.abs(H), axis=-1, keepdims=True)
+    valid = np.abs(dH) > 1e-9 * scale
+    slope = np.where(valid, dB / np.where(valid, dH, 1.0), -np.inf)
+    return _value(np.max(slope, axis=-1))
+
+
+# Parameters of one loop (1-D branches) or of stacked loops (2-D branches, one loop per row)
+def loop_metrics(H_forward, B_forward, H_reverse, B_reverse):
+    H_forward, B_forward, H_reverse, B_reverse = _branches(H_forward, B_forward, H_reverse, B_reverse)
+    coercivity_forward = zero_crossing(H_forward, B_forward)
+    coercivity_reverse = zero_crossing(H_reverse, B_reverse)
+    remanence_forward = zero_crossing(B_forward, H_forward)
+    remanence_reverse = zero_crossing(B_reverse, H_reverse)
+    remanence = _value(0.5 * (np.abs(remanence_forward) + np.abs(remanence_reverse)))
+    B_max = _value(np.maximum(np.max(np.abs(B_forward), axis=-1), np.max(np.abs(B_reverse), axis=-1)))
+    return LoopMetrics(
+        coercivity=_value(0.5 * (np.abs(coercivity_forward) + np.abs(coercivity_reverse))),
+        coercivity_forward=coercivity_forward, coercivity_reverse=coercivity_reverse,
+        remanence=remanence, remanence_forward=remanence_forward, remanence_reverse=remanence_reverse,
+        H_max=_value(np.maximum(np.max(np.abs(H_forward), axis=-1), np.max(np.abs(H_reverse), axis=-1))),
+        B_max=B_max,
+        loop_area=loop_area(H_forward, B_forward, H_reverse, B_reverse),
+        max_permeability=_value(np.maximum(max_permeability(H_forward, B_forward),
+                                           max_permeability(H_reverse, B_reverse))),
+        squareness=_value(remanence / B_max))
+
+
+# Parameters of the smoothed loop of a result of compute_bh_loop or compute_cycle_average
+def result_metrics(result):
+    return loop_metrics(result.H_forward_smoothed, result.B_forward_smoothed, result.H_reverse_smoothed,
+                        result.B_reverse_smoothed)
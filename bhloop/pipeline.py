@@ -0,0 +1,351 @@
+#
+# Digital BH-loop algorithm: headless processing pipeline
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The functions in this module never plot, write files or print, so they can be called from the GUI, from scripts,
+# notebooks or worker processes without a display.
+#
+
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+from .drift import estimate_ground
+from .integration import cumulative_integral, ground_integral
+from .profiling import count, stage
+from .sinefit import FIT_METHODS, fft_fit_sinusoid
+from .vertices import detect_vertices
+
+pi = np.pi  # pi-constant 3.1415....
+
+# Alignment of the branches to the reference times: 'sample' (branches start at the samples int(t / dt)) or
+# 'subsample' (the response is interpolated so that the branches start exactly at t1 and t2)
+ALIGNMENT_MODES = ('sample', 'subsample')
+
+
+# Results of processing one capture: fitted sinusoid parameters, reference points and the BH curves
+@dataclass
+class BHLoopResult:
+    time: np.ndarray  # Time values based on the time increment
+    sinusoid_fit: np.ndarray  # Fitted sinusoid curve
+    A0: float  # Estimated amplitude
+    f0: float  # Estimated frequency (Hz)
+    ph0: float  # Estimated phase (rads)
+    A_fit: float  # Fitted amplitude
+    f_fit: float  # Fitted frequency (Hz)
+    ph_fit: float  # Fitted phase (rads)
+    scenario: int  # 1 if the sinusoid starts from a non-negative value, otherwise 2
+    t1: float  # Reference times (s)
+    t2: float
+    t3: float
+    refindex1: int  # Indexes corresponding to the reference time moments
+    refindex2: int
+    refindex3: int
+    groundf: float  # Ground offsets of the forward and reverse branches (entered or estimated)
+    groundr: float
+    H_forward: np.ndarray  # Rescaled and shifted BH curves before smoothing
+    B_forward: np.ndarray
+    H_reverse: np.ndarray
+    B_reverse: np.ndarray
+    con_forward: str  # Concavity direction of the forward BH curve ('up' or 'down')
+    con_reverse: str  # Concavity direction of the reverse BH curve ('up' or 'down')
+    H_forward_smoothed: np.ndarray  # Smoothed BH curves of equal length
+    B_forward_smoothed: np.ndarray
+    H_reverse_smoothed: np.ndarray
+    B_reverse_smoothed: np.ndarray
+
+    @property
+    def ph_degrees(self):
+        return np.degrees(self.ph_fit)
+
+
+# Sinusoidal function used in the fitting
+def sinusoid(t, A, f, phase):
+    return A * np.sin(2 * pi * f * t + phase)
+
+
+# Function for computing the moving average
+def moving_average(data, window_size):
+    cumsum = np.cumsum(data, axis=-1)
+    cumsum[..., window_size:] = cumsum[..., window_size:] - cumsum[..., :-window_size]
+    return cumsum[..., window_size - 1:] / window_size
+
+
+# Linear interpolation of the samples at fractional indexes (positions of any shape)
+def interpolate_samples(values, positions):
+    index = np.clip(np.floor(positions).astype(np.int64), 0, len(values) - 2)
+    fraction = positions - index
+    return values[index] * (1.0 - fraction) + values[index + 1] * fraction
+
+
+# Initial estimation of the sinusoid amplitude, frequency and phase from the first positive and negative vertices.
+# Returns A0, f0, ph0 and the scenario (1 if the sinusoid starts from a non-negative value, otherwise 2).
+def estimate_sinusoid(sin_values, time_increment):
+    vertices = detect_vertices(sin_values)
+
+    # Scenarios for selecting sine wave vertices
+    scenario = 1 if sin_values[0] >= 0 else 2
+
+    # The first vertex of the opposite sign to the starting value, and the next vertex after it.
+    # Average indices for the sets of points near the vertices are found by detect_vertices.
+    first, second = (vertices.negative, vertices.positive) if scenario == 1 else (vertices.positive,
+                                                                                  vertices.negative)
+    following = second[second > first[0]] if len(first) > 0 else second[:0]
+    if len(following) == 0:
+        raise ValueError('The record must contain a positive and a negative vertex after the first sign change')
+    if scenario == 1:
+        negative_set_aver, positive_set_aver = float(first[0]), float(following[0])
+    else:
+        positive_set_aver, negative_set_aver = float(first[0]), float(following[0])
+
+    # Integer indices for the found negative and positive sinusoid vertices
+    pvertex = int(positive_set_aver)
+    nvertex = int(negative_set_aver)
+
+    # Estimations of the period (T0) and frequency (f0) of the sinusoid
+    T0 = abs(positive_set_aver - negative_set_aver) * time_increment * 2
+    f0 = 1 / T0
+
+    # Improving A0: average amplitude of the sinusoid calculated from two vertices
+    A0 = (sin_values[pvertex] - sin_values[nvertex]) / 2.0
+
+    # Estimation of the sinusoid phase (ph0) in radians
+    # Only positive phase will be used (anticlockwise rotation)
+    qT = int(abs(pvertex - nvertex) / 2)  # Index difference for the quarter period
+    value = max(-1.0, min(sin_values[0] / A0, 1.0))  # Normalising the zero-index value and clamping it to [-1, 1]
+    phase = np.arcsin(value)  # Phase calculated from the arcsin function in the range [-pi/2, pi/2]
+    if scenario == 1:  # First scenario sin_values[0] >= 0
+        if sin_values[qT] >= 0:
+            ph0 = phase  # First quarter
+        else:
+            ph0 = pi - phase  # Second quarter
+    else:  # Second scenario sin_values[0] <= 0
+        if sin_values[qT] <= 0:
+            ph0 = pi - phase  # Third quarter
+        else:
+            ph0 = 2.0 * pi + phase  # Fourth quarter
+
+    return float(A0), float(f0), float(ph0), scenario
+
+
+# Fitting the sinusoid values to the sinusoid starting from the estimated parameters p0 = [A0, f0, ph0]
+def fit_sinusoid(time, sin_values, p0):
+    params, covariance, info, message, status = curve_fit(sinusoid, time, sin_values, p0=p0, full_output=True)
+    count('fit_evaluations', int(info['nfev']))
+    A_fit, f_fit, ph_fit = params
+    return float(A_fit), float(f_fit), float(ph_fit)
+
+
+# Estimated and fitted sinusoid parameters with the chosen method ('fft' or 'curve_fit').
+# Returns (A0, f0, ph0), (A_fit, f_fit, ph_fit) and the scenario.
+def fit_excitation(time, sin_values, time_increment, method='fft'):
+    if method not in FIT_METHODS:
+        raise ValueError('Unknown fitting method {!r}, expected one of {}'.format(method, FIT_METHODS))
+    if method == 'curve_fit':
+        with stage('vertices'):
+            A0, f0, ph0, scenario = estimate_sinusoid(sin_values, time_increment)
+        return (A0, f0, ph0), fit_sinusoid(time, sin_values, [A0, f0, ph0]), scenario
+
+    # Scenarios for selecting sine wave vertices
+    scenario = 1 if sin_values[0] >= 0 else 2
+    estimated, fitted = fft_fit_sinusoid(time, sin_values, time_increment)
+    return estimated, fitted, scenario
+
+
+# Calculation of the reference time points t123 used in the numerical integration.
+# The phase is first brought to the range where t1 is the first reference point after the record start:
+# [-pi/2, 3*pi/2) in the first scenario and [pi/2, 5*pi/2) in the second one.
+# Arrays of parameters and scenarios (one per record) give arrays of the reference times.
+def reference_times(f_fit, ph_fit, scenario):
+    first = np.equal(scenario, 1)  # First scenario sin_values[0] >= 0, second scenario sin_values[0] <= 0
+    lower = np.where(first, -0.5 * pi, 0.5 * pi)
+    ph_fit = (ph_fit - lower) % (2.0 * pi) + lower
+    t1 = (np.where(first, 3.0 * pi / 2.0, 5.0 * pi / 2.0) - ph_fit) / (2.0 * pi * f_fit)
+    t2 = (np.where(first, 5.0 * pi / 2.0, 7.0 * pi / 2.0) - ph_fit) / (2.0 * pi * f_fit)
+    t3 = t2 + 0.5 / f_fit
+    if np.ndim(t1) == 0:
+        return float(t1), float(t2), float(t3)
+    return t1, t2, t3
+
+
+# Vertical shift of a BH curve defined by the direction of its concavity.
+# B = a + b * H is the straight line between the BH curve ends.
+# For 2-D input every row is a separate curve and an array of concavity directions is returned; rows padded at the
+# end are described by their lengths.
+def shift_branch(H, B, lengths=None):
+    if lengths is None:
+        l = B.shape[-1]
+        H_first, H_last = H[..., 0], H[..., l - 1]
+        B_first, B_last = B[..., 0], B[..., l - 1]
+        B_middle = B[..., int(l / 2)]
+    else:
+        l = np.asarray(lengths)[..., np.newaxis]
+        H_first, H_last = H[..., 0], np.take_along_axis(H, l - 1, -1)[..., 0]
+        B_first, B_last = B[..., 0], np.take_along_axis(B, l - 1, -1)[..., 0]
+        B_middle = np.take_along_axis(B, l // 2, -1)[..., 0]
+    b = (B_last - B_first) / (H_last - H_first)
+    a = (B_first * H_last - B_last * H_first) / (H_last - H_first)
+    # Direction of the concavity
+    down = (a + b * (H_last - H_first) / 2) >= B_middle
+
+    shift = np.where(down, -1.0, 1.0) * np.abs(B_first - B_last) / 2
+    B = B + np.expand_dims(shift, -1)
+    concavity = np.where(down, 'down', 'up')
+    if concavity.ndim == 0:
+        concavity = str(concavity)
+    return B, concavity
+
+
+# Reference indexes of the time points t123 in a record of N points
+def reference_indices(t1, t2, t3, dt, N):
+    refindex1 = int(t1 / dt)
+    refindex2 = int(t2 / dt)
+    refindex3 = int(t3 / dt)
+    if not 0 <= refindex1 < refindex2 < refindex3 <= N:
+        raise ValueError('The record does not contain a full period between the reference points '
+                         '(indexes {}, {}, {} for {} points)'.format(refindex1, refindex2, refindex3, N))
+    return refindex1, refindex2, refindex3
+
+
+# Samples of the branches: the record itself with the reference indexes (alignment 'sample'), or the response
+# interpolated at t1 + k * branch_dt, k = 0 .. 2n - 1 (alignment 'subsample'), where n is the number of samples in
+# a half period and branch_dt = (t2 - t1) / n. The forward and reverse branches then start exactly at t1 and t2 and
+# have the same length. fitted = (A_fit, f_fit, ph_fit) gives the exact H at the interpolated times.
+# Returns the response, the fitted sinusoid, the time increment and the indexes of the branches in these arrays.
+def branch_samples(response_values, sinusoid_fit, refindexes, t1, t2, dt, fitted, alignment='sample'):
+    if alignment not in ALIGNMENT_MODES:
+        raise ValueError('Unknown alignment {!r}, expected one of {}'.format(alignment, ALIGNMENT_MODES))
+    if alignment == 'sample':
+        return response_values, sinusoid_fit, dt, tuple(refindexes)
+
+    branch_points = int(round((t2 - t1) / dt))
+    branch_dt = (t2 - t1) / max(branch_points, 1)
+    times = t1 + np.arange(2 * branch_points) * branch_dt
+    if branch_points < 2 or t1 < 0 or times[-1] > (len(response_values) - 1) * dt:
+        raise ValueError('The record does not contain a full period after the reference time t1 = {} s'.format(t1))
+    return (interpolate_samples(response_values, times / dt), sinusoid(times, *fitted), branch_dt,
+            (0, branch_points, 2 * branch_points))
+
+
+# Forward (reference indexes 1 to 2) and reverse (reference indexes 2 to 3) integrals of the voltage response
+# without the ground offsets, which are applied by scale_branches
+def branch_integrals(response_values, refindex1, refindex2, refindex3, dt, integration_mode='trapezoid'):
+    raw_forward = cumulative_integral(response_values[refindex1:refindex2], dt, mode=integration_mode)
+    raw_reverse = cumulative_integral(response_values[refindex2:refindex3], dt, mode=integration_mode)
+    return raw_forward, raw_reverse
+
+
+# Ground offsets, B and H scales and the vertical shifts of the BH curves.
+# H values are taken from the fitting sinusoid.
+def scale_branches(raw_forward, raw_reverse, sinusoid_fit, refindex1, refindex2, refindex3, dt, B_scale=1.0,
+                   H_scale=1.0, groundf=0.0, groundr=0.0, integration_mode='trapezoid'):
+    B_forward = raw_forward - groundf * ground_integral(len(raw_forward), dt, integration_mode)
+    B_reverse = raw_reverse - groundr * ground_integral(len(raw_reverse), dt, integration_mode)
+
+    # Rescaling the magnetic induction B and the field H from the data values
+    B_forward = B_forward * B_scale
+    H_forward = -sinusoid_fit[refindex1:refindex2] * H_scale
+    B_reverse = B_reverse * B_scale
+    H_reverse = -sinusoid_fit[refindex2:refindex3] * H_scale
+
+    # Vertical shifts of the BH curves
+    B_forward, con_forward = shift_branch(H_forward, B_forward)
+    B_reverse, con_reverse = shift_branch(H_reverse, B_reverse)
+    return H_forward, B_forward, H_reverse, B_reverse, con_forward, con_reverse
+
+
+# Smoothing the data using moving averages and trimming the arrays to the minimum length
+def smooth_loop(H_forward, B_forward, H_reverse, B_reverse, window=3):
+    smoothed = [moving_average(values, window) for values in (H_forward, B_forward, H_reverse, B_reverse)]
+    min_length = min(len(values) for values in smoothed)
+    return [values[:min_length] for values in smoothed]
+
+
+# Uniform H grid of the given number of points over the range covered by both branches
+def h_grid(H_forward, H_reverse, points):
+    low = max(np.min(H_forward), np.min(H_reverse))
+    high = min(np.max(H_forward), np.max(H_reverse))
+    if points < 2 or not low < high:
+        raise ValueError('Cannot build an H grid of {} points between {} and {}'.format(points, low, high))
+    return np.linspace(low, high, points)
+
+
+# B of a branch interpolated at the H grid. The grid is returned in the direction of the branch (decreasing H for
+# the forward branch), so the resampled loop is drawn and evaluated like the original one.
+def resample_branch(H, B, grid):
+    order = np.argsort(H, kind='stable')
+    B_grid = np.interp(grid, H[order], B[order])
+    if H[-1] < H[0]:
+        return grid[::-1], B_grid[::-1]
+    return grid, B_grid
+
+
+# Resampling both smoothed branches onto a shared H grid: fixed-size outputs that can be compared and averaged
+# point by point between runs, independently of the sampling rate
+def resample_loop(H_forward, B_forward, H_reverse, B_reverse, points):
+    grid = h_grid(H_forward, H_reverse, points)
+    return [*resample_branch(H_forward, B_forward, grid), *resample_branch(H_reverse, B_reverse, grid)]
+
+
+# Full processing of one capture.
+# response: values proportional to the induction B; excitation: sinusoid values proportional to the field H;
+# dt: time increment (s); window: moving average window; groundf/groundr: ground offsets of the forward/reverse
+# branches; fit_method: 'fft' (closed-form estimator) or 'curve_fit' (vertex search and scipy curve_fit);
+# ground_method: 'manual' (groundf/groundr as given), 'closure' or 'periods' (offsets estimated from the record);
+# alignment: 'sample' or 'subsample' (branches interpolated to start exactly at t1 and t2); grid_points: number of
+# points of the shared H grid the smoothed branches are resampled onto (None keeps the smoothed samples).
+def compute_bh_loop(response, excitation, dt, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0, groundr=0.0,
+                    integration_mode='trapezoid', fit_method='fft', ground_method='manual', alignment='sample',
+                    grid_points=None):
+    response_values = np.asarray(response, dtype=float)
+    sin_values = np.asarray(excitation, dtype=float)
+    if response_values.shape != sin_values.shape or response_values.ndim != 1:
+        raise ValueError('The response and excitation must be 1-D arrays of equal length')
+    N = len(sin_values)  # Number of points in each column
+    count('samples', N)
+
+    # Time values based on the time increment
+    time = np.arange(N) * dt
+
+    # Estimated and fitted sinusoid parameters
+    with stage('fit'):
+        (A0, f0, ph0), (A_fit, f_fit, ph_fit), scenario = fit_excitation(time, sin_values, dt, fit_method)
+        sinusoid_fit = sinusoid(time, A_fit, f_fit, ph_fit)
+
+    # Reference time points and the corresponding indexes
+    with stage('indices'):
+        t1, t2, t3 = reference_times(f_fit, ph_fit, scenario)
+        refindex1, refindex2, refindex3 = reference_indices(t1, t2, t3, dt, N)
+        branch_response, branch_sinusoid, branch_dt, branch_indexes = branch_samples(
+            response_values, sinusoid_fit, (refindex1, refindex2, refindex3), t1, t2, dt, (A_fit, f_fit, ph_fit),
+            alignment)
+
+    # Integration of the voltage response, ground offsets, scales and vertical shifts of the BH curves
+    with stage('integral'):
+        raw_forward, raw_reverse = branch_integrals(branch_response, *branch_indexes, branch_dt, integration_mode)
+    if ground_method != 'manual':
+        with stage('ground'):
+            groundf, groundr = estimate_ground(ground_method, response_values, raw_forward, raw_reverse, dt, t1,
+                                               f_fit, integration_mode, branch_dt=branch_dt)
+    with stage('scale'):
+        H_forward, B_forward, H_reverse, B_reverse, con_forward, con_reverse = scale_branches(
+            raw_forward, raw_reverse, branch_sinusoid, *branch_indexes, branch_dt, B_scale, H_scale,
+            groundf, groundr, integration_mode)
+
+    # Smoothed and trimmed curves, optionally resampled onto the H grid
+    with stage('smooth'):
+        H_forward_smoothed, B_forward_smoothed, H_reverse_smoothed, B_reverse_smoothed = smooth_loop(
+            H_forward, B_forward, H_reverse, B_reverse, window)
+    if grid_points:
+        with stage('resample'):
+            H_forward_smoothed, B_forward_smoothed, H_reverse_smoothed, B_reverse_smoothed = resample_loop(
+                H_forward_smoothed, B_forward_smoothed, H_reverse_smoothed, B_reverse_smoothed, grid_points)
+
+    return BHLoopResult(
+        time=time, sinusoid_fit=sinusoid_fit, A0=A0, f0=f0, ph0=ph0, A_fit=A_fit, f_fit=f_fit, ph_fit=ph_fit,
+        scenario=scenario, t1=t1, t2=t2, t3=t3, refindex1=refindex1, refindex2=refindex2, refindex3=refindex3,
+        groundf=groundf, groundr=groundr, H_forward=H_forward, B_forward=B_forward, H_reverse=H_reverse,
+        B_reverse=B_reverse, con_forward=con_forward, con_reverse=con_reverse,
+        H_forward_smoothed=H_forward_smoothed, B_forward_smoothed=B_forward_smoothed,
+        H_reverse_smoothed=H_reverse_smoothed, B_reverse_smoothed=B_reverse_smoothed)
@@ -0,0 +1,71 @@
+#
+# Digital BH-loop algorithm: plots of the processing results
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The functions draw into the given matplotlib axes, so the caller decides whether the figure is shown, saved or
+# embedded into a window.
+#
+
+import numpy as np
+
+
+# Plot the original data and the fitted curve with vertical lines at t1, t2, and t3
+def plot_sinusoid_fit(ax, sin_values, result):
+    ax.scatter(result.time, sin_values, label='Original Data', color='blue', marker='o')
+    ax.plot(result.time, result.sinusoid_fit, label='Fitted Sinusoid', color='red')
+
+    ax.axvline(x=result.t1, color='green', linestyle='--', label='t1')
+    ax.axvline(x=result.t2, color='purple', linestyle='--', label='t2')
+    ax.axvline(x=result.t3, color='orange', linestyle='--', label='t3')
+
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Amplitude')
+    ax.set_title('Sinusoidal Fit with Reference Points t1, t2, and t3')
+    ax.legend()
+    ax.grid(True)
+
+
+# Graph of the smoothed BH curves.
+# For the results averaged over all periods, the spread of B over the periods is shown as a shaded band.
+def plot_smoothed_loop(ax, result):
+    ax.plot(result.H_forward_smoothed, result.B_forward_smoothed, label='Smoothed B_forward vs. H_forward',
+            color='blue')
+    ax.plot(result.H_reverse_smoothed, result.B_reverse_smoothed, label='Smoothed B_reverse vs. H_reverse',
+            color='red')
+    if hasattr(result, 'n_periods'):
+        ax.fill_between(result.H_forward_smoothed, result.B_forward_smoothed - result.B_forward_spread,
+                        result.B_forward_smoothed + result.B_forward_spread, color='blue', alpha=0.2)
+        ax.fill_between(result.H_reverse_smoothed, result.B_reverse_smoothed - result.B_reverse_spread,
+                        result.B_reverse_smoothed + result.B_reverse_spread, color='red', alpha=0.2,
+                        label='Spread over {} periods'.format(result.n_periods))
+    ax.set_xlabel('H (A/m)')
+    ax.set_ylabel('B (T)')
+    ax.set_title('Smoothed Magnetic Hysteresis Loop')
+    ax.legend()
+    ax.grid(True)
+
+
+# Smoothed loops of a frequency sweep drawn over each other, coloured from the lowest to the highest frequency.
+# loops: dicts with the smoothed branches (as read from the result store); frequencies: fitted frequencies (Hz).
+def plot_sweep_loops(ax, loops, frequencies):
+    from matplotlib import colormaps
+
+    colors = colormaps['viridis'](np.linspace(0.0, 1.0, max(len(loops), 1)))
+    for loop, frequency, color in zip(loops, frequencies, colors):
+        ax.plot(loop['H_forward_smoothed'], loop['B_forward_smoothed'], color=color,
+                label='{:.4g} kHz'.format(frequency / 1e3))
+        ax.plot(loop['H_reverse_smoothed'], loop['B_reverse_smoothed'], color=color)
+    ax.set_xlabel('H (A/m)')
+    ax.set_ylabel('B (T)')
+    ax.set_title('Hysteresis Loops of the Frequency Sweep')
+    ax.legend()
+    ax.grid(True)
+
+
+# Loop parameter of a frequency sweep against the fitted frequency
+def plot_sweep_parameter(ax, frequencies, values, label, title, color='blue'):
+    ax.plot(np.asarray(frequencies) / 1e3, values, marker='o', color=color, label=label)
+    ax.set_xlabel('Frequency (kHz)')
+    ax.set_ylabel(label)
+    ax.set_title(title)
+    ax.grid(True)
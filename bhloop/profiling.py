@@ -0,0 +1,184 @@
+#
+# Digital BH-loop algorithm: stage timing, peak memory and counters of the processing
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The processing functions mark their stages with "with stage('fit'):" and report counters with
+# count('samples', N). These calls only record anything inside "with Profiler() as profiler:"; otherwise stage()
+# returns a shared empty context and count() returns at once, so the instrumentation costs nothing measurable.
+# The active profiler is kept in a context variable, so threads and worker processes do not mix their records.
+# A StageMonitor receives the name of every stage as it starts (e.g. to drive a progress bar, or to stop a run at
+# the next stage by raising an exception from the callback), with or without a profiler.
+#
+# Usage:
+#   with Profiler(memory=True, cprofile=True) as profiler:
+#       result = compute_bh_loop(response, excitation, dt)
+#   profiler.write_json('profile.json')
+#   profiler.dump_cprofile('profile.prof')
+#   print(format_breakdown(profiler.report()))
+#
+
+import cProfile
+import contextvars
+import json
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+_active = contextvars.ContextVar('bhloop_profiler', default=None)
+_monitor = contextvars.ContextVar('bhloop_stage_monitor', default=None)
+_null_stage = nullcontext()
+
+
+# Context of one processing stage: time, number of calls and peak memory of the active profiler
+def stage(name):
+    monitor = _monitor.get()
+    if monitor is not None:
+        monitor.callback(name)
+    profiler = _active.get()
+    if profiler is None:
+        return _null_stage
+    return _Stage(profiler, name)
+
+
+# Adding value to a counter of the active profiler (samples processed, periods found, fit iterations, ...)
+def count(name, value=1):
+    profiler = _active.get()
+    if profiler is not None:
+        profiler.counters[name] = profiler.counters.get(name, 0) + value
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.peak = 0
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.memory:
+            # The peak reached so far belongs to the enclosing stage, then the peak is measured anew
+            if profiler.stack:
+                parent = profiler.stack[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler.stack.pop()
+        record = profiler.stages.setdefault(self.name, {'calls': 0, 'seconds': 0.0, 'peak_memory_bytes': 0})
+        record['calls'] += 1
+        record['seconds'] += seconds
+        if profiler.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record['peak_memory_bytes'] = max(record['peak_memory_bytes'], self.peak)
+            if profiler.stack:
+                parent = profiler.stack[-1]
+                parent.peak = max(parent.peak, self.peak)
+        return False
+
+
+# Collector of the stage records and counters. memory=True traces the peak memory of every stage with tracemalloc
+# (which slows the processing down); cprofile=True also runs cProfile for dump_cprofile.
+class Profiler:
+    def __init__(self, memory=False, cprofile=False):
+        self.memory = memory
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.stages = {}
+        self.counters = {}
+        self.stack = []
+        self.seconds = 0.0
+        self.peak_memory_bytes = 0
+        self._token = None
+        self._tracing = False
+
+    def __enter__(self):
+        self._token = _active.set(self)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self.start = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.seconds += time.perf_counter() - self.start
+        if self.memory:
+            self.peak_memory_bytes = max(self.peak_memory_bytes, tracemalloc.get_traced_memory()[1],
+                                         *(record['peak_memory_bytes'] for record in self.stages.values()))
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+        _active.reset(self._token)
+        return False
+
+    # Stage records, counters and totals as a dictionary for JSON
+    def report(self):
+        report = {'total_seconds': self.seconds, 'stages': self.stages, 'counters': self.counters}
+        if self.memory:
+            report['peak_memory_bytes'] = self.peak_memory_bytes
+        return report
+
+    def write_json(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    # cProfile statistics readable by pstats or snakeviz
+    def dump_cprofile(self, path):
+        if self.cprofile is None:
+            raise ValueError('The profiler was created without cprofile=True')
+        self.cprofile.dump_stats(path)
+
+
+# Observer of the stage starts: callback(name) is called as every stage begins, in the thread running the stages.
+# An exception raised by the callback propagates out of the processing function.
+class StageMonitor:
+    def __init__(self, callback):
+        self.callback = callback
+        self._token = None
+
+    def __enter__(self):
+        self._token = _monitor.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _monitor.reset(self._token)
+        return False
+
+
+# Text table of the stage times (and peak memory) of a report, largest first
+def format_breakdown(report):
+    total = report['total_seconds'] or float('nan')
+    lines = ['{:>12s} {:>6s} {:>11s} {:>7s} {:>11s}'.format('stage', 'calls', 'time', 'share', 'peak memory')]
+    for name, record in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+        memory = '{:8.1f} MB'.format(record['peak_memory_bytes'] / 2 ** 20) if 'peak_memory_bytes' in report else ''
+        lines.append('{:>12s} {:>6d} {:>8.2f} ms {:>6.1f}% {:>11s}'.format(
+            name, record['calls'], record['seconds'] * 1e3, 100.0 * record['seconds'] / total, memory))
+    lines.append('{:>12s} {:>6s} {:>8.2f} ms'.format('total', '', report['total_seconds'] * 1e3))
+    for name, value in sorted(report['counters'].items()):
+        lines.append('{:>15s} = {}'.format(name, value))
+    return '\n'.join(lines)
+
+
+# Sum of several reports (e.g. of the files of a batch): times, calls and counters are added, the peaks are the
+# largest ones
+def merge_reports(reports):
+    merged = {'total_seconds': 0.0, 'stages': {}, 'counters': {}}
+    for report in reports:
+        merged['total_seconds'] += report['total_seconds']
+        if 'peak_memory_bytes' in report:
+            merged['peak_memory_bytes'] = max(merged.get('peak_memory_bytes', 0), report['peak_memory_bytes'])
+        for name, record in report['stages'].items():
+            total = merged['stages'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_memory_bytes': 0})
+            total['calls'] += record['calls']
+            total['seconds'] += record['seconds']
+            total['peak_memory_bytes'] = max(total['peak_memory_bytes'], record['peak_memory_bytes'])
+        for name, value in report['counters'].items():
+            merged['counters'][name] = merged['counters'].get(name, 0) + value
+    return merged
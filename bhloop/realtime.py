@@ -0,0 +1,339 @@
+#
+# Digital BH-loop algorithm: real-time acquisition pipeline with a live loop display
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# A frame source (the oscilloscope driver, or the file replay simulator below for testing without hardware) is read
+# by an acquisition thread. A worker thread fits and integrates every frame, and the live view polls the latest
+# result from the Tk event loop, so neither the acquisition nor the processing blocks the window. Frames are
+# dropped (and counted) if the processing does not keep up with the acquisition.
+#
+# Usage (from the repository root):
+#   python -m bhloop.realtime "Experimental data/Test1.csv" --time-increment 1e-8 --rate 50 --fps 20
+#   python -m bhloop.realtime "Experimental data/Test1.csv" --time-increment 1e-8 --headless --frames 500
+#
+
+import argparse
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+from .cycles import compute_cycle_average
+from .drift import GROUND_METHODS
+from .files import load_capture
+from .pipeline import ALIGNMENT_MODES, compute_bh_loop
+
+STAGES = ('acquire', 'queue', 'process', 'display', 'total')  # Stages with the measured latency
+
+
+# One frame of the acquisition
+@dataclass
+class Frame:
+    index: int  # Frame number counted from the start of the acquisition
+    response: np.ndarray
+    excitation: np.ndarray
+    time_increment: float
+    acquired: float = 0.0  # time.perf_counter() when the frame was acquired
+
+
+# Frame source replaying a capture file at the given frame rate, so the pipeline can be tested without hardware.
+# Every frame is frame_size points of the record (the whole record by default); the record is repeated endlessly
+# unless frames limits the number of frames. Small noise can be added to make the frames differ.
+# Any object with the read() method returning a Frame (or None at the end) and close() can be used as a source.
+class FileReplaySource:
+    def __init__(self, file_name, time_increment, rate=20.0, frame_size=None, frames=None, noise=0.0, seed=None):
+        self.response, self.excitation = load_capture(file_name, cache=True)
+        self.time_increment = time_increment
+        self.period = 1.0 / rate if rate else 0.0  # Time between the frames (s)
+        self.frame_size = frame_size or len(self.response)
+        self.frames = frames
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.index = 0
+        self.next_time = None
+
+    def read(self):
+        if self.frames is not None and self.index >= self.frames:
+            return None
+
+        # Waiting for the acquisition time of the next frame
+        now = time.perf_counter()
+        if self.next_time is None:
+            self.next_time = now
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time += self.period
+
+        start = (self.index * self.frame_size) % len(self.response)
+        positions = (start + np.arange(self.frame_size)) % len(self.response)
+        response = self.response[positions]
+        excitation = self.excitation[positions]
+        if self.noise:
+            response = response + self.noise * np.std(response) * self.rng.standard_normal(self.frame_size)
+        frame = Frame(self.index, response, excitation, self.time_increment)
+        self.index += 1
+        return frame
+
+    def close(self):
+        pass
+
+
+# Latency of the pipeline stages over the last frames (thread-safe)
+class LatencyStats:
+    def __init__(self, size=500):
+        self.lock = threading.Lock()
+        self.values = {stage: deque(maxlen=size) for stage in STAGES}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.values[stage].append(seconds)
+
+    # Mean, 95th percentile and maximum of every stage (ms)
+    def summary(self):
+        with self.lock:
+            values = {stage: np.array(items) for stage, items in self.values.items()}
+        return {stage: {'count': len(items),
+                        'mean_ms': float(np.mean(items)) * 1e3 if len(items) else float('nan'),
+                        'p95_ms': float(np.percentile(items, 95)) * 1e3 if len(items) else float('nan'),
+                        'max_ms': float(np.max(items)) * 1e3 if len(items) else float('nan')}
+                for stage, items in values.items()}
+
+
+# Producer/consumer pipeline: acquisition thread -> bounded frame queue -> processing thread -> latest result
+class AcquisitionPipeline:
+    def __init__(self, source, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0, groundr=0.0,
+                 integration_mode='trapezoid', fit_method='fft', all_periods=False, queue_size=2,
+                 ground_method='manual', alignment='sample', grid_points=None):
+        self.source = source
+        self.parameters = dict(B_scale=B_scale, H_scale=H_scale, window=window, groundf=groundf,
+                               groundr=groundr, integration_mode=integration_mode, fit_method=fit_method,
+                               ground_method=ground_method, alignment=alignment, grid_points=grid_points)
+        self.compute = compute_cycle_average if all_periods else compute_bh_loop
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.stats = LatencyStats()
+        self.lock = threading.Lock()
+        self.latest = None  # (frame, result) of the last processed frame
+        self.displayed_index = -1
+        self.acquired = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.started = None
+        self.stop_event = threading.Event()
+        self.finished = threading.Event()  # Set when the source is exhausted and all frames are processed
+        self.threads = []
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.threads = [threading.Thread(target=self._acquire, name='bh-acquire', daemon=True),
+                        threading.Thread(target=self._process, name='bh-process', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.source.close()
+
+    # Acquisition thread
+    def _acquire(self):
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            frame = self.source.read()
+            if frame is None:
+                break
+            frame.acquired = time.perf_counter()
+            self.stats.add('acquire', frame.acquired - start)
+            self.acquired += 1
+            self._put(frame)
+        self._put(None)  # End of the acquisition
+
+    # Putting into the frame queue, the oldest waiting frame is dropped when the queue is full
+    def _put(self, frame):
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    dropped = self.frames.get_nowait()
+                    if dropped is not None:
+                        self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    # Processing thread: fit and integration of every frame taken from the queue
+    def _process(self):
+        while not self.stop_event.is_set():
+            try:
+                frame = self.frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            start = time.perf_counter()
+            self.stats.add('queue', start - frame.acquired)
+            try:
+                result = self.compute(frame.response, frame.excitation, frame.time_increment, **self.parameters)
+            except Exception as error:
+                self.errors += 1
+                self.last_error = error
+                continue
+            self.stats.add('process', time.perf_counter() - start)
+            with self.lock:
+                self.latest = (frame, result)
+            self.processed += 1
+        self.finished.set()
+
+    # Latest processed frame and result not shown yet, or None
+    def take_latest(self):
+        with self.lock:
+            if self.latest is None or self.latest[0].index == self.displayed_index:
+                return None
+            self.displayed_index = self.latest[0].index
+            return self.latest
+
+    # Reporting that a frame has been drawn
+    def mark_displayed(self, frame, ready):
+        now = time.perf_counter()
+        self.stats.add('display', now - ready)
+        self.stats.add('total', now - frame.acquired)
+
+    # Acquisition and processing rates (frames/s) and the latency summary
+    def report(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9) if self.started else float('nan')
+        return {'elapsed_s': elapsed, 'acquired': self.acquired, 'processed': self.processed,
+                'dropped': self.dropped, 'errors': self.errors,
+                'acquisition_rate': self.acquired / elapsed, 'processing_rate': self.processed / elapsed,
+                'keeping_up': self.dropped == 0, 'stages': self.stats.summary()}
+
+
+# Text of the latency report
+def format_report(report):
+    lines = ['Acquired {acquired} frames, processed {processed}, dropped {dropped}, errors {errors} in '
+             '{elapsed_s:.2f} s'.format(**report),
+             'Acquisition rate = {:.1f} frames/s, processing rate = {:.1f} frames/s ({})'.format(
+                 report['acquisition_rate'], report['processing_rate'],
+                 'keeping up' if report['keeping_up'] else 'NOT keeping up')]
+    for stage, values in report['stages'].items():
+        if values['count']:
+            lines.append('{:>8s}: mean {:8.3f} ms   p95 {:8.3f} ms   max {:8.3f} ms'.format(
+                stage, values['mean_ms'], values['p95_ms'], values['max_ms']))
+    return '\n'.join(lines)
+
+
+# Live loop display embedded in a Tk window. The latest result is polled with root.after at the target frame
+# rate, so the Tk event loop is never blocked by the acquisition or the processing.
+class LiveLoopView:
+    def __init__(self, master, pipeline, fps=20.0):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+        import tkinter as tk
+
+        self.master = master
+        self.pipeline = pipeline
+        self.interval = max(int(1000.0 / fps), 1)  # Polling interval (ms)
+
+        self.figure = Figure(figsize=(8, 5))
+        self.ax = self.figure.add_subplot()
+        self.forward_line, = self.ax.plot([], [], color='blue', label='B_forward vs. H_forward')
+        self.reverse_line, = self.ax.plot([], [], color='red', label='B_reverse vs. H_reverse')
+        self.ax.set_xlabel('H (A/m)')
+        self.ax.set_ylabel('B (T)')
+        self.ax.set_title('Live Magnetic Hysteresis Loop')
+        self.ax.legend(loc='upper left')
+        self.ax.grid(True)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.status = tk.Label(master, text='Waiting for frames...', justify=tk.LEFT, font=('Courier', 9))
+        self.status.pack(fill=tk.X)
+        self.job = None
+
+    def start(self):
+        self.job = self.master.after(self.interval, self.update)
+
+    def stop(self):
+        if self.job is not None:
+            self.master.after_cancel(self.job)
+            self.job = None
+
+    def update(self):
+        latest = self.pipeline.take_latest()
+        if latest is not None:
+            frame, result = latest
+            ready = time.perf_counter()
+            self.forward_line.set_data(result.H_forward_smoothed, result.B_forward_smoothed)
+            self.reverse_line.set_data(result.H_reverse_smoothed, result.B_reverse_smoothed)
+            self.ax.relim()
+            self.ax.autoscale_view()
+            self.canvas.draw_idle()
+            self.pipeline.mark_displayed(frame, ready)
+            self.status.config(text=format_report(self.pipeline.report()))
+        self.job = self.master.after(self.interval, self.update)
+
+
+# Window with the live view of a pipeline; closing the window stops the pipeline
+def open_live_window(master, pipeline, fps=20.0, title='Live BH-loop'):
+    import tkinter as tk
+
+    window = tk.Toplevel(master) if master is not None else tk.Tk()
+    window.title(title)
+    view = LiveLoopView(window, pipeline, fps)
+
+    def close():
+        view.stop()
+        pipeline.stop()
+        print(format_report(pipeline.report()))
+        window.destroy()
+
+    window.protocol('WM_DELETE_WINDOW', close)
+    pipeline.start()
+    view.start()
+    return window
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Real-time BH-loop processing of a replayed capture')
+    parser.add_argument('file', help='capture file replayed as the frame source')
+    parser.add_argument('--time-increment', type=float, required=True, help='time increment (s)')
+    parser.add_argument('--rate', type=float, default=20.0, help='acquisition rate (frames/s), 0 for no limit')
+    parser.add_argument('--fps', type=float, default=20.0, help='target display frame rate')
+    parser.add_argument('--frame-size', type=int, help='points per frame (default: the whole record)')
+    parser.add_argument('--frames', type=int, help='number of frames (default: endless)')
+    parser.add_argument('--noise', type=float, default=0.0, help='relative noise added to the response')
+    parser.add_argument('--all-periods', action='store_true', help='average all periods of every frame')
+    parser.add_argument('--ground-method', choices=GROUND_METHODS, default='manual',
+                        help='ground offsets estimated in every frame (default: none)')
+    parser.add_argument('--alignment', choices=ALIGNMENT_MODES, default='sample',
+                        help='alignment of the branches to the reference times')
+    parser.add_argument('--grid-points', type=int, help='resample every loop onto an H grid of this many points')
+    parser.add_argument('--headless', action='store_true', help='no display, print the latency report')
+    args = parser.parse_args(argv)
+
+    source = FileReplaySource(args.file, args.time_increment, rate=args.rate, frame_size=args.frame_size,
+                              frames=args.frames if args.frames or not args.headless else 100, noise=args.noise)
+    pipeline = AcquisitionPipeline(source, all_periods=args.all_periods, ground_method=args.ground_method,
+                                   alignment=args.alignment, grid_points=args.grid_points)
+
+    if args.headless:
+        pipeline.start()
+        while not pipeline.finished.wait(0.05):
+            latest = pipeline.take_latest()
+            if latest is not None:
+                pipeline.mark_displayed(latest[0], time.perf_counter())
+        pipeline.stop()
+        print(format_report(pipeline.report()))
+        return
+
+    window = open_live_window(None, pipeline, fps=args.fps)
+    window.mainloop()
+
+
+if __name__ == '__main__':
+    main()
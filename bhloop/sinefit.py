@@ -0,0 +1,128 @@
+#
+# Digital BH-loop algorithm: closed-form sinusoid estimator
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The frequency is found from the interpolated peak of the FFT; the amplitude and phase at this frequency follow
+# from linear least squares, and a few Gauss-Newton steps refine all three parameters. Every step is a fixed
+# number of O(N) array operations, so the result does not depend on initial guesses.
+#
+
+import numpy as np
+from scipy.fft import next_fast_len, rfft
+
+from .profiling import count
+
+pi = np.pi  # pi-constant 3.1415....
+padding_limit = 1 << 16  # Records shorter than this are zero-padded before the FFT
+
+FIT_METHODS = ('fft', 'curve_fit')  # Sinusoid fitting methods: this estimator or scipy curve_fit
+
+
+# Frequency of the strongest spectral component from the Hann-windowed FFT.
+# Short records are zero-padded to four times their length; the peak position between the bins is interpolated
+# from the three largest magnitudes.
+# For 2-D input every row is a separate record: an array of frequencies is returned, with NaN for the rows
+# without a sinusoid.
+def fft_frequency(sin_values, time_increment):
+    y = np.asarray(sin_values, dtype=float)
+    N = y.shape[-1]
+    if N < 4:
+        raise ValueError('At least 4 points are needed to estimate the sinusoid frequency')
+    n_fft = next_fast_len(4 * N if N < padding_limit else N, real=True)
+    spectrum = np.abs(rfft((y - y.mean(axis=-1, keepdims=True)) * np.hanning(N), n=n_fft, axis=-1, workers=-1))
+    spectrum[..., 0] = 0.0  # Remaining DC component
+    k = np.argmax(spectrum[..., :-1], axis=-1)[..., np.newaxis]
+    centre = np.take_along_axis(spectrum, k, -1)[..., 0]
+    flat = (k[..., 0] == 0) | (centre == 0.0)
+    if y.ndim == 1 and flat:
+        raise ValueError('The excitation does not contain a sinusoid (flat signal)')
+
+    left = np.take_along_axis(spectrum, np.maximum(k - 1, 0), -1)[..., 0]
+    right = np.take_along_axis(spectrum, k + 1, -1)[..., 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = 2.0 * (right - left) / (left + 2.0 * centre + right)  # Peak position between the bins
+    frequency = np.where(flat, np.nan, (k[..., 0] + delta) / (n_fft * time_increment))
+    return _value(frequency)
+
+
+# Float for a single record, array for stacked records
+def _value(array):
+    return float(array) if np.ndim(array) == 0 else array
+
+
+# Dot products along the last axis (a stack of one row uses the same BLAS call as a single record)
+def _dot(u, v):
+    if np.ndim(u) == 1 and np.ndim(v) == 1:
+        return np.dot(u, v)
+    if len(u) == 1:
+        return np.dot(u[0], v[0])[np.newaxis]
+    return np.einsum('...i,...i->...', u, v)
+
+
+# Amplitude and phase of A * sin(2 * pi * f * t + phase) at the given frequency by linear least squares.
+# Returns A, phase (in the range [0, 2*pi)) and the coefficients a, b of the sine and cosine terms.
+# For stacked records (2-D sin_values), f holds one frequency per row and arrays are returned.
+def linear_sinusoid_fit(time, sin_values, f):
+    omega_t = 2.0 * pi * np.expand_dims(f, -1) * time
+    a, b = _linear_coefficients(np.sin(omega_t), np.cos(omega_t), sin_values)
+    return _value(np.hypot(a, b)), _value(np.arctan2(b, a) % (2.0 * pi)), a, b
+
+
+# Least-squares coefficients of y = a * sin_wt + b * cos_wt from the 2x2 normal equations
+def _linear_coefficients(sin_wt, cos_wt, y):
+    ss, sc, cc = _dot(sin_wt, sin_wt), _dot(sin_wt, cos_wt), _dot(cos_wt, cos_wt)
+    normal = np.stack([np.stack([ss, sc], -1), np.stack([sc, cc], -1)], -2)
+    coefficients = np.linalg.solve(normal, np.stack([_dot(sin_wt, y), _dot(cos_wt, y)], -1)[..., np.newaxis])
+    return coefficients[..., 0, 0], coefficients[..., 1, 0]
+
+
+# Gauss-Newton refinement of the sinusoid a * sin(wt) + b * cos(wt) with w = 2 * pi * f.
+# The three parameters (a, b, f) are updated together from the 3x3 normal equations, which are assembled from dot
+# products, until the relative frequency step drops below the tolerance (usually 2-5 steps when starting from the
+# FFT estimate). Stacked records (2-D sin_values) are refined together, and the converged rows are left out of
+# the following steps.
+def refine_sinusoid(time, sin_values, f, max_iterations=10, tolerance=1e-10):
+    y = np.asarray(sin_values, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    f = np.array(f, dtype=float, ndmin=1)
+    omega_t = 2.0 * pi * f[:, np.newaxis] * time
+    a, b = _linear_coefficients(np.sin(omega_t), np.cos(omega_t), y)
+    active = np.arange(len(f))  # Rows which have not converged yet
+    iteration = -1  # No steps with max_iterations=0: the linear fit at the starting frequency is returned
+    for iteration in range(max_iterations):
+        if len(active) == len(f):
+            active = slice(None)  # All rows, without copying the records
+        y_active, a_active, b_active = y[active], a[active, np.newaxis], b[active, np.newaxis]
+        omega_t = 2.0 * pi * f[active, np.newaxis] * time
+        sin_wt = np.sin(omega_t)
+        cos_wt = np.cos(omega_t)
+        residual = y_active - (a_active * sin_wt + b_active * cos_wt)
+        df_term = 2.0 * pi * time * (a_active * cos_wt - b_active * sin_wt)  # Derivative of the model with respect to f
+        columns = (sin_wt, cos_wt, df_term)
+        products = {(i, j): _dot(columns[i], columns[j]) for i in range(3) for j in range(i, 3)}  # Symmetric matrix
+        normal = np.stack([np.stack([products[min(i, j), max(i, j)] for j in range(3)], -1) for i in range(3)], -2)
+        step = np.linalg.solve(normal, np.stack([_dot(u, residual) for u in columns], -1)[..., np.newaxis])[..., 0]
+        a[active] += step[:, 0]
+        b[active] += step[:, 1]
+        f[active] += step[:, 2]
+        active = np.arange(len(f))[active][np.abs(step[:, 2]) > tolerance * np.abs(f[active])]
+        if len(active) == 0:
+            break
+    count('fit_iterations', iteration + 1)
+    A, ph = np.hypot(a, b), np.arctan2(b, a) % (2.0 * pi)
+    if single:
+        return float(A[0]), float(f[0]), float(ph[0])
+    return A, f, ph
+
+
+# Estimated (FFT peak and linear least squares) and refined sinusoid parameters.
+# Returns (A0, f0, ph0) and (A_fit, f_fit, ph_fit); arrays with one value per row for 2-D sin_values, where all
+# rows must contain a sinusoid.
+def fft_fit_sinusoid(time, sin_values, time_increment, max_iterations=10):
+    sin_values = np.asarray(sin_values, dtype=float)
+    f0 = fft_frequency(sin_values, time_increment)
+    if np.any(np.isnan(f0)):
+        raise ValueError('The excitation does not contain a sinusoid (flat signal)')
+    A0, ph0 = linear_sinusoid_fit(time, sin_values, f0)[:2]
+    return (A0, f0, ph0), refine_sinusoid(time, sin_values, f0, max_iterations)
@@ -0,0 +1,174 @@
+#
+# Digital BH-loop algorithm: processing of many records of the same length in one call
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The responses and excitations are (n_records, n_samples) arrays. The sinusoid fit, reference indexes,
+# integration, ground offsets and scales, vertical shifts and smoothing run along the last axis of these arrays,
+# without a Python loop over the records. The branches of the records have different lengths, so they are
+# returned padded to the longest one together with the lengths, and the smoothed curves as masked arrays.
+# Records where the sinusoid or a full period is not found are marked invalid instead of raising.
+#
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from .drift import estimate_ground
+from .integration import cumulative_integral, ground_integral
+from .pipeline import BHLoopResult, moving_average, reference_times, shift_branch, sinusoid
+from .profiling import count, stage
+from .sinefit import fft_frequency, linear_sinusoid_fit, refine_sinusoid
+
+
+# Results of stacked records: arrays with one value (or one row) per record
+@dataclass
+class StackedLoopResult:
+    time: np.ndarray
+    sinusoid_fit: np.ndarray  # (n_records, n_samples)
+    valid: np.ndarray  # False for the records without a sinusoid or a full period
+    A0: np.ndarray
+    f0: np.ndarray
+    ph0: np.ndarray
+    A_fit: np.ndarray
+    f_fit: np.ndarray
+    ph_fit: np.ndarray
+    scenario: np.ndarray
+    t1: np.ndarray
+    t2: np.ndarray
+    t3: np.ndarray
+    refindex1: np.ndarray
+    refindex2: np.ndarray
+    refindex3: np.ndarray
+    groundf: np.ndarray  # Ground offsets applied to every record (entered or estimated)
+    groundr: np.ndarray
+    forward_lengths: np.ndarray  # Points of the forward branch of every record
+    reverse_lengths: np.ndarray  # Points of the reverse branch of every record
+    H_forward: np.ndarray  # Branches padded to the longest one
+    B_forward: np.ndarray
+    H_reverse: np.ndarray
+    B_reverse: np.ndarray
+    con_forward: np.ndarray
+    con_reverse: np.ndarray
+    smoothed_lengths: np.ndarray  # Points of the smoothed and trimmed curves of every record
+    H_forward_smoothed: np.ma.MaskedArray
+    B_forward_smoothed: np.ma.MaskedArray
+    H_reverse_smoothed: np.ma.MaskedArray
+    B_reverse_smoothed: np.ma.MaskedArray
+
+    def __len__(self):
+        return len(self.valid)
+
+    # Result of one record in the form of compute_bh_loop, e.g. for write_signal_parameters and the plots
+    def record(self, i):
+        if not self.valid[i]:
+            raise ValueError('Record {} does not contain a sinusoid with a full period'.format(i))
+        lf, lr, ls = self.forward_lengths[i], self.reverse_lengths[i], self.smoothed_lengths[i]
+        return BHLoopResult(
+            time=self.time, sinusoid_fit=self.sinusoid_fit[i], A0=float(self.A0[i]), f0=float(self.f0[i]),
+            ph0=float(self.ph0[i]), A_fit=float(self.A_fit[i]), f_fit=float(self.f_fit[i]),
+            ph_fit=float(self.ph_fit[i]), scenario=int(self.scenario[i]), t1=float(self.t1[i]),
+            t2=float(self.t2[i]), t3=float(self.t3[i]), refindex1=int(self.refindex1[i]),
+            refindex2=int(self.refindex2[i]), refindex3=int(self.refindex3[i]), groundf=float(self.groundf[i]),
+            groundr=float(self.groundr[i]), H_forward=self.H_forward[i, :lf], B_forward=self.B_forward[i, :lf],
+            H_reverse=self.H_reverse[i, :lr], B_reverse=self.B_reverse[i, :lr],
+            con_forward=str(self.con_forward[i]), con_reverse=str(self.con_reverse[i]),
+            H_forward_smoothed=self.H_forward_smoothed.data[i, :ls],
+            B_forward_smoothed=self.B_forward_smoothed.data[i, :ls],
+            H_reverse_smoothed=self.H_reverse_smoothed.data[i, :ls],
+            B_reverse_smoothed=self.B_reverse_smoothed.data[i, :ls])
+
+
+# Samples from start to start + lengths of every row, padded with the last sample of the row
+def _gather(values, start, length):
+    positions = start[:, np.newaxis] + np.arange(length)
+    return np.take_along_axis(values, np.minimum(positions, values.shape[-1] - 1), -1)
+
+
+# Processing of stacked records, the counterpart of compute_bh_loop with the 'fft' sinusoid fit.
+# responses/excitations: (n_records, n_samples) arrays; groundf/groundr: scalars or one value per record, used
+# when ground_method is 'manual'. Records where the ground offset cannot be estimated are marked invalid.
+def compute_bh_loops(responses, excitations, dt, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0, groundr=0.0,
+                     integration_mode='trapezoid', ground_method='manual'):
+    response_values = np.asarray(responses, dtype=float)
+    sin_values = np.asarray(excitations, dtype=float)
+    if response_values.shape != sin_values.shape or response_values.ndim != 2:
+        raise ValueError('The responses and excitations must be 2-D arrays of equal shape (records, samples)')
+    n_records, N = sin_values.shape
+    count('samples', n_records * N)
+    time = np.arange(N) * dt
+    nan = np.full(n_records, np.nan)
+
+    # Sinusoid fit of the records with a spectral peak
+    with stage('fit'):
+        f0 = fft_frequency(sin_values, dt)
+        valid = ~np.isnan(f0)
+        A0, ph0, A_fit, f_fit, ph_fit = (nan.copy() for _ in range(5))
+        if valid.any():
+            A0[valid], ph0[valid] = linear_sinusoid_fit(time, sin_values[valid], f0[valid])[:2]
+            A_fit[valid], f_fit[valid], ph_fit[valid] = refine_sinusoid(time, sin_values[valid], f0[valid])
+        sinusoid_fit = sinusoid(time, A_fit[:, np.newaxis], f_fit[:, np.newaxis], ph_fit[:, np.newaxis])
+        scenario = np.where(sin_values[:, 0] >= 0, 1, 2)
+
+    # Reference time points and indexes; records without a full period are invalid
+    with stage('indices'):
+        t1, t2, t3 = reference_times(f_fit, ph_fit, scenario)
+        with np.errstate(invalid='ignore'):
+            refindexes = [np.where(valid, np.nan_to_num(t / dt), 0).astype(int) for t in (t1, t2, t3)]
+        refindex1, refindex2, refindex3 = refindexes
+        valid &= (0 <= refindex1) & (refindex1 < refindex2) & (refindex2 < refindex3) & (refindex3 <= N)
+        # Two-point placeholder branches of the invalid records keep the arrays well defined
+        refindex1, refindex2, refindex3 = (np.where(valid, index, k) for k, index in enumerate(refindexes))
+        forward_lengths = refindex2 - refindex1
+        reverse_lengths = refindex3 - refindex2
+
+    # Integration of the padded branches
+    with stage('integral'):
+        forward_points, reverse_points = int(forward_lengths.max()), int(reverse_lengths.max())
+        raw_forward = cumulative_integral(_gather(response_values, refindex1, forward_points), dt,
+                                          mode=integration_mode)
+        raw_reverse = cumulative_integral(_gather(response_values, refindex2, reverse_points), dt,
+                                          mode=integration_mode)
+
+    groundf = np.broadcast_to(np.asarray(groundf, dtype=float), (n_records,)).copy()
+    groundr = np.broadcast_to(np.asarray(groundr, dtype=float), (n_records,)).copy()
+    if ground_method != 'manual':
+        # Estimated offsets of the valid records; the placeholder branches are too short to estimate
+        with stage('ground'):
+            groundf[:] = groundr[:] = np.nan
+            if valid.any():
+                groundf[valid], groundr[valid] = estimate_ground(
+                    ground_method, response_values[valid], raw_forward[valid], raw_reverse[valid], dt, t1[valid],
+                    f_fit[valid], integration_mode, forward_lengths=forward_lengths[valid],
+                    reverse_lengths=reverse_lengths[valid])
+            valid &= ~np.isnan(groundf)
+
+    # Ground offsets, scales and the vertical shifts of the BH curves
+    with stage('scale'):
+        unit_forward = ground_integral(forward_points, dt, integration_mode)
+        unit_reverse = ground_integral(reverse_points, dt, integration_mode)
+        B_forward = (raw_forward - groundf[:, np.newaxis] * unit_forward) * B_scale
+        B_reverse = (raw_reverse - groundr[:, np.newaxis] * unit_reverse) * B_scale
+        H_forward = -_gather(sinusoid_fit, refindex1, forward_points) * H_scale
+        H_reverse = -_gather(sinusoid_fit, refindex2, reverse_points) * H_scale
+        with np.errstate(invalid='ignore', divide='ignore'):
+            B_forward, con_forward = shift_branch(H_forward, B_forward, forward_lengths)
+            B_reverse, con_reverse = shift_branch(H_reverse, B_reverse, reverse_lengths)
+
+    # Smoothing and trimming every record to the shorter of its branches
+    with stage('smooth'):
+        smoothed_lengths = np.maximum(np.minimum(forward_lengths, reverse_lengths) - window + 1, 0)
+        points = int(smoothed_lengths.max())
+        mask = ~valid[:, np.newaxis] | (np.arange(points) >= smoothed_lengths[:, np.newaxis])
+        H_forward_smoothed, B_forward_smoothed, H_reverse_smoothed, B_reverse_smoothed = [
+            np.ma.masked_array(moving_average(values, window)[:, :points], mask=mask)
+            for values in (H_forward, B_forward, H_reverse, B_reverse)]
+        smoothed_lengths = np.where(valid, smoothed_lengths, 0)
+
+    return StackedLoopResult(
+        time=time, sinusoid_fit=sinusoid_fit, valid=valid, A0=A0, f0=f0, ph0=ph0, A_fit=A_fit, f_fit=f_fit,
+        ph_fit=ph_fit, scenario=scenario, t1=t1, t2=t2, t3=t3, refindex1=refindex1, refindex2=refindex2,
+        refindex3=refindex3, groundf=groundf, groundr=groundr, forward_lengths=forward_lengths,
+        reverse_lengths=reverse_lengths, H_forward=H_forward, B_forward=B_forward, H_reverse=H_reverse,
+        B_reverse=B_reverse, con_forward=con_forward, con_reverse=con_reverse, smoothed_lengths=smoothed_lengths,
+        H_forward_smoothed=H_forward_smoothed, B_forward_smoothed=B_forward_smoothed,
+        H_reverse_smoothed=H_reverse_smoothed, B_reverse_smoothed=B_reverse_smoothed)
@@ -0,0 +1,312 @@
+#
+# Digital BH-loop algorithm: columnar result store
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# Processed captures (smoothed loop arrays, fitted parameters, loop metrics and processing metadata) are appended
+# to one store instead of a set of text files per capture. The store is a directory of compressed NumPy .npz
+# segments; every append writes one new segment with the records as columns, so earlier runs are never rewritten
+# and an interrupted run loses at most the segment being written. The loop arrays of all records of a segment are
+# concatenated with an offsets column (ragged columns), and only the segments of the requested records are read.
+# Compaction writes all records to one new segment that lists the segments it supersedes; superseded segments are
+# ignored from the moment it appears, and are removed afterwards.
+#
+# Usage (from the repository root):
+#   python -m bhloop.store results/results.bhstore
+#   python -m bhloop.store results/results.bhstore --f-min 1e5 --f-max 3e5 --export results/legacy
+#   python -m bhloop.store results/results.bhstore --compact
+#
+
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from dataclasses import fields
+from types import SimpleNamespace
+
+import numpy as np
+
+from .files import write_signal_parameters, write_smoothed_loop
+from .metrics import LoopMetrics, result_metrics
+from .profiling import stage
+
+SEGMENT_PATTERN = 'segment_*.npz'
+COMPACTED_MARK = '_compacted_'  # In the names of compacted segments, which hold the 'superseded' column
+
+# Scalar columns of a record: text, fields of the result, processing metadata and the loop metrics
+TEXT_FIELDS = ['file_name', 'con_forward', 'con_reverse', 'parameters', 'cache_key']
+RESULT_FIELDS = ['A0', 'f0', 'ph0', 'A_fit', 'f_fit', 'ph_fit', 't1', 't2', 't3', 'refindex1', 'refindex2',
+                 'refindex3', 'groundf', 'groundr']
+NUMBER_FIELDS = (['timestamp', 'time_increment', 'B_scale', 'H_scale', 'periods', 'seconds'] + RESULT_FIELDS
+                 + [field.name for field in fields(LoopMetrics)])
+# Ragged columns: one array per record (the spread is empty for the results of a single period)
+ARRAY_FIELDS = ['H_forward_smoothed', 'B_forward_smoothed', 'H_reverse_smoothed', 'B_reverse_smoothed',
+                'B_forward_spread', 'B_reverse_spread']
+
+
+# Record of one processed capture: the scalar and array columns of the store.
+# parameters: processing options (window, integration mode, ...) saved as JSON; seconds: processing time;
+# cache_key: key under which a caller finds its cached results again (e.g. the frequency sweep), empty by default.
+def result_record(result, file_name, time_increment, B_scale=1.0, H_scale=1.0, parameters=None, seconds=np.nan,
+                  timestamp=None, cache_key=''):
+    record = {'file_name': str(file_name), 'con_forward': str(result.con_forward),
+              'con_reverse': str(result.con_reverse), 'parameters': json.dumps(parameters or {}, sort_keys=True),
+              'cache_key': cache_key, 'timestamp': time.time() if timestamp is None else timestamp,
+              'time_increment': time_increment, 'B_scale': B_scale, 'H_scale': H_scale,
+              'periods': getattr(result, 'n_periods', 1), 'seconds': seconds}
+    for name in RESULT_FIELDS:
+        record[name] = getattr(result, name)
+    metrics = result_metrics(result)
+    for field in fields(LoopMetrics):
+        record[field.name] = getattr(metrics, field.name)
+    for name in ARRAY_FIELDS:
+        record[name] = np.asarray(getattr(result, name, ()), dtype=float)
+    return record
+
+
+# Store of processed captures in a directory of segments
+class ResultStore:
+    def __init__(self, path):
+        self.path = path
+        self._table = None  # Scalar columns of all records, read on first use
+        self._segments = []  # Segment file of every loaded segment
+        self._segment_rows = None  # Segment number and row inside the segment of every record
+
+    def __len__(self):
+        return len(self.table()['file_name'])
+
+    # Appending records as one new segment. The segment is written to a temporary name first, so readers and
+    # parallel writers never see a half-written file.
+    def append(self, records):
+        return self._write(records, 'segment_{:020d}_{}.npz'.format(time.time_ns(), os.getpid()))
+
+    # Writing records as the segment of the given name; superseded: names of the segments it replaces
+    def _write(self, records, segment_name, superseded=()):
+        records = list(records)
+        if not records:
+            return None
+        os.makedirs(self.path, exist_ok=True)
+        columns = {name: np.array([str(record[name]) for record in records]) for name in TEXT_FIELDS}
+        for name in NUMBER_FIELDS:
+            columns[name] = np.array([record[name] for record in records], dtype=float)
+        for name in ARRAY_FIELDS:
+            values = [np.asarray(record.get(name, ()), dtype=float) for record in records]
+            columns[name] = np.concatenate(values) if values else np.empty(0)
+            columns[name + '_offsets'] = np.concatenate([[0], np.cumsum([len(array) for array in values])])
+        if superseded:
+            columns['superseded'] = np.array(superseded)
+
+        with stage('store'):
+            descriptor, temporary = tempfile.mkstemp(suffix='.npz', dir=self.path)
+            try:
+                with os.fdopen(descriptor, 'wb') as handle:
+                    np.savez_compressed(handle, **columns)
+                os.replace(temporary, os.path.join(self.path, segment_name))
+            except BaseException:
+                os.remove(temporary)
+                raise
+        self._table = None
+        return os.path.join(self.path, segment_name)
+
+    # Segment files in the order they were written, without the segments superseded by a compaction
+    def segment_files(self):
+        return self._listing()[0]
+
+    # Current and superseded segment files, from one listing of the directory
+    def _listing(self):
+        segments = sorted(glob.glob(os.path.join(self.path, SEGMENT_PATTERN)))
+        superseded = set()
+        for segment in segments:
+            if COMPACTED_MARK in os.path.basename(segment):
+                with np.load(segment) as data:
+                    superseded.update(str(name) for name in data['superseded'])
+        current = [segment for segment in segments if os.path.basename(segment) not in superseded]
+        return current, [segment for segment in segments if os.path.basename(segment) in superseded]
+
+    # Scalar columns of all records as arrays, together with the lookup indexes by file, frequency and time
+    def table(self):
+        if self._table is None:
+            self._segments = self.segment_files()
+            parts, segment_rows = [], []
+            for number, segment in enumerate(self._segments):
+                with np.load(segment) as data:
+                    parts.append({name: _column(data, name) for name in TEXT_FIELDS + NUMBER_FIELDS})
+                n = len(parts[-1]['file_name'])
+                segment_rows.append(np.column_stack([np.full(n, number), np.arange(n)]))
+            self._table = {name: (np.concatenate([part[name] for part in parts]) if parts else
+                                  np.array([], dtype=str if name in TEXT_FIELDS else float))
+                           for name in TEXT_FIELDS + NUMBER_FIELDS}
+            self._segment_rows = np.concatenate(segment_rows) if segment_rows else np.empty((0, 2), dtype=int)
+            self._by_file = {}
+            for row, file_name in enumerate(self._table['file_name']):
+                self._by_file.setdefault(os.path.basename(file_name), []).append(row)
+                self._by_file.setdefault(file_name, []).append(row)
+            self._by_frequency = np.argsort(self._table['f_fit'], kind='stable')
+            self._by_time = np.argsort(self._table['timestamp'], kind='stable')
+        return self._table
+
+    # Rows with values of a sorted column between low and high (inclusive)
+    @staticmethod
+    def _between(values, order, low, high):
+        sorted_values = values[order]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        stop = len(order) if high is None else np.searchsorted(sorted_values, high, side='right')
+        return order[start:stop]
+
+    # Rows matching all given conditions, in the order they were stored.
+    # file: file name with or without the directory; f_min/f_max: fitted frequency range (Hz);
+    # since/until: processing time range (seconds since the epoch, datetime or ISO string).
+    def find(self, file=None, f_min=None, f_max=None, since=None, until=None):
+        table = self.table()
+        rows = np.arange(len(table['file_name']))
+        if file is not None:
+            rows = np.intersect1d(rows, self._by_file.get(file, []))
+        if f_min is not None or f_max is not None:
+            rows = np.intersect1d(rows, self._between(table['f_fit'], self._by_frequency, f_min, f_max))
+        if since is not None or until is not None:
+            rows = np.intersect1d(rows, self._between(table['timestamp'], self._by_time, _seconds(since),
+                                                      _seconds(until)))
+        return rows
+
+    # Loop arrays of the given rows (one dict of arrays per row). Every segment is read once.
+    def loops(self, rows):
+        self.table()
+        rows = np.atleast_1d(np.asarray(rows, dtype=int))
+        loops = [None] * len(rows)
+        segment_rows = self._segment_rows[rows]
+        for number in np.unique(segment_rows[:, 0]):
+            selected = np.flatnonzero(segment_rows[:, 0] == number)
+            with np.load(self._segments[number]) as data:
+                columns = {name: (data[name], data[name + '_offsets']) for name in ARRAY_FIELDS}
+            for i in selected:
+                local = segment_rows[i, 1]
+                loops[i] = {name: values[offsets[local]:offsets[local + 1]]
+                            for name, (values, offsets) in columns.items()}
+        return loops
+
+    # Scalar columns of one row
+    def record_scalars(self, row):
+        table = self.table()
+        return {name: table[name][row].item() for name in TEXT_FIELDS + NUMBER_FIELDS}
+
+    # Complete record of one row: scalar columns and loop arrays
+    def record(self, row):
+        record = self.record_scalars(row)
+        record.update(self.loops([row])[0])
+        return record
+
+    # Writing the legacy signal_parameters.txt and smoothed_hysteresis_data.csv of the given rows (all by default),
+    # prefixed with the capture name as in the batch mode. Returns the written paths.
+    def export(self, directory, rows=None):
+        os.makedirs(directory, exist_ok=True)
+        rows = self.find() if rows is None else np.atleast_1d(rows)
+        files, runs = np.unique(self.table()['file_name'], return_counts=True)
+        repeated = set(files[runs > 1])
+        paths = []
+        for row, loop in zip(rows, self.loops(rows)):
+            record = self.record_scalars(row)
+            result = _stored_result(record, loop)
+            name = os.path.splitext(os.path.basename(record['file_name']))[0]
+            if record['file_name'] in repeated:
+                name += '_{}'.format(row)  # Repeated runs of the same file are numbered by their rows
+            parameters = os.path.join(directory, name + '_signal_parameters.txt')
+            loop_path = os.path.join(directory, name + '_smoothed_hysteresis_data.csv')
+            write_signal_parameters(parameters, record['file_name'], record['time_increment'], record['B_scale'],
+                                    record['H_scale'], result)
+            write_smoothed_loop(loop_path, result)
+            paths += [parameters, loop_path]
+        return paths
+
+    # Rewriting all segments as one segment, e.g. after many small appends. Only the segments present at the start
+    # are read. The compacted segment sorts right after the last of them, so segments appended meanwhile stay after
+    # it, and it supersedes them all in one step when it appears: readers never see a record twice, also if the
+    # removal of the old files fails. Files left over from an interrupted compaction are removed as well.
+    def compact(self):
+        segments, stale = self._listing()
+        if len(segments) < 2:
+            for segment in stale:
+                os.remove(segment)
+            return
+        records = [record for segment in segments for record in _segment_records(segment)]
+        prefix = os.path.splitext(os.path.basename(segments[-1]))[0].split(COMPACTED_MARK)[0]
+        self._write(records, '{}{}{:020d}.npz'.format(prefix, COMPACTED_MARK, time.time_ns()),
+                    [os.path.basename(segment) for segment in segments])
+        self._table = None
+        for segment in stale + segments:
+            os.remove(segment)
+
+
+# Column of a segment; text columns added to the store later (cache_key) are empty in the older segments
+def _column(data, name):
+    if name in data.files or name not in TEXT_FIELDS:
+        return data[name]
+    return np.full(len(data['file_name']), '')
+
+
+# Complete records of one segment file
+def _segment_records(segment):
+    with np.load(segment) as data:
+        columns = {name: _column(data, name) for name in TEXT_FIELDS + NUMBER_FIELDS}
+        columns.update((name, data[name]) for name in data.files if name not in columns)
+    records = []
+    for row in range(len(columns['file_name'])):
+        record = {name: columns[name][row].item() for name in TEXT_FIELDS + NUMBER_FIELDS}
+        for name in ARRAY_FIELDS:
+            offsets = columns[name + '_offsets']
+            record[name] = columns[name][offsets[row]:offsets[row + 1]]
+        records.append(record)
+    return records
+
+
+# Processing time in seconds since the epoch from a number, datetime or ISO string
+def _seconds(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+# Stored record in the form of a result of compute_bh_loop, as needed by the legacy writers
+def _stored_result(record, loop):
+    result = SimpleNamespace(**record, **loop)
+    result.ph_degrees = float(np.degrees(record['ph_fit']))
+    result.refindex1, result.refindex2, result.refindex3 = (int(record[name])
+                                                            for name in ('refindex1', 'refindex2', 'refindex3'))
+    if record['periods'] > 1 and len(loop['B_forward_spread']):
+        result.n_periods = int(record['periods'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query and export of a BH-loop result store')
+    parser.add_argument('store', help='store directory')
+    parser.add_argument('--file', help='capture file name (with or without the directory)')
+    parser.add_argument('--f-min', type=float, help='lowest fitted frequency (Hz)')
+    parser.add_argument('--f-max', type=float, help='highest fitted frequency (Hz)')
+    parser.add_argument('--since', help='earliest processing time (ISO format, e.g. 2024-02-12T10:00)')
+    parser.add_argument('--until', help='latest processing time (ISO format)')
+    parser.add_argument('--export', help='write the legacy TXT/CSV files of the selected records to this directory')
+    parser.add_argument('--compact', action='store_true', help='rewrite all segments as one segment')
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.store)
+    if args.compact:
+        store.compact()
+    rows = store.find(file=args.file, f_min=args.f_min, f_max=args.f_max, since=args.since, until=args.until)
+    table = store.table()
+    for row in rows:
+        processed = datetime.fromtimestamp(table['timestamp'][row]).isoformat(timespec='seconds')
+        print('{:6d}  {}  {}  f_fit = {} Hz, Hc = {}, loop area = {}'.format(
+            row, processed, table['file_name'][row], table['f_fit'][row], table['coercivity'][row],
+            table['loop_area'][row]))
+    print('{} of {} records in {} segments'.format(len(rows), len(table['file_name']), len(store.segment_files())))
+    if args.export:
+        paths = store.export(args.export, rows)
+        print('Exported {} files to {}'.format(len(paths), args.export))
+
+
+if __name__ == '__main__':
+    main()
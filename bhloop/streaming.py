@@ -0,0 +1,273 @@
+#
+# Digital BH-loop algorithm: streaming processing of arbitrarily long acquisitions
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The record is read in fixed-size chunks, so the peak memory does not depend on the record length. The samples of
+# a period that is not finished at the end of a chunk are carried over to the next chunk, and the periods are
+# emitted as soon as the chunk that completes them has been processed.
+#
+# Usage (from the repository root):
+#   python -m bhloop.streaming capture.bhraw --output capture_loop.csv
+#   python -m bhloop.streaming "Experimental data/Test1.csv" --time-increment 1e-8 --chunk-size 400
+#
+
+import argparse
+import struct
+from dataclasses import dataclass
+from itertools import islice
+
+import numpy as np
+
+from .cycles import extract_cycles, find_periods, first_period_time
+from .integration import INTEGRATION_MODES
+from .metrics import result_metrics
+from .pipeline import fit_excitation, moving_average, pi, shift_branch
+from .sinefit import FIT_METHODS
+
+# Raw binary capture: a 40-byte header followed by the interleaved (response, excitation) samples.
+# Header: magic, sample type code, padding, time increment (s), response scale, excitation scale.
+# The stored values are multiplied by the channel scales when read (the scales are 1 for float32).
+RAW_MAGIC = b'BHRAW001'
+RAW_HEADER = struct.Struct('<8sB7xddd')
+RAW_DTYPES = {0: np.dtype('<f4'), 1: np.dtype('<i2')}
+RAW_DTYPE_CODES = {'float32': 0, 'int16': 1}
+
+default_chunk_size = 250_000  # Points per chunk
+
+
+# Periods of the loop finished in one chunk and emitted together by the streaming processor.
+# The BH curves are 2-D arrays with one row per period; every branch has the same number of points.
+@dataclass
+class StreamedPeriods:
+    first_index: int  # Number of the first period counted from the start of the record
+    t1: np.ndarray  # Reference times t1 of the periods (s), counted from the start of the record
+    H_forward: np.ndarray
+    B_forward: np.ndarray
+    H_reverse: np.ndarray
+    B_reverse: np.ndarray
+
+    def __len__(self):
+        return len(self.t1)
+
+
+# Loop averaged over all streamed periods. The field names follow BHLoopResult and CycleAverageResult, so the
+# result can be saved and plotted by the same functions.
+@dataclass
+class StreamAverage:
+    A_fit: float
+    f_fit: float
+    ph_fit: float  # Phase at the start of the record (rads)
+    n_periods: int
+    H_forward_smoothed: np.ndarray
+    B_forward_smoothed: np.ndarray
+    H_reverse_smoothed: np.ndarray
+    B_reverse_smoothed: np.ndarray
+    B_forward_spread: np.ndarray
+    B_reverse_spread: np.ndarray
+
+
+# Writing a raw binary capture. With sample_type='int16' each channel is scaled to the full int16 range.
+def write_raw_capture(path, response, excitation, time_increment, sample_type='float32'):
+    data = np.column_stack((response, excitation)).astype(float)
+    if sample_type == 'int16':
+        scales = np.max(np.abs(data), axis=0) / 32767.0
+        scales[scales == 0] = 1.0
+        data = np.round(data / scales)
+    else:
+        scales = np.ones(2)
+    code = RAW_DTYPE_CODES[sample_type]
+    with open(path, 'wb') as file:
+        file.write(RAW_HEADER.pack(RAW_MAGIC, code, time_increment, scales[0], scales[1]))
+        file.write(data.astype(RAW_DTYPES[code]).tobytes())
+
+
+# Memory-mapped raw binary capture. Returns the (N, 2) memory map of the stored samples, the time increment and
+# the channel scales. Nothing is read from the disk until the samples are accessed.
+def open_raw_capture(path):
+    with open(path, 'rb') as file:
+        header = file.read(RAW_HEADER.size)
+    if len(header) < RAW_HEADER.size:
+        raise ValueError('{} is too short for a raw capture'.format(path))
+    magic, code, time_increment, response_scale, excitation_scale = RAW_HEADER.unpack(header)
+    if magic != RAW_MAGIC or code not in RAW_DTYPES:
+        raise ValueError('{} is not a raw BH-loop capture'.format(path))
+    samples = np.memmap(path, dtype=RAW_DTYPES[code], mode='r', offset=RAW_HEADER.size).reshape(-1, 2)
+    return samples, time_increment, np.array([response_scale, excitation_scale])
+
+
+# Chunks of (response, excitation) from a raw binary capture
+def raw_chunks(path, chunk_size=default_chunk_size):
+    samples, time_increment, scales = open_raw_capture(path)
+    for start in range(0, len(samples), chunk_size):
+        chunk = samples[start:start + chunk_size] * scales
+        yield chunk[:, 0], chunk[:, 1]
+
+
+# Chunks of (response, excitation) from a two-column CSV file
+def csv_chunks(file_name, chunk_size=default_chunk_size):
+    with open(file_name) as file:
+        while True:
+            lines = list(islice(file, chunk_size))
+            if not lines:
+                return
+            data = np.loadtxt(lines, delimiter=',', ndmin=2)
+            yield data[:, 0], data[:, 1]
+
+
+# Streaming processor of the loop periods for the sinusoid frequency f_fit and the scenario fitted beforehand.
+# Only the phase is tracked chunk by chunk (linear least squares at the fixed frequency), so slow phase drifts of
+# long records are followed.
+def stream_periods(chunks, time_increment, f_fit, B_scale=1.0, H_scale=1.0, groundf=0.0, groundr=0.0,
+                   integration_mode='trapezoid', scenario=1):
+    response_carry = np.zeros(0)
+    excitation_carry = np.zeros(0)
+    carry_start = 0  # Index of the first carried sample counted from the start of the record
+    period_index = 0
+
+    for response_chunk, excitation_chunk in chunks:
+        response_values = np.concatenate((response_carry, np.asarray(response_chunk, dtype=float)))
+        sin_values = np.concatenate((excitation_carry, np.asarray(excitation_chunk, dtype=float)))
+        time = np.arange(len(sin_values)) * time_increment  # Time counted from the first carried sample
+
+        # Phase tracking: y = a * sin(wt) + b * cos(wt) at the fitted frequency, solved by the normal equations
+        omega_t = 2.0 * pi * f_fit * time
+        sin_wt = np.sin(omega_t)
+        cos_wt = np.cos(omega_t)
+        ss, sc, cc = np.dot(sin_wt, sin_wt), np.dot(sin_wt, cos_wt), np.dot(cos_wt, cos_wt)
+        a, b = np.linalg.solve([[ss, sc], [sc, cc]], [np.dot(sin_wt, sin_values), np.dot(cos_wt, sin_values)])
+        ph_local = float(np.arctan2(b, a))
+
+        period_times, branch_points = find_periods(f_fit, ph_local, time_increment, len(sin_values),
+                                                   scenario=scenario)
+        if len(period_times) > 0:
+            sinusoid_fit = a * sin_wt + b * cos_wt
+            H_forward, B_forward, H_reverse, B_reverse = extract_cycles(
+                response_values, sinusoid_fit, time_increment, f_fit, period_times, branch_points,
+                B_scale=B_scale, H_scale=H_scale, groundf=groundf, groundr=groundr,
+                integration_mode=integration_mode)
+            B_forward = shift_branch(H_forward, B_forward)[0]
+            B_reverse = shift_branch(H_reverse, B_reverse)[0]
+            yield StreamedPeriods(period_index, carry_start * time_increment + period_times,
+                                  H_forward, B_forward, H_reverse, B_reverse)
+            period_index += len(period_times)
+            next_t1 = period_times[-1] + 1.0 / f_fit
+        else:
+            next_t1 = first_period_time(f_fit, ph_local, scenario)
+
+        # Samples of the unfinished period are carried over, starting a little before its t1, so the phase refit
+        # in the next buffer cannot move t1 in front of the buffer start
+        margin = max(branch_points // 4, 1)
+        keep = min(max(int(next_t1 / time_increment) - margin, 0), len(sin_values))
+        response_carry = response_values[keep:]
+        excitation_carry = sin_values[keep:]
+        carry_start += keep
+
+
+# Running sums over the streamed periods for the averaged loop and the spread of B over the periods
+class PeriodAccumulator:
+    def __init__(self):
+        self.n_periods = 0
+        self.sums = None
+        self.squares = None
+
+    def add(self, periods):
+        curves = [periods.H_forward, periods.B_forward, periods.H_reverse, periods.B_reverse]
+        if self.sums is None:
+            self.sums = [values.sum(axis=0) for values in curves]
+            self.squares = [(values ** 2).sum(axis=0) for values in curves]
+        else:
+            for sums, squares, values in zip(self.sums, self.squares, curves):
+                sums += values.sum(axis=0)
+                squares += (values ** 2).sum(axis=0)
+        self.n_periods += len(periods)
+
+    # Averaged and smoothed loop
+    def average(self, window, fit):
+        if self.n_periods == 0:
+            raise ValueError('The record does not contain a full period of the excitation')
+        means = [sums / self.n_periods for sums in self.sums]
+        spread = [np.sqrt(np.maximum(self.squares[i] / self.n_periods - means[i] ** 2, 0.0)) for i in (1, 3)]
+        smoothed = [moving_average(values, window) for values in means + spread]
+        min_length = min(len(values) for values in smoothed)
+        smoothed = [values[:min_length] for values in smoothed]
+        A_fit, f_fit, ph_fit = fit
+        return StreamAverage(A_fit, f_fit, ph_fit, self.n_periods, *smoothed)
+
+
+# Streaming processing of a whole capture with averaging over all periods.
+# The sinusoid is fitted on the first fit_points of the record (or the whole record if it is shorter).
+# The callback (if given) receives the StreamedPeriods of every chunk as soon as they are finished.
+def process_stream(chunks, time_increment, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0, groundr=0.0,
+                   integration_mode='trapezoid', fit_method='fft', fit_points=100_000, callback=None):
+    chunks = iter(chunks)
+
+    # Chunks collected for the sinusoid fit
+    head = []
+    while sum(len(response_chunk) for response_chunk, excitation_chunk in head) < fit_points:
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        head.append(chunk)
+    if not head:
+        raise ValueError('The record is empty')
+    sin_values = np.concatenate([np.asarray(excitation_chunk, dtype=float) for response_chunk, excitation_chunk
+                                 in head])
+    _, fit, scenario = fit_excitation(np.arange(len(sin_values)) * time_increment, sin_values, time_increment,
+                                      fit_method)
+
+    def all_chunks():
+        yield from head
+        yield from chunks
+
+    accumulator = PeriodAccumulator()
+    for periods in stream_periods(all_chunks(), time_increment, fit[1], B_scale=B_scale, H_scale=H_scale,
+                                  groundf=groundf, groundr=groundr, integration_mode=integration_mode,
+                                  scenario=scenario):
+        accumulator.add(periods)
+        if callback is not None:
+            callback(periods)
+    return accumulator.average(window, fit)
+
+
+def main(argv=None):
+    from .files import write_smoothed_loop
+
+    parser = argparse.ArgumentParser(description='Streaming processing of long BH-loop captures')
+    parser.add_argument('source', help='raw binary capture or two-column CSV file')
+    parser.add_argument('--time-increment', type=float, help='time increment (s), required for CSV files')
+    parser.add_argument('--chunk-size', type=int, default=default_chunk_size, help='points per chunk')
+    parser.add_argument('--output', help='CSV file for the averaged loop')
+    parser.add_argument('--B-scale', type=float, default=1.0)
+    parser.add_argument('--H-scale', type=float, default=1.0)
+    parser.add_argument('--window', type=int, default=3, help='moving average window')
+    parser.add_argument('--groundf', type=float, default=0.0, help='ground offset (forward)')
+    parser.add_argument('--groundr', type=float, default=0.0, help='ground offset (reverse)')
+    parser.add_argument('--integration-mode', choices=INTEGRATION_MODES, default='trapezoid')
+    parser.add_argument('--fit-method', choices=FIT_METHODS, default='fft')
+    args = parser.parse_args(argv)
+
+    if args.source.lower().endswith('.csv'):
+        if args.time_increment is None:
+            parser.error('--time-increment is required for CSV files')
+        chunks = csv_chunks(args.source, args.chunk_size)
+        time_increment = args.time_increment
+    else:
+        time_increment = args.time_increment or open_raw_capture(args.source)[1]
+        chunks = raw_chunks(args.source, args.chunk_size)
+
+    result = process_stream(chunks, time_increment, B_scale=args.B_scale, H_scale=args.H_scale,
+                            window=args.window, groundf=args.groundf, groundr=args.groundr,
+                            integration_mode=args.integration_mode, fit_method=args.fit_method)
+    print('Fitted amplitude = ', result.A_fit)
+    print('Fitted frequency = ', result.f_fit, ' Hz')
+    print('Number of averaged periods = ', result.n_periods)
+    metrics = result_metrics(result)
+    print('Coercive field = ', metrics.coercivity, ' A/m')
+    print('Remanence = ', metrics.remanence, ' T')
+    print('Loop area = ', metrics.loop_area, ' J/m^3')
+    if args.output:
+        write_smoothed_loop(args.output, result)
+
+
+if __name__ == '__main__':
+    main()
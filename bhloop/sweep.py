@@ -0,0 +1,251 @@
+#
+# Digital BH-loop algorithm: frequency sweep of one sample measured at several frequencies
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The captures of the sweep are listed in a manifest (CSV file with the columns "file" and "time_increment";
+# relative paths are relative to the manifest) or given as a directory or glob pattern. A missing time increment is
+# taken from the capture metadata (oscilloscope xlsx files and .npz containers) or from --time-increment.
+# The captures are processed in parallel worker processes and their results are kept in a result store in the
+# output directory, keyed on the file (path, size and modification time), its time increment and the processing
+# options (the cache_key column of the store): running the sweep again after adding one frequency only processes
+# the new file. Every result is stored as soon as its capture is processed, so an interrupted sweep resumes from the
+# captures that were not finished.
+# Outputs: sweep_summary.csv (loop parameters against the fitted frequency), the loss and coercivity against the
+# frequency and the overlaid loops as PNG images.
+#
+# Usage (from the repository root):
+#   python -m bhloop.sweep sweep.csv --output results/sweep
+#   python -m bhloop.sweep "Experimental data/Original Excel files" --output results/sweep --all-periods
+#
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .batch import _StoreWriter, find_captures, process_file
+from .captures import SOURCE_EXTENSIONS, cached_capture
+from .drift import GROUND_METHODS
+from .integration import INTEGRATION_MODES
+from .pipeline import ALIGNMENT_MODES
+from .sinefit import FIT_METHODS
+from .store import ResultStore
+
+# Columns of the sweep summary, sorted by the fitted frequency
+SWEEP_FIELDS = ['file', 'time_increment', 'f_fit (Hz)', 'loop_area', 'power_loss', 'coercivity', 'remanence',
+                'H_max', 'B_max', 'squareness', 'max_permeability', 'periods', 'status', 'error']
+
+
+# Result store of a sweep, which is also the cache of the processed captures
+def sweep_store_path(output_directory):
+    return os.path.join(output_directory, 'sweep.bhstore')
+
+
+# Captures and time increments of a manifest: (file name, time increment or None) in the order of the manifest
+def read_manifest(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            file_name = row['file'].strip()
+            if not os.path.isabs(file_name):
+                file_name = os.path.join(directory, file_name)
+            time_increment = (row.get('time_increment') or '').strip()
+            entries.append((file_name, float(time_increment) if time_increment else None))
+    return entries
+
+
+# Manifest file or capture files (directory or glob pattern, also xlsx and .npz containers) of a sweep
+def sweep_entries(source):
+    if os.path.isfile(source) and source.lower().endswith('.csv'):
+        with open(source, newline='') as csv_file:
+            header = next(csv.reader(csv_file), [])
+        if 'file' in [name.strip() for name in header]:
+            return read_manifest(source)
+    if os.path.isdir(source):
+        file_names = sorted(file_name for extension in SOURCE_EXTENSIONS
+                            for file_name in find_captures(os.path.join(source, '*' + extension)))
+    else:
+        file_names = find_captures(source)
+    return [(file_name, None) for file_name in file_names]
+
+
+# Time increment from the capture metadata, or the default value
+def infer_time_increment(file_name, default=None):
+    time_increment = cached_capture(file_name).time_increment
+    if time_increment is None:
+        time_increment = default
+    if time_increment is None:
+        raise ValueError('The time increment of {} is not in the manifest, the file or --time-increment'.format(
+            file_name))
+    return time_increment
+
+
+# Cache key of a capture: file identity, time increment and the processing options
+def sweep_key(file_name, time_increment, parameters):
+    status = os.stat(file_name)
+    return json.dumps(dict(parameters, time_increment=time_increment, source_size=status.st_size,
+                           source_mtime=status.st_mtime_ns), sort_keys=True)
+
+
+# Store rows of the stored results by (file name, cache key); the latest result wins
+def stored_rows(store):
+    table = store.table()
+    return {(file_name, key): row for row, (file_name, key) in enumerate(zip(table['file_name'],
+                                                                             table['cache_key']))}
+
+
+# Processing of the sweep. Captures without a stored result for their key are processed in a process pool, and
+# every result is appended to the store (sweep.bhstore in the output directory) as it arrives. A capture whose
+# worker fails (e.g. a broken process pool) gets a failed row. Returns the rows of all captures sorted by the
+# fitted frequency (failed ones last), the number of processed captures and the wall time; the rows of the
+# successful captures hold the store row of their result under 'store_row'.
+def run_sweep(entries, output_directory, time_increment=None, workers=None, **parameters):
+    os.makedirs(output_directory, exist_ok=True)
+    start = time.perf_counter()
+    store = ResultStore(sweep_store_path(output_directory))
+    stored = stored_rows(store)
+
+    rows, keys, pending = {}, {}, {}
+    for file_name, dt in entries:
+        try:
+            dt = dt or infer_time_increment(file_name, time_increment)
+            keys[file_name] = sweep_key(file_name, dt, parameters)
+        except (OSError, ValueError) as error:
+            rows[file_name] = {'file': file_name, 'time_increment': dt, 'status': 'failed',
+                               'error': '{}: {}'.format(type(error).__name__, error)}
+            continue
+        rows[file_name] = {'file': file_name, 'time_increment': dt, 'status': 'cached'}
+        if (file_name, keys[file_name]) not in stored:
+            pending[file_name] = dt
+
+    # Processing of the new and changed captures; only the store record of every capture is kept
+    processed = 0
+    if pending:
+        writer = _StoreWriter(store.path, chunk=1)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = {executor.submit(process_file, file_name, output_directory, dt, legacy=False, record=True,
+                                       **parameters): file_name for file_name, dt in pending.items()}
+            for future in as_completed(futures):
+                file_name = futures[future]
+                try:
+                    row = future.result()
+                except Exception as error:
+                    row = {'status': 'failed', 'error': '{}: {}'.format(type(error).__name__, error)}
+                if row['status'] == 'ok':
+                    row['record']['cache_key'] = keys[file_name]
+                    writer.add(row)
+                    processed += 1
+                    rows[file_name]['status'] = 'ok'
+                else:
+                    rows[file_name].update(status='failed', error=row['error'])
+
+    # Loop parameters of every capture from its stored result (the store is opened again to read the new records)
+    store = ResultStore(store.path)
+    stored = stored_rows(store)
+    table = store.table()
+    for file_name, row in rows.items():
+        if row['status'] == 'failed':
+            continue
+        store_row = row['store_row'] = stored[(file_name, keys[file_name])]
+        for name in ('loop_area', 'coercivity', 'remanence', 'H_max', 'B_max', 'squareness', 'max_permeability',
+                     'periods'):
+            row[name] = table[name][store_row]
+        row['f_fit (Hz)'] = table['f_fit'][store_row]
+        row['power_loss'] = row['loop_area'] * row['f_fit (Hz)']  # Loss per second (W/m^3 for B in T, H in A/m)
+
+    ordered = sorted(rows.values(), key=lambda row: (row['status'] == 'failed', row.get('f_fit (Hz)', 0.0)))
+    return ordered, processed, time.perf_counter() - start
+
+
+# Writing the sweep summary
+def write_sweep_summary(path, rows):
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=SWEEP_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# Loss and coercivity against the frequency and the overlaid loops as PNG images. The figures are created without
+# pyplot, so no display is needed. Returns the paths of the images.
+def save_sweep_plots(output_directory, rows, loops):
+    from matplotlib.figure import Figure
+    from .plotting import plot_sweep_loops, plot_sweep_parameter
+
+    rows = [row for row in rows if row['status'] != 'failed']
+    frequencies = [row['f_fit (Hz)'] for row in rows]
+    paths = {name: os.path.join(output_directory, 'sweep_{}.png'.format(name))
+             for name in ('loss', 'coercivity', 'loops')}
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    plot_sweep_parameter(ax, frequencies, [row['loop_area'] for row in rows], 'Loss per cycle (J/m^3)',
+                         'Hysteresis Loss against Frequency')
+    plot_sweep_parameter(ax.twinx(), frequencies, [row['power_loss'] for row in rows], 'Loss power (W/m^3)',
+                         'Hysteresis Loss against Frequency', color='red')
+    fig.legend(loc='upper left')
+    fig.savefig(paths['loss'])
+
+    fig = Figure(figsize=(10, 6))
+    plot_sweep_parameter(fig.add_subplot(), frequencies, [row['coercivity'] for row in rows], 'Coercive field (A/m)',
+                         'Coercive Field against Frequency')
+    fig.savefig(paths['coercivity'])
+
+    fig = Figure(figsize=(10, 6))
+    plot_sweep_loops(fig.add_subplot(), loops, frequencies)
+    fig.savefig(paths['loops'])
+    return list(paths.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Frequency sweep of BH-loop captures')
+    parser.add_argument('source', help='manifest CSV file (columns file, time_increment), directory or glob pattern')
+    parser.add_argument('--output', required=True, help='output directory (also holds the result cache)')
+    parser.add_argument('--time-increment', type=float,
+                        help='time increment (s) of the captures without one in the manifest or file metadata')
+    parser.add_argument('--B-scale', type=float, default=1.0)
+    parser.add_argument('--H-scale', type=float, default=1.0)
+    parser.add_argument('--window', type=int, default=3, help='moving average window')
+    parser.add_argument('--groundf', type=float, default=0.0, help='ground offset (forward)')
+    parser.add_argument('--groundr', type=float, default=0.0, help='ground offset (reverse)')
+    parser.add_argument('--ground-method', choices=GROUND_METHODS, default='manual')
+    parser.add_argument('--alignment', choices=ALIGNMENT_MODES, default='sample')
+    parser.add_argument('--grid-points', type=int, help='resample the loops onto a shared H grid')
+    parser.add_argument('--integration-mode', choices=INTEGRATION_MODES, default='trapezoid')
+    parser.add_argument('--fit-method', choices=FIT_METHODS, default='fft')
+    parser.add_argument('--all-periods', action='store_true', help='average every loop over all full periods')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    entries = sweep_entries(args.source)
+    if not entries:
+        parser.error('no captures found in {}'.format(args.source))
+    rows, processed, seconds = run_sweep(
+        entries, args.output, time_increment=args.time_increment, workers=args.workers, B_scale=args.B_scale,
+        H_scale=args.H_scale, window=args.window, groundf=args.groundf, groundr=args.groundr,
+        ground_method=args.ground_method, alignment=args.alignment, grid_points=args.grid_points,
+        integration_mode=args.integration_mode, fit_method=args.fit_method, all_periods=args.all_periods)
+
+    summary_path = os.path.join(args.output, 'sweep_summary.csv')
+    write_sweep_summary(summary_path, rows)
+    loops = ResultStore(sweep_store_path(args.output)).loops([row['store_row'] for row in rows if 'store_row' in row])
+    plot_paths = save_sweep_plots(args.output, rows, loops)
+
+    for row in rows:
+        if row['status'] == 'failed':
+            print('{}: {}'.format(row['file'], row['error']))
+        else:
+            print('{:>10.4g} kHz  {}  loss = {} J/m^3, Hc = {} ({})'.format(
+                row['f_fit (Hz)'] / 1e3, row['file'], row['loop_area'], row['coercivity'], row['status']))
+    print('')
+    statuses = [row['status'] for row in rows]
+    print('Processed {} of {} captures in {:.3f} s ({} cached, {} failed)'.format(
+        processed, len(rows), seconds, statuses.count('cached'), statuses.count('failed')))
+    print('Summary table: {}'.format(summary_path))
+    print('Plots: {}'.format(', '.join(plot_paths)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#
+# Digital BH-loop algorithm: synthetic captures with a known hysteresis loop
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The excitation is the sinusoid A * sin(2 * pi * f * t + ph) and the field is H = -excitation, as in
+# compute_bh_loop with H_scale = 1. The induction follows a tanh-type loop,
+#   B = Bs * tanh((H - Hc) / w) on the branch of increasing H and B = Bs * tanh((H + Hc) / w) on the branch of
+#   decreasing H,
+# and the response is the exact derivative dB/dt (the pickup coil voltage), so the integrated response with
+# B_scale = 1 reproduces B. A DC ground offset and Gaussian noise can be added to both channels.
+#
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# Synthetic capture together with its ground truth
+@dataclass
+class SyntheticCapture:
+    response: np.ndarray
+    excitation: np.ndarray
+    time_increment: float
+    amplitude: float  # Excitation amplitude A
+    frequency: float  # Excitation frequency f (Hz)
+    phase: float  # Excitation phase ph (rads)
+    coercivity: float  # Coercive field Hc
+    saturation: float  # Saturation induction Bs
+    width: float  # Field width w of the switching
+    ground: float  # DC ground offset added to the response
+    noise: float  # Noise standard deviation relative to the channel amplitudes
+
+    # True induction on the branch of decreasing (decreasing=True) or increasing H
+    def induction(self, H, decreasing):
+        return self.saturation * np.tanh((np.asarray(H) + (self.coercivity if decreasing else -self.coercivity))
+                                         / self.width)
+
+    # RMS error of the BH curves of a result relative to Bs; smoothed=True compares the smoothed curves
+    def loop_error(self, result, smoothed=False):
+        suffix = '_smoothed' if smoothed else ''
+        squares, count = 0.0, 0
+        for branch in ('forward', 'reverse'):
+            H = getattr(result, 'H_' + branch + suffix)
+            B = getattr(result, 'B_' + branch + suffix)
+            decreasing = H[-1] < H[0]
+            squares += float(np.sum((B - self.induction(H, decreasing)) ** 2))
+            count += len(B)
+        return np.sqrt(squares / count) / self.saturation
+
+
+# Synthetic capture of n_points samples. The frequency defaults to the given number of periods in the record.
+def synthetic_capture(n_points=1200, time_increment=1e-8, frequency=None, periods=4, amplitude=1.0, phase=0.0,
+                      coercivity=0.3, saturation=1.0, width=0.1, ground=0.0, noise=0.0, seed=None):
+    if n_points < 2 or time_increment <= 0:
+        raise ValueError('At least two samples and a positive time increment are needed')
+    if coercivity >= amplitude:
+        raise ValueError('The excitation amplitude must exceed the coercive field to switch the loop')
+    if frequency is None:
+        frequency = periods / (n_points * time_increment)
+
+    omega = 2.0 * np.pi * frequency
+    argument = omega * time_increment * np.arange(n_points) + phase
+    excitation = amplitude * np.sin(argument)
+    dH_dt = np.cos(argument)
+    dH_dt *= -amplitude * omega  # H = -excitation
+    del argument
+
+    # Branch of each sample from the direction of the field change, and dB/dt = dB/dH * dH/dt
+    shifted = -excitation + np.where(dH_dt < 0, coercivity, -coercivity)
+    shifted /= width
+    response = np.cosh(shifted)
+    del shifted
+    response **= -2.0
+    response *= saturation / width
+    response *= dH_dt
+    del dH_dt
+    response += ground
+
+    if noise:
+        rng = np.random.default_rng(seed)
+        response += noise * float(np.max(np.abs(response - ground))) * rng.standard_normal(n_points)
+        excitation += noise * amplitude * rng.standard_normal(n_points)
+
+    return SyntheticCapture(response=response, excitation=excitation, time_increment=time_increment,
+                            amplitude=amplitude, frequency=frequency, phase=phase, coercivity=coercivity,
+                            saturation=saturation, width=width, ground=ground, noise=noise)
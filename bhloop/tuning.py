@@ -0,0 +1,290 @@
+#
+# Digital BH-loop algorithm: incremental re-evaluation for the interactive tuning of the loop parameters
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# The processing is split into stages, and the output of every stage is kept in an LRU cache keyed on the file
+# identity and the inputs of the stage and all stages above it (bounded by the number of outputs and by the bytes
+# of their arrays, since the first stages hold full-record arrays):
+#   load -> sinusoid fit -> reference indexes -> raw integral -> ground estimate -> offsets/scales -> smoothing
+# Changing B_scale, H_scale, groundf or groundr therefore only repeats the last two stages, and changing the
+# moving average window or the H grid only repeats the smoothing (and resampling). The estimated ground offsets
+# (ground_method other than 'manual') depend only on the raw integral and are cached with it. The file is read and
+# the sinusoid is fitted again only when the file, its time increment or the fitting method change.
+# A session can be shared by the GUI thread and a background worker: its calls are serialized by a lock, and the
+# tuning window does not wait for it (a call with blocking=False returns None while the worker holds the session).
+#
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .cycles import compute_cycle_average
+from .drift import estimate_ground
+from .files import load_capture
+from .pipeline import (BHLoopResult, branch_integrals, branch_samples, fit_excitation, reference_indices,
+                       reference_times, resample_loop, scale_branches, sinusoid, smooth_loop)
+from .profiling import count, stage
+
+TUNING_STAGES = ('load', 'fit', 'indices', 'integral', 'ground', 'scale', 'smooth')
+default_cache_size = 64  # Stage outputs kept in the cache, enough for several recently opened captures
+# Bytes of the arrays kept in the cache: the stages of a 1e7-sample capture take about 600 MB, plus about 80 MB for
+# every further set of scales or window, so the cache holds one such capture with a few parameter sets
+default_cache_bytes = 1 << 30
+
+
+# Bytes of the arrays in a stage output (nested tuples, lists and dicts); views are counted like copies
+def array_bytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(array_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(array_bytes(item) for item in value.values())
+    return 0
+
+
+# Least recently used cache of the stage outputs with hit and miss counters per stage. The oldest outputs are
+# dropped when there are more than maxsize outputs or more than maxbytes bytes of arrays; the newest output is
+# always kept.
+class StageCache:
+    def __init__(self, maxsize=default_cache_size, maxbytes=default_cache_bytes):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.items = OrderedDict()
+        self.sizes = {}  # Bytes of the arrays of every output
+        self.nbytes = 0
+        self.hits = dict.fromkeys(TUNING_STAGES, 0)
+        self.misses = dict.fromkeys(TUNING_STAGES, 0)
+
+    def __len__(self):
+        return len(self.items)
+
+    # Cached output of the stage, or the output of compute() stored in the cache
+    def get(self, stage, key, compute):
+        key = (stage,) + key
+        if key in self.items:
+            self.items.move_to_end(key)
+            self.hits[stage] += 1
+            return self.items[key]
+        value = compute()
+        self.misses[stage] += 1
+        self.items[key] = value
+        self.sizes[key] = array_bytes(value)
+        self.nbytes += self.sizes[key]
+        while len(self.items) > 1 and (len(self.items) > self.maxsize or self.nbytes > self.maxbytes):
+            oldest, _ = self.items.popitem(last=False)
+            self.nbytes -= self.sizes.pop(oldest)
+        return value
+
+    def clear(self):
+        self.items.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+
+
+# Identity of a file: the absolute path, size and modification time, so an overwritten file is read again
+def file_identity(file_name):
+    status = os.stat(file_name)
+    return os.path.abspath(file_name), status.st_size, status.st_mtime_ns
+
+
+# Tuning session: compute() gives the same result as compute_bh_loop, but repeats only the stages downstream of
+# the changed parameters. compute_timed() also returns the stages recomputed by the call and its duration.
+class TuningSession:
+    def __init__(self, maxsize=default_cache_size, maxbytes=default_cache_bytes):
+        self.cache = StageCache(maxsize, maxbytes)
+        self.lock = threading.RLock()
+
+    # Output of a stage from the cache or computed, with the name of a computed stage added to recomputed;
+    # timed=False for functions recording their own stage time
+    def _stage(self, name, key, compute, recomputed, timed=True):
+        misses = self.cache.misses[name]
+
+        def timed_compute():
+            with stage(name):
+                return compute()
+
+        value = self.cache.get(name, key, timed_compute if timed else compute)
+        if self.cache.misses[name] != misses:
+            recomputed.append(name)
+        else:
+            count('cache_hits')
+        return value
+
+    # File identity with the response and excitation values of the file; None at once with blocking=False if
+    # another thread is using the session
+    def load(self, file_name, blocking=True):
+        if not self.lock.acquire(blocking=blocking):
+            return None
+        try:
+            return self._load(file_name, [])
+        finally:
+            self.lock.release()
+
+    def _load(self, file_name, recomputed):
+        identity = file_identity(file_name)
+        return identity, self._stage('load', identity, lambda: load_capture(file_name, cache=True), recomputed,
+                                     timed=False)
+
+    def compute(self, file_name, dt, **parameters):
+        return self.compute_timed(file_name, dt, **parameters)[0]
+
+    # Result, stages recomputed by the call and its duration in seconds; None at once with blocking=False if
+    # another thread is using the session
+    def compute_timed(self, file_name, dt, blocking=True, **parameters):
+        if not self.lock.acquire(blocking=blocking):
+            return None
+        try:
+            start = time.perf_counter()
+            recomputed = []
+            result = self._compute(recomputed, file_name, dt, **parameters)
+            return result, recomputed, time.perf_counter() - start
+        finally:
+            self.lock.release()
+
+    def _compute(self, recomputed, file_name, dt, B_scale=1.0, H_scale=1.0, window=3, groundf=0.0, groundr=0.0,
+                 integration_mode='trapezoid', fit_method='fft', all_periods=False, ground_method='manual',
+                 alignment='sample', grid_points=None):
+        identity, (response_values, sin_values) = self._load(file_name, recomputed)
+        if all_periods:
+            # The averaging over all periods is not split into stages: only the file reading is reused
+            result = compute_cycle_average(response_values, sin_values, dt, B_scale=B_scale, H_scale=H_scale,
+                                           window=window, groundf=groundf, groundr=groundr,
+                                           integration_mode=integration_mode, fit_method=fit_method,
+                                           ground_method=ground_method, alignment=alignment,
+                                           grid_points=grid_points)
+            recomputed.append('cycles')
+            return result
+
+        N = len(sin_values)
+        count('samples', N)
+        fit_key = identity + (dt, fit_method)
+
+        def fit():
+            time_values = np.arange(N) * dt
+            estimated, fitted, scenario = fit_excitation(time_values, sin_values, dt, fit_method)
+            return time_values, sinusoid(time_values, *fitted), estimated, fitted, scenario
+
+        time_values, sinusoid_fit, (A0, f0, ph0), (A_fit, f_fit, ph_fit), scenario = self._stage(
+            'fit', fit_key, fit, recomputed)
+
+        def indices():
+            t123 = reference_times(f_fit, ph_fit, scenario)
+            refindexes = reference_indices(*t123, dt, N)
+            return t123, refindexes, branch_samples(response_values, sinusoid_fit, refindexes, t123[0], t123[1],
+                                                    dt, (A_fit, f_fit, ph_fit), alignment)
+
+        indices_key = fit_key + (alignment,)
+        (t1, t2, t3), refindexes, (branch_response, branch_sinusoid, branch_dt, branch_indexes) = self._stage(
+            'indices', indices_key, indices, recomputed)
+
+        integral_key = indices_key + (integration_mode,)
+        raw_forward, raw_reverse = self._stage(
+            'integral', integral_key,
+            lambda: branch_integrals(branch_response, *branch_indexes, branch_dt, integration_mode), recomputed)
+
+        if ground_method != 'manual':
+            groundf, groundr = self._stage(
+                'ground', integral_key + (ground_method,),
+                lambda: estimate_ground(ground_method, response_values, raw_forward, raw_reverse, dt, t1, f_fit,
+                                        integration_mode, branch_dt=branch_dt), recomputed)
+
+        scale_key = integral_key + (B_scale, H_scale, groundf, groundr)
+        H_forward, B_forward, H_reverse, B_reverse, con_forward, con_reverse = self._stage(
+            'scale', scale_key,
+            lambda: scale_branches(raw_forward, raw_reverse, branch_sinusoid, *branch_indexes, branch_dt, B_scale,
+                                   H_scale, groundf, groundr, integration_mode), recomputed)
+
+        def smooth():
+            smoothed = smooth_loop(H_forward, B_forward, H_reverse, B_reverse, window)
+            return resample_loop(*smoothed, grid_points) if grid_points else smoothed
+
+        H_forward_smoothed, B_forward_smoothed, H_reverse_smoothed, B_reverse_smoothed = self._stage(
+            'smooth', scale_key + (window, grid_points), smooth, recomputed)
+
+        refindex1, refindex2, refindex3 = refindexes
+        return BHLoopResult(
+            time=time_values, sinusoid_fit=sinusoid_fit, A0=A0, f0=f0, ph0=ph0, A_fit=A_fit, f_fit=f_fit,
+            ph_fit=ph_fit, scenario=scenario, t1=t1, t2=t2, t3=t3, refindex1=refindex1, refindex2=refindex2,
+            refindex3=refindex3, groundf=groundf, groundr=groundr, H_forward=H_forward, B_forward=B_forward,
+            H_reverse=H_reverse, B_reverse=B_reverse, con_forward=con_forward, con_reverse=con_reverse,
+            H_forward_smoothed=H_forward_smoothed, B_forward_smoothed=B_forward_smoothed,
+            H_reverse_smoothed=H_reverse_smoothed, B_reverse_smoothed=B_reverse_smoothed)
+
+
+# Tuning window with sliders for the scales, ground offsets and the moving average window.
+# The loop is recomputed by the session and redrawn shortly after the last slider move, in the Tk event loop.
+# While a background job is using the session, the window does not wait for it and tries again after retry ms.
+# parameters are the keyword arguments of TuningSession.compute; the final values are kept in this dictionary.
+def open_tuning_window(master, session, file_name, dt, parameters, delay=30, retry=100):
+    import tkinter as tk
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.figure import Figure
+
+    from .plotting import plot_smoothed_loop
+
+    window = tk.Toplevel(master) if master is not None else tk.Tk()
+    window.title('Tuning: ' + os.path.basename(file_name))
+    figure = Figure(figsize=(8, 5))
+    ax = figure.add_subplot()
+    canvas = FigureCanvasTkAgg(figure, master=window)
+    canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    status = tk.Label(window, text='')
+    status.pack()
+    sliders = {}
+    pending = [None]
+
+    # Slider ranges: 0 to twice the initial scales, ground offsets within 5% of the response range
+    def add_sliders():
+        pending[0] = None
+        loaded = session.load(file_name, blocking=False)
+        if loaded is None:
+            status.config(text='Waiting for the running job...')
+            pending[0] = window.after(retry, add_sliders)
+            return
+        response_values, _ = loaded[1]
+        ground_range = 0.05 * float(np.max(np.abs(response_values))) or 1.0
+        for name, low, high in (('B_scale', 0.0, 2.0 * (parameters.get('B_scale', 1.0) or 1.0)),
+                                ('H_scale', 0.0, 2.0 * (parameters.get('H_scale', 1.0) or 1.0)),
+                                ('groundf', -ground_range, ground_range),
+                                ('groundr', -ground_range, ground_range),
+                                ('window', 1, 51)):
+            variable = tk.DoubleVar(window, value=parameters.get(name, 3 if name == 'window' else 0.0))
+            resolution = 1 if name == 'window' else (high - low) / 1000.0
+            slider = tk.Scale(window, label=name, variable=variable, from_=low, to=high, resolution=resolution,
+                              orient=tk.HORIZONTAL, length=400)
+            slider.pack(fill=tk.X)
+            sliders[name] = variable
+            variable.trace_add('write', schedule)
+        redraw()
+
+    def redraw():
+        pending[0] = None
+        for name, variable in sliders.items():
+            parameters[name] = int(variable.get()) if name == 'window' else variable.get()
+        try:
+            computed = session.compute_timed(file_name, dt, blocking=False, **parameters)
+        except ValueError as error:
+            status.config(text=str(error))
+            return
+        if computed is None:
+            status.config(text='Waiting for the running job...')
+            pending[0] = window.after(retry, redraw)
+            return
+        result, recomputed, seconds = computed
+        ax.clear()
+        plot_smoothed_loop(ax, result)
+        canvas.draw_idle()
+        status.config(text='{:.1f} ms, recomputed: {}'.format(seconds * 1e3, ', '.join(recomputed) or 'nothing'))
+
+    # Only the last of quick slider moves is computed
+    def schedule(*args):
+        if pending[0] is not None:
+            window.after_cancel(pending[0])
+        pending[0] = window.after(delay, redraw)
+
+    add_sliders()
+    return window
@@ -0,0 +1,119 @@
+#
+# Digital BH-loop algorithm: vectorized detection of zero crossings and sinusoid vertices
+# Project repository on GitHub: https://github.com/DYK-Team/Digital_BH-loop_algorithm
+#
+# All zero crossings and vertex regions of the record are found in a few passes of array operations. The sign of
+# the sinusoid is tracked with hysteresis (a Schmitt trigger), so noise around zero does not produce false
+# crossings.
+#
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# Zero crossings and vertices of all half periods of the sinusoid
+@dataclass
+class Vertices:
+    rising: np.ndarray  # Indices of the zero crossings from negative to positive values
+    falling: np.ndarray  # Indices of the zero crossings from positive to negative values
+    positive: np.ndarray  # Average indices of the points near the positive vertices (one per positive half period)
+    negative: np.ndarray  # Average indices of the points near the negative vertices
+    amplitude: float  # Amplitude of the sinusoid used for the vertex levels
+
+
+# Starts and ends (exclusive) of the runs of True values in a boolean array
+def _runs(mask):
+    edges = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    if mask[0]:
+        edges = np.concatenate(([0], edges))
+    if mask[-1]:
+        edges = np.concatenate((edges, [len(mask)]))
+    return edges[::2], edges[1::2]
+
+
+# Detection of the zero crossings and vertices.
+# level: the vertex regions are the points above level * amplitude (or below -level * amplitude), as in the
+# original search of the vertex sets; hysteresis: fraction of the amplitude the signal must exceed to change sign;
+# clip_fraction: the signal is treated as clipped if it stays at its maximum or minimum value for longer than this
+# fraction of the average half period.
+# The amplitude is the median of the half period extremes, so single noise spikes do not move the vertex levels.
+def detect_vertices(sin_values, level=0.9, hysteresis=0.1, clip_fraction=0.25, allow_clipped=False):
+    y = np.asarray(sin_values, dtype=float)
+    N = len(y)
+    if N < 3:
+        raise ValueError('At least 3 points are needed to find the sinusoid vertices')
+    y_max, y_min = float(np.max(y)), float(np.min(y))
+    if not (y_max > 0 > y_min):
+        raise ValueError('The excitation is flat or does not change sign, so it has no vertices')
+
+    # Sign of the sinusoid with hysteresis: it changes only when the signal passes the opposite threshold.
+    # Only the points where the signal enters the region beyond one of the thresholds are needed.
+    threshold = hysteresis * min(y_max, -y_min)
+    above = y > threshold
+    below = y < -threshold
+    enter_above = np.flatnonzero(above[1:] & ~above[:-1]) + 1
+    enter_below = np.flatnonzero(below[1:] & ~below[:-1]) + 1
+    events = np.concatenate((enter_above, enter_below))
+    order = np.argsort(events, kind='stable')
+    events = events[order]
+    event_signs = np.concatenate((np.ones(len(enter_above), dtype=bool), np.zeros(len(enter_below), dtype=bool)))
+    event_signs = event_signs[order]
+    if above[0] or below[0]:
+        initial_sign = bool(above[0])
+    elif len(events) > 0:
+        initial_sign = bool(event_signs[0])
+    else:
+        raise ValueError('The excitation does not exceed the hysteresis threshold')
+    # The state after an event is its sign, so a flip is an event of the sign opposite to the previous event
+    changes = np.flatnonzero(event_signs != np.concatenate(([initial_sign], event_signs[:-1])))
+    flips = events[changes]
+    rising_mask = event_signs[changes]
+    if len(flips) == 0:
+        raise ValueError('The excitation does not change sign beyond the hysteresis threshold')
+
+    # Exact crossing: the last sign change of the signal before the state change
+    non_negative = y >= 0
+    sign_changes = np.flatnonzero(non_negative[1:] != non_negative[:-1]) + 1
+    crossings = sign_changes[np.searchsorted(sign_changes, flips, side='right') - 1]
+
+    # Polarity of every half period (half period 0 lies before the first crossing)
+    polarity = np.concatenate(([1 if initial_sign else -1], np.where(rising_mask, 1, -1)))
+    mean_half_period = float(np.mean(np.diff(crossings))) if len(crossings) > 1 else float(N)
+
+    # Clipping: the longest run of consecutive points at the maximum or minimum value
+    longest_run = max(int(np.max(end - start)) for start, end in (_runs(y >= y_max), _runs(y <= y_min)))
+    if longest_run > clip_fraction * mean_half_period and not allow_clipped:
+        raise ValueError('The excitation is clipped: it stays at its extreme value for {} points of a '
+                         '{:.0f}-point half period'.format(longest_run, mean_half_period))
+
+    # Extremes of the half periods. Only the complete half periods (between two crossings) are used for the
+    # amplitudes and vertices.
+    peaks = np.where(polarity > 0, np.maximum.reduceat(y, np.concatenate(([0], crossings))),
+                     -np.minimum.reduceat(y, np.concatenate(([0], crossings))))
+    complete = np.zeros(len(polarity), dtype=bool)
+    complete[1:-1] = True
+    if not np.any(complete):
+        raise ValueError('The record does not contain a complete half period of the excitation')
+
+    # Average indices of the vertex regions in each complete half period.
+    # The vertex level of each polarity is taken from the median of its half period extremes. The regions are
+    # handled as runs of consecutive points: a run from start to end - 1 has end - start points and the index sum
+    # (start + end - 1) * (end - start) / 2.
+    amplitudes = []
+    vertex_sets = []
+    for sign in (1, -1):
+        selected = complete & (polarity == sign)
+        A0 = float(np.median(peaks[selected])) if np.any(selected) else float(np.median(peaks[complete]))
+        start, end = _runs(y >= level * A0) if sign > 0 else _runs(y <= -level * A0)
+        half_period = np.searchsorted(crossings, start, side='right')
+        keep = selected[half_period]
+        start, end, half_period = start[keep], end[keep], half_period[keep]
+        counts = np.bincount(half_period, weights=end - start, minlength=len(polarity))
+        sums = np.bincount(half_period, weights=(start + end - 1) * (end - start) / 2.0, minlength=len(polarity))
+        found = counts > 0
+        amplitudes.append(A0)
+        vertex_sets.append(sums[found] / counts[found])
+
+    return Vertices(crossings[rising_mask], crossings[~rising_mask], vertex_sets[0], vertex_sets[1],
+                    0.5 * (amplitudes[0] + amplitudes[1]))